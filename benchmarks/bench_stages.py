@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+Micro-benchmarks of each processing stage on the test data and synthetic tiles
+
+Run them from the repository root with `pytest benchmarks`, see the README to save and compare baselines
+"""
+
+from unittest import mock
+
+import pytest
+
+import cool
+import cool_prescreen
+import cool_store
+
+from .conftest import model_results
+
+
+def bench_convert_to_cv2_image(measure, tiles):
+    """decode one tile"""
+    measure(cool.convert_to_cv2_image, tiles[0])
+
+
+def bench_build_mosaic_image(measure, tiles):
+    """decode and assemble the tiles of a mosaic into a reused buffer"""
+    buffer = cool.acquire_mosaic_buffer()
+
+    measure(cool.build_mosaic_image, tiles, 1, 2, None, buffer=buffer, rgb=True)
+
+
+@pytest.mark.parametrize("check", ["bytes", "uniform", "edges"])
+def bench_prescreen(measure, tiles, mosaic, check):
+    """screen a mosaic with each prescreen check"""
+    measure(cool_prescreen.screen, tiles, mosaic, cool_prescreen.get_checks(check))
+
+
+def bench_detect_towers(measure, mosaic):
+    """run the model on a mosaic, skipped without the weights"""
+    if not cool.get_model_weight_path().is_file():
+        pytest.skip("the model weights are not available")
+
+    cool.detect_towers(mosaic, rgb=True)
+
+    measure(cool.detect_towers, mosaic, rgb=True)
+
+
+@pytest.mark.parametrize("detections", [1, 25])
+def bench_locate_results(measure, detections):
+    """georeference the detections of one mosaic"""
+    measure(cool.locate_results, model_results(detections), 198263, 394029)
+
+
+def bench_locate_results_batch(measure):
+    """georeference the detections of a batch of mosaics at once"""
+    results = [model_results(10, seed) for seed in range(8)]
+    keys = [(198263 + 2 * seed, 394029) for seed in range(8)]
+
+    measure(cool.locate_results_batch, results, keys)
+
+
+@pytest.mark.parametrize("detections", [25, 2500])
+def bench_copy_results(measure, detections):
+    """format the detections as csv for COPY"""
+    results_df = cool.locate_results(model_results(detections), 198263, 394029)
+    #: the cursor drains the stream like the database would so only the csv formatting is measured
+    cursor = mock.Mock(execute=lambda sql, stream: stream.read())
+    conn = mock.Mock(connection=mock.Mock(cursor=mock.Mock(return_value=cursor)))
+
+    measure(cool.copy_results, results_df, conn)
+
+
+def bench_result_writer_add(measure):
+    """buffer a row and its detections in the result writer"""
+    results_df = cool.locate_results(model_results(10), 198263, 394029)
+    writer = cool.ResultWriter(max_rows=10**9, max_seconds=3600)
+
+    try:
+        measure(writer.add, 198263, 394029, results_df)
+    finally:
+        with mock.patch("cool.save_processed_rows"):
+            writer.close()
+
+
+def bench_tile_store_get(measure, tmp_path, tiles):
+    """read a tile from a tile store of 1000 tiles"""
+    store = cool_store.TileStore(tmp_path)
+
+    for col in range(1000):
+        store.put(20, col, 1, tiles[col % 4])
+
+    try:
+        measure(store.get, 20, 500, 1)
+    finally:
+        store.close()
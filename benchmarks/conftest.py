@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+Fixtures shared by the stage benchmarks
+"""
+
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+
+root = Path(__file__).parent.parent / "test-data"
+
+
+def _encode(image):
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+@pytest.fixture(params=["test-data", "synthetic"])
+def tiles(request):
+    """the jpeg bytes of the four tiles of a mosaic, either real imagery or random noise that compresses poorly"""
+    if request.param == "test-data":
+        return [(root / f"{name}.jpg").read_bytes() for name in ["1_2", "1_3", "2_2", "2_3"]]
+
+    rng = np.random.default_rng(0)
+
+    return [_encode(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)) for _ in range(4)]
+
+
+@pytest.fixture
+def mosaic():
+    """the rgb test mosaic"""
+    return cv2.cvtColor(cv2.imread(str(root / "1_2_mosaic.jpg")), cv2.COLOR_BGR2RGB)
+
+
+def model_results(detections, seed=0):
+    """build an object that looks like a yolov5 result with random boxes
+
+    Args:
+        detections (int): the number of boxes
+        seed (int): the random seed (optional)
+
+    Returns:
+        SimpleNamespace: an object with the `pandas().xyxy[0]` dataframe of a yolov5 result
+    """
+    rng = np.random.default_rng(seed)
+    corners = rng.uniform(0, 480, (detections, 2))
+    sizes = rng.uniform(8, 32, (detections, 2))
+
+    results_df = pd.DataFrame(np.hstack([corners, corners + sizes]), columns=["xmin", "ymin", "xmax", "ymax"])
+    results_df["confidence"] = rng.uniform(0.007, 1, detections)
+    results_df["class"] = 0
+    results_df["name"] = "tower"
+
+    #: like yolov5, every call to pandas builds new dataframes so the caller can change them
+    return SimpleNamespace(pandas=lambda: SimpleNamespace(xyxy=[results_df.copy()]))
+
+
+@pytest.fixture
+def measure(benchmark):
+    """benchmark a function and record the peak memory it allocates in the benchmark's extra info
+
+    the peak is measured in a separate call so tracing does not slow down the timed rounds
+    """
+
+    def run(function, *args, **kwargs):
+        tracemalloc.start()
+
+        try:
+            function(*args, **kwargs)
+            benchmark.extra_info["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+
+        return benchmark(function, *args, **kwargs)
+
+    return run
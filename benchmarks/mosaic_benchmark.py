@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+Benchmark the mosaic layouts, the `MOSAIC_GRID` and `MOSAIC_OVERLAP` settings
+
+For each layout it reports the index rows and downloaded tiles for the area of a 2x2 mosaic, the time to assemble
+and, when the weights are available, detect a mosaic, the area processed per second, and the towers split by a
+mosaic edge or seen whole by more than one mosaic. The towers are random boxes or the detections in a csv with the
+`centroid_x_3857` and `centroid_y_3857` columns of `cooling_tower_results`
+
+Usage:
+    mosaic_benchmark.py [--layouts=list --mosaics=count --towers=file --random-towers=count --tower-pixels=px]
+
+Options:
+    --layouts=list              The comma separated grid:overlap layouts [default: 2:0,2:32,3:0,3:32,4:0,4:64]
+    --mosaics=count             The number of mosaics timed for each layout [default: 20]
+    --towers=file               A csv of detections to count the edge splits of instead of random towers
+    --random-towers=count       The number of random towers [default: 100000]
+    --tower-pixels=px           The width and height of a tower in pixels [default: 40]
+Examples:
+    python -m benchmarks.mosaic_benchmark
+    python -m benchmarks.mosaic_benchmark --layouts=2:0,3:64 --towers=./cooling_tower_results.csv
+"""
+
+import csv
+import os
+from itertools import cycle, islice
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+from docopt import docopt
+
+import cool
+
+root = Path(__file__).parent.parent / "test-data"
+#: the upper left tile of the index, the mosaics start every grid tiles from here
+ORIGIN = (192093, 389243)
+
+
+def count_edge_splits(x_px, y_px, tower_pixels, layout, origin=ORIGIN):
+    """count the towers that no mosaic holds whole and the towers more than one mosaic holds whole
+
+    Args:
+        x_px (np.ndarray): the centroid column of each tower in pixels from the left edge of the world
+        y_px (np.ndarray): the centroid row of each tower in pixels from the top edge of the world
+        tower_pixels (float): the width and height of the towers
+        layout (SimpleNamespace): the mosaic layout, see `cool.get_mosaic_layout`
+        origin (tuple): the column and row of the first mosaic (optional)
+
+    Returns:
+        tuple: the number of split towers and the number of duplicated towers
+    """
+    step = layout.grid * cool.TILE_SIZE
+
+    def holding(centers, start):
+        low = centers - tower_pixels / 2 - start * cool.TILE_SIZE
+        high = centers + tower_pixels / 2 - start * cool.TILE_SIZE
+
+        #: mosaic k holds the tower along this axis when k * step <= low and high <= k * step + size
+        return np.maximum(np.floor(low / step) - np.ceil((high - layout.size) / step) + 1, 0)
+
+    mosaics = holding(np.asarray(x_px), origin[0]) * holding(np.asarray(y_px), origin[1])
+
+    return int(np.count_nonzero(mosaics == 0)), int(np.count_nonzero(mosaics > 1))
+
+
+def read_towers(path):
+    """read the tower centroids from a csv and convert them to world pixels at zoom 20
+
+    Args:
+        path (Path): a csv with `centroid_x_3857` and `centroid_y_3857` columns
+
+    Returns:
+        tuple: the np.ndarray x and y pixels
+    """
+    with open(path, newline="", encoding="utf-8") as towers:
+        rows = [(float(row["centroid_x_3857"]), float(row["centroid_y_3857"])) for row in csv.DictReader(towers)]
+
+    x, y = np.array(rows, dtype=np.float64).reshape(-1, 2).T
+    resolution = cool.meters_per_pixel()
+
+    return (x + cool.WEB_MERCATOR_HALF_WIDTH) / resolution, (cool.WEB_MERCATOR_HALF_WIDTH - y) / resolution
+
+
+def random_towers(count, seed=0):
+    """spread towers over a 2000 by 2000 tile area from the index origin
+
+    Args:
+        count (int): the number of towers
+        seed (int): the random seed (optional)
+
+    Returns:
+        tuple: the np.ndarray x and y pixels
+    """
+    rng = np.random.default_rng(seed)
+    span = 2000 * cool.TILE_SIZE
+
+    return (
+        ORIGIN[0] * cool.TILE_SIZE + rng.uniform(0, span, count),
+        ORIGIN[1] * cool.TILE_SIZE + rng.uniform(0, span, count),
+    )
+
+
+def time_layout(layout, mosaics, tiles, detect):
+    """the seconds to assemble and detect a mosaic of a layout
+
+    Args:
+        layout (SimpleNamespace): the mosaic layout
+        mosaics (int): the number of mosaics to time
+        tiles (list): tile bytes to fill the mosaics with
+        detect (bool): run the model on the mosaics
+
+    Returns:
+        tuple: the mean assemble and detect seconds, detect is None when the model was not run
+    """
+    tiles = list(islice(cycle(tiles), layout.tiles**2))
+    buffer = cool.acquire_mosaic_buffer(layout)
+    assemble = detection = 0
+
+    for _ in range(mosaics):
+        start = perf_counter()
+        mosaic = cool.assemble_mosaic(tiles, buffer, rgb=True, layout=layout)
+        assemble += perf_counter() - start
+
+        if detect:
+            start = perf_counter()
+            cool.detect_towers(mosaic, rgb=True)
+            detection += perf_counter() - start
+
+    return assemble / mosaics, detection / mosaics if detect else None
+
+
+def main():
+    """run the benchmark and print the results"""
+    args = docopt(__doc__, version="1.0")  # type: ignore
+
+    layouts = [cool.get_mosaic_layout(*map(int, item.split(":"))) for item in args["--layouts"].split(",")]
+    mosaics = int(args["--mosaics"])
+    tower_pixels = float(args["--tower-pixels"])
+    tiles = [(root / f"{name}.jpg").read_bytes() for name in ["1_2", "1_3", "2_2", "2_3"]]
+
+    if args["--towers"]:
+        x_px, y_px = read_towers(args["--towers"])
+    else:
+        x_px, y_px = random_towers(int(args["--random-towers"]))
+
+    detect = cool.get_model_weight_path().is_file()
+
+    if detect:
+        cool._get_model()  # pylint: disable=protected-access
+    else:
+        print("the model weights are not available, only the mosaics are timed")
+
+    print(f"{len(x_px):,} towers of {tower_pixels:.0f} pixels, {mosaics} mosaics for each layout")
+    print(
+        f"{'layout':>8} {'input':>6} {'rows':>6} {'tiles':>6} {'mosaic':>9} {'detect':>9} {'tiles/s':>8} "
+        f"{'split':>7} {'dupes':>7}"
+    )
+
+    for layout in layouts:
+        #: the model input size is read from the environment like a task would
+        os.environ["MOSAIC_GRID"] = str(layout.grid)
+        os.environ["MOSAIC_OVERLAP"] = str(layout.overlap)
+
+        assemble, detection = time_layout(layout, mosaics, tiles, detect)
+        split, duplicated = count_edge_splits(x_px, y_px, tower_pixels, layout)
+        #: the index rows and downloads for the area of one 2x2 mosaic
+        rows = 4 / layout.grid**2
+        downloads = rows * layout.tiles**2
+        seconds = assemble + (detection or 0)
+
+        print(
+            f"{layout.grid}x{layout.grid}+{layout.overlap:<3} {cool.get_inference_size(layout):>6} {rows:>6.2f} "
+            f"{downloads:>6.2f} {cool.format_time(assemble):>9} "
+            f"{cool.format_time(detection) if detect else '-':>9} {layout.grid**2 / seconds:>8,.0f} "
+            f"{split / len(x_px):>7.2%} {duplicated / len(x_px):>7.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,33 +4,82 @@
 DHHS Cooling Tower object detection
 Cooling tower module containing methods
 """
+import io
 import json
 import logging
 import math
-from os import environ, getenv
+import multiprocessing
+import re
+import signal
+import subprocess
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import partial
+from os import cpu_count, environ, getenv
 from pathlib import Path
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
 from time import perf_counter
 from types import SimpleNamespace
 
-import cv2
-import google.cloud.logging
-import mercantile
 import numpy as np
-import pyproj
 import requests
-import sqlalchemy
-import torch
-from google.cloud.sql.connector import Connector, IPTypes
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+import cool_dedupe
+import cool_metrics
+import cool_prescreen
+import cool_queue
+import cool_spool
+import cool_store
+
 QUAD_WORD = None
 MODEL = None
 SECRETS = None
+RESULTS_TABLE = "cooling_tower_results"
+#: the database drivers that can stream the results with COPY FROM STDIN, the others insert them
+COPY_DRIVERS = ("pg8000", "psycopg2", "psycopg")
+#: the tower scout weights for each inference backend, selected with the INFERENCE_BACKEND environment variable
+MODEL_WEIGHTS = {
+    "pytorch": "xl_250_best.pt",
+    "onnx": "xl_250_best.onnx",
+    "torchscript": "xl_250_best.torchscript",
+    #: created from the onnx weights with `cool_cli.py quantize-model`
+    "onnx-int8": "xl_250_best.int8.onnx",
+}
+#: the tile service, override with the TILE_URL environment variable e.g. for a local tile server
+TILE_URL = "https://discover.agrc.utah.gov/login/path/{quad_word}/tiles/utah"
+#: half the width of the web mercator (3857) world in meters
+WEB_MERCATOR_HALF_WIDTH = math.pi * 6378137.0
+#: the width and height of a tile in pixels
+TILE_SIZE = 256
+#: the model input pixels for each mosaic pixel, yolov5 scales the 512 pixel 2x2 mosaics up to its 640 pixel input
+INFERENCE_SCALE = 640 / 512
+SESSION = None
+TILE_EXECUTOR = None
+TILE_STORE = None
+DECODE_EXECUTOR = None
+#: reusable mosaic buffers shared by the mosaic and detect stages
+_MOSAIC_BUFFERS = Queue()
+_SESSION_LOCK = Lock()
+#: the metric for the time spent in each stage, by the stage name in the logs
+STAGE_METRICS = {
+    "download": "download",
+    "mosaic": "mosaic",
+    "towerscout": "detect",
+    "georeference": "locate",
+    "finish": "row",
+}
+#: marker placed on a pipeline queue after the last row
+_STAGE_DONE = object()
 PROJECT_ID = getenv("PROJECT_ID")
 CONNECTION_NAME = getenv("CLOUDSQL_CONNECTION_STRING") or ""
-# initialize Cloud SQL Python Connector object
-connector = Connector()
+#: the Cloud SQL Python Connector and database engine are created on first use by `_get_pool`
+CONNECTOR = None
+POOL = None
+LOGGING_CLIENT = None
 
 
 def _get_connection():
@@ -42,7 +91,9 @@ def _get_connection():
     Returns:
         pg8000.dbapi.Connection: A pg8000 connection object
     """
-    conn = connector.connect(
+    from google.cloud.sql.connector import IPTypes  # pylint: disable=import-outside-toplevel
+
+    conn = CONNECTOR.connect(
         CONNECTION_NAME,  # Cloud SQL Instance Connection Name
         "pg8000",
         user="cloud-run-sa@ut-dts-agrc-dhhs-towers-dev.iam",
@@ -54,17 +105,75 @@ def _get_connection():
     return conn
 
 
-if "PY_ENV" in environ and environ["PY_ENV"] == "production":
+def _is_production():
+    """check if the code is running in the production environment
+
+    Args:
+        None
+
+    Returns:
+        bool: True when `PY_ENV` is production
+    """
+    return "PY_ENV" in environ and environ["PY_ENV"] == "production"
+
+
+def setup_logging():
+    """send the logs to cloud logging in production
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    global LOGGING_CLIENT  # pylint: disable=global-statement
+
+    if LOGGING_CLIENT is not None or not _is_production():
+        return
+
+    import google.cloud.logging  # pylint: disable=import-outside-toplevel
+
     logging.info("setting up production environment")
     LOGGING_CLIENT = google.cloud.logging.Client()
-    POOL = sqlalchemy.create_engine(
-        "postgresql+pg8000://",
-        creator=_get_connection,
-    )
-
     LOGGING_CLIENT.setup_logging()
 
 
+def _get_pool():
+    """the database engine shared by the task, created on first use
+
+    `DATABASE_URL` e.g. a local postgres database is used instead of cloud sql when it is set
+
+    Args:
+        None
+
+    Returns:
+        sqlalchemy.engine.Engine: the engine connecting to cloud sql
+    """
+    global CONNECTOR, POOL  # pylint: disable=global-statement
+
+    if POOL is None:
+        with _SESSION_LOCK:
+            if POOL is None and getenv("DATABASE_URL"):
+                import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+                POOL = sqlalchemy.create_engine(getenv("DATABASE_URL"))
+
+            if POOL is None:
+                if not _is_production():
+                    raise RuntimeError("set DATABASE_URL, the cloud sql database is only available in production")
+
+                import sqlalchemy  # pylint: disable=import-outside-toplevel
+                from google.cloud.sql.connector import Connector  # pylint: disable=import-outside-toplevel
+
+                CONNECTOR = Connector()
+                POOL = sqlalchemy.create_engine(
+                    "postgresql+pg8000://",
+                    creator=_get_connection,
+                )
+
+    return POOL
+
+
 def _get_secrets():
     """load secrets for use in the program
 
@@ -101,377 +210,1905 @@ def process_all_tiles(job_name, task_index, task_size, skip, take):
     Returns:
         None
     """
+    setup_logging()
     task_start = perf_counter()
 
-    #: calculate the number of rows to skip/take from the database table
-    #: if nonzero numbers are provided as environment variables, they will be used
-    #: otherwise, we assume a static job_size environment variable is passed in and
-    #: calculate skip/take based on the task_index
-    concurrent_tasks = int(getenv("CONCURRENT_TASKS") or 35)
-    if skip in (0, None) and take in (0, None):
-        skip = (task_index % concurrent_tasks) * task_size
-        take = task_size
+    cool_metrics.METRICS.labels.update({"job": job_name, "task": task_index})
+    reporter = cool_metrics.Reporter()
+
+    #: optionally claim the rows from a local work queue that is synced back to the database in the background
+    queue = syncer = None
+    if getenv("WORK_QUEUE"):
+        queue = cool_queue.WorkQueue(getenv("WORK_QUEUE"))
+        syncer = cool_queue.Syncer(queue, update_index_rows, float(getenv("WORK_QUEUE_SYNC_SECONDS") or 60))
+
+    #: optionally collect the results in a per task table that is merged into the results table at the end
+    staging_table = None
+    if getenv("STAGE_RESULTS", "").lower() in ("1", "true", "yes"):
+        staging_table = create_staging_table(f"{job_name}-{task_index}")
+
+    #: optionally write every save to a local spool that is loaded into the database in the background
+    spool = None
+    if getenv("PERSIST", "").lower() == "spool":
+        spool = cool_spool.Spool(
+            Path(getenv("SPOOL_DIR") or "spool") / f"{job_name}-{task_index}",
+            partial(save_processed_rows, table=staging_table or RESULTS_TABLE, queue=queue),
+        )
 
-    logging.info("job: %s task: %i start %s", job_name, task_index, {"skip": skip, "take": take})
-    rows = get_rows(skip, take)
+    #: optionally run each row as a block of mosaics that are only detected at zoom 20 where a coarse pass found towers
+    levels = get_cascade_levels()
 
-    for row in rows:
-        logging.info("%i, %i start", row.col_num, row.row_num)
+    #: optionally drop the detections that repeat a detection of a neighboring mosaic before they are saved
+    dedupe = None
+    if getenv("DEDUPE", "").lower() in ("1", "true", "yes"):
+        layout = get_mosaic_layout()
+        dedupe = cool_dedupe.DuplicateFilter(meters_per_pixel(), layout.size, 2 * layout.grid * 2**levels)
+
+    #: the cascade filters the detections of each zoom 20 mosaic of a row itself
+    writer = ResultWriter(
+        table=staging_table or RESULTS_TABLE, spool=spool, queue=queue, dedupe=None if levels else dedupe
+    )
+
+    #: if nonzero skip/take numbers are provided as environment variables, they will be used unless there is a queue
+    #: otherwise, the task claims small chunks of rows with a lease until it has processed
+    #: the static job_size environment variable rows or there are no rows left
+    if queue is not None or (skip in (0, None) and take in (0, None)):
+        worker = f"{job_name}-{task_index}"
+        chunk_size = int(getenv("CLAIM_SIZE") or 10)
+        lease_seconds = float(getenv("LEASE_SECONDS") or 600)
+        claim_seconds = float(getenv("CLAIM_SECONDS") or 60)
+        progress_seconds = float(getenv("PROGRESS_SECONDS") or 300)
+
+        logging.info(
+            "job: %s task: %i start %s",
+            job_name,
+            task_index,
+            {"claim": chunk_size, "claim_seconds": claim_seconds, "limit": task_size or None},
+        )
+        rows = iter_claimed_rows(
+            worker,
+            chunk_size,
+            lease_seconds,
+            task_size or None,
+            claim_seconds,
+            progress_seconds,
+            queue,
+            writer.completed,
+        )
+    else:
+        logging.info("job: %s task: %i start %s", job_name, task_index, {"skip": skip, "take": take})
+        rows = get_rows(skip, take)
+
+    #: cloud run sends a SIGTERM before killing a task so buffered rows are flushed on the way out
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+    process_workers = int(getenv("PROCESS_WORKERS") or 1)
+
+    try:
+        if levels:
+            process_rows_cascade(rows, writer, levels, dedupe)
+        elif process_workers > 1:
+            process_rows_forked(rows, process_workers, writer)
+        elif getenv("PIPELINE", "").lower() in ("1", "true", "yes"):
+            process_rows_pipelined(rows, get_pipeline_workers(), writer)
+        else:
+            process_rows(rows, writer)
+    finally:
+        writer.close()
+
+        if staging_table:
+            merge_staging_table(staging_table)
+
+        if syncer is not None:
+            syncer.close()
+
+        _close_tile_store()
+        reporter.close()
+
+    logging.info("job: %s task: %i finished: %s", job_name, task_index, format_time(perf_counter() - task_start))
+
+
+def _exit_on_sigterm(signum, frame):  # pylint: disable=unused-argument
+    """turn a SIGTERM into a SystemExit so `finally` blocks run"""
+    logging.warning("received SIGTERM, shutting down")
+
+    raise SystemExit(128 + signum)
+
+
+def _log_stage(col, row, stage, seconds, batch=None):
+    """log the time a row spent in a stage and add it to the stage latency histogram
+
+    Args:
+        col (int): the column of the WMTS index for the tile of interest (top-left tile)
+        row (int): the row of the WMTS index for the tile of interest (top-left tile)
+        stage (str): the stage name used in the logs, one of `STAGE_METRICS`
+        seconds (float): the time spent in the stage
+        batch (int): the number of rows that shared the time when the stage works on batches (optional)
+
+    Returns:
+        None
+    """
+    if batch:
+        cool_metrics.observe(f"{STAGE_METRICS[stage]}_seconds", seconds / batch)
+        logging.info("%i, %i %s: %s batch of %i", col, row, stage, format_time(seconds), batch)
+
+        return
+
+    cool_metrics.observe(f"{STAGE_METRICS[stage]}_seconds", seconds)
+    logging.info("%i, %i %s: %s", col, row, stage, format_time(seconds))
+
+
+def process_rows(rows, writer):
+    """run the full processing chain on each row, one stage after another
+
+    Args:
+        rows (iterator): index rows with `col_num` and `row_num` attributes
+        writer (ResultWriter): saves the results and marks the rows as processed
 
+    Returns:
+        None
+    """
+    #: download the tiles for the next rows while the current row is being processed
+    downloads = prefetch_tiles(rows, int(getenv("PREFETCH_ROWS") or 0))
+    #: every row reuses the same mosaic buffer
+    buffer = acquire_mosaic_buffer()
+
+    while True:
         row_start = perf_counter()
-        tiles = download_tiles(row.col_num, row.row_num, None)
-        logging.info("%i, %i download: %s", row.col_num, row.row_num, format_time(perf_counter() - row_start))
+        row, tiles = next(downloads, (None, None))
+
+        if row is None:
+            break
+
+        logging.info("%i, %i start", row.col_num, row.row_num)
+        _log_stage(row.col_num, row.row_num, "download", perf_counter() - row_start)
 
         mosaic_start = perf_counter()
-        mosaic_image = build_mosaic_image(tiles, row.col_num, row.row_num, None)
-        logging.info("%i, %i mosaic: %s", row.col_num, row.row_num, format_time(perf_counter() - mosaic_start))
+        mosaic_image = build_mosaic_image(tiles, row.col_num, row.row_num, None, buffer=buffer, rgb=True)
+        _log_stage(row.col_num, row.row_num, "mosaic", perf_counter() - mosaic_start)
+
+        if prescreen_mosaic(tiles, mosaic_image, row.col_num, row.row_num):
+            writer.add(row.col_num, row.row_num)
+            _log_stage(row.col_num, row.row_num, "finish", perf_counter() - row_start)
+
+            continue
 
         result_start = perf_counter()
-        results = detect_towers(mosaic_image)
-        logging.info("%i, %i towerscout: %s", row.col_num, row.row_num, format_time(perf_counter() - result_start))
+        results = detect_towers(mosaic_image, rgb=True)
+        _log_stage(row.col_num, row.row_num, "towerscout", perf_counter() - result_start)
 
         if not results:
-            logging.info(
-                "%i, %i finish: %s",
-                row.col_num,
-                row.row_num,
-                format_time(perf_counter() - row_start),
-            )
+            _log_stage(row.col_num, row.row_num, "finish", perf_counter() - row_start)
 
             continue
 
         locate_start = perf_counter()
         results_df = locate_results(results, row.col_num, row.row_num)
-        logging.info("%i, %i georeference: %s", row.col_num, row.row_num, format_time(perf_counter() - locate_start))
+        _log_stage(row.col_num, row.row_num, "georeference", perf_counter() - locate_start)
 
-        if len(results_df.index) == 0:
-            logging.debug("no results to upload, updating the index")
+        logging.debug("buffering %i results for col: %i row: %i", len(results_df.index), row.col_num, row.row_num)
 
-            update_index(row.col_num, row.row_num)
+        writer.add(row.col_num, row.row_num, results_df)
 
-            logging.info(
-                "%i, %i finish: %s",
-                row.col_num,
-                row.row_num,
-                format_time(perf_counter() - row_start),
-            )
+        _log_stage(row.col_num, row.row_num, "finish", perf_counter() - row_start)
 
-            continue
 
-        logging.debug("appending results for col: %i row: %i", row.col_num, row.row_num)
+def process_rows_cascade(rows, writer, levels, dedupe=None):
+    """run the zoom cascade on each row, a coarse pass over the row's block then zoom 20 where it found towers
 
-        append_start = perf_counter()
-        append_status = append_results(results_df)
-        logging.info(
-            "%i, %i saving %i: %s",
-            row.col_num,
-            row.row_num,
-            len(results_df.index),
-            format_time(perf_counter() - append_start),
-        )
+    each index row is the top-left of a block of 2**levels by 2**levels zoom 20 mosaics. the model runs once on
+    a coarse mosaic of the whole block and the zoom 20 mosaics are only downloaded and detected where a coarse
+    detection is at least `CASCADE_CONFIDENCE`. the row is marked processed with the zoom 20 detections
+
+    Args:
+        rows (iterator): index rows with `col_num` and `row_num` attributes
+        writer (ResultWriter): saves the results and marks the rows as processed
+        levels (int): the zoom levels between the coarse and the zoom 20 mosaics, see `get_cascade_levels`
+        dedupe (cool_dedupe.DuplicateFilter): drops the detections already kept from a neighboring mosaic (optional)
+
+    Returns:
+        None
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    layout = get_mosaic_layout()
+    confidence = float(getenv("CASCADE_CONFIDENCE") or 0.05)
+    margin = float(getenv("CASCADE_MARGIN") or 16)
+    #: every zoom 20 mosaic reuses the same mosaic buffer
+    buffer = acquire_mosaic_buffer(layout)
+
+    for row in rows:
+        row_start = perf_counter()
+        col_num, row_num = int(row.col_num), int(row.row_num)
+        logging.info("%i, %i start", col_num, row_num)
+
+        coarse_df = detect_coarse(col_num, row_num, levels, layout)
 
-        if append_status != "SUCCESS":
-            logging.warning("append unsuccessful for col: %i row: %i, skipping index update", row.col_num, row.row_num)
+        if coarse_df is None:
+            _log_stage(col_num, row_num, "finish", perf_counter() - row_start)
 
             continue
 
-        update_index(row.col_num, row.row_num)
+        candidates = cascade_candidates(coarse_df, col_num, row_num, levels, layout, confidence, margin)
+        cool_metrics.increment("cascade_refined", len(candidates))
+        cool_metrics.increment("cascade_skipped", 4**levels - len(candidates))
+        logging.info("%i, %i cascade: refining %i of %i mosaics", col_num, row_num, len(candidates), 4**levels)
 
-        logging.info(
-            "%i, %i finish: %s",
-            row.col_num,
-            row.row_num,
-            format_time(perf_counter() - row_start),
-        )
+        located = []
+        for fine_col, fine_row in candidates:
+            results_df = detect_fine(fine_col, fine_row, layout, buffer)
 
-    logging.info("job: %s task: %i finished: %s", job_name, task_index, format_time(perf_counter() - task_start))
+            #: the row stays unprocessed when any of its imagery is missing, like a row without tiles
+            if results_df is None:
+                break
 
+            located.append((fine_col, fine_row, results_df))
+        else:
+            frames = []
+            for fine_col, fine_row, results_df in located:
+                if dedupe is not None:
+                    results_df = dedupe.filter(fine_col, fine_row, results_df)
 
-def convert_to_cv2_image(image):
-    """convert image (bytes) to a cv2 image object
+                if results_df is not None and not results_df.empty:
+                    frames.append(results_df)
+
+            writer.add(col_num, row_num, pd.concat(frames, ignore_index=True) if frames else None)
+
+        _log_stage(col_num, row_num, "finish", perf_counter() - row_start)
+
+
+def detect_coarse(col, row, levels, layout=None):
+    """detect towers on the coarse mosaic of the block of zoom 20 mosaics of an index row
 
     Args:
-        image (bytes): The image (bytes) to convert
+        col (int): the zoom 20 column of the top-left tile of the block
+        row (int): the zoom 20 row of the top-left tile of the block
+        levels (int): the zoom levels between the coarse and the zoom 20 mosaics
+        layout (SimpleNamespace): the layout of the zoom 20 mosaics, see `get_mosaic_layout` (optional)
 
     Returns:
-        cv2.Image: A cv2 image object
+        dataframe: the detections in coarse mosaic pixels, None when the imagery is missing
     """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
 
-    return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), 1)  # 1 means flags=cv2.IMREAD_COLOR
+    coarse = get_coarse_layout(col, row, levels, layout)
 
+    start = perf_counter()
+    tiles = download_tiles(col >> levels, row >> levels, None, layout=coarse, zoom=20 - levels)
+    _log_stage(col, row, "download", perf_counter() - start)
 
-def reorder_colors_to_rgb(image):
-    """reorders np.ndarray image object from BGR to RGB
+    buffer = acquire_mosaic_buffer(coarse)
 
-    Args:
-        image (np.ndarray): The image to reorder colors
+    try:
+        start = perf_counter()
+        mosaic_image = build_mosaic_image(tiles, col, row, None, buffer=buffer, rgb=True, layout=coarse)
+        _log_stage(col, row, "mosaic", perf_counter() - start)
 
-    Returns:
-        np.ndarray: The image with reordered colors
-    """
+        if mosaic_image is None:
+            return None
 
-    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if prescreen_mosaic(tiles, mosaic_image, col, row):
+            return pd.DataFrame(columns=["xmin", "ymin", "xmax", "ymax", "confidence"])
 
+        start = perf_counter()
+        results = detect_towers(mosaic_image, rgb=True, layout=coarse)
+        _log_stage(col, row, "towerscout", perf_counter() - start)
+    finally:
+        release_mosaic_buffer(buffer)
 
-def get_rows(skip, take):
-    """grab rows to process from the indices table
+    return results.pandas().xyxy[0]
+
+
+def detect_fine(col, row, layout=None, buffer=None):
+    """detect and locate the towers on a zoom 20 mosaic
 
     Args:
-        skip (string): the number of leading rows to skip
-        take (string): the number of rows to get form the table
+        col (int): the column of the top-left tile of the mosaic
+        row (int): the row of the top-left tile of the mosaic
+        layout (SimpleNamespace): the mosaic layout, see `get_mosaic_layout` (optional)
+        buffer (np.ndarray): a reusable array to build the mosaic in, see `acquire_mosaic_buffer` (optional)
 
     Returns:
-        rows (iterator): a row iterator
-    """
-    #: create sql query with skip/take for unprocessed rows
-    #: order by row, col ascending to ensure consistent processing order
-    sql = sqlalchemy.text(
-        f"""
-    SELECT * FROM images_within_habitat
-    WHERE processed = false
-    ORDER BY row_num, col_num
-    LIMIT {take} OFFSET {skip}
+        dataframe: the located detections, None when the imagery is missing
     """
-    )
+    start = perf_counter()
+    tiles = download_tiles(col, row, None, layout=layout)
+    _log_stage(col, row, "download", perf_counter() - start)
 
-    task_start = perf_counter()
+    start = perf_counter()
+    mosaic_image = build_mosaic_image(tiles, col, row, None, buffer=buffer, rgb=True, layout=layout)
+    _log_stage(col, row, "mosaic", perf_counter() - start)
 
-    #: perform query
-    with POOL.connect() as conn:
-        rows = conn.execute(sql).fetchall()
-        conn.commit()
+    if mosaic_image is None:
+        return None
 
-        logging.info("get rows query: %s", format_time(perf_counter() - task_start))
+    start = perf_counter()
+    results = detect_towers(mosaic_image, rgb=True, layout=layout)
+    _log_stage(col, row, "towerscout", perf_counter() - start)
+
+    start = perf_counter()
+    results_df = locate_results(results, col, row)
+    _log_stage(col, row, "georeference", perf_counter() - start)
 
-        return rows
+    return results_df
 
 
-def _get_retry_session():
-    """create a requests session that has a retry built into it
+def cascade_candidates(results_df, col, row, levels, layout=None, confidence=0.05, margin=16):
+    """find the zoom 20 mosaics of a block that hold a coarse detection
 
     Args:
-        None
-
-    Raises:
-        error: The final error that causes worker_method to fail after 3 retries
+        results_df (dataframe): the coarse detections in coarse mosaic pixels from `detect_coarse`
+        col (int): the zoom 20 column of the top-left tile of the block
+        row (int): the zoom 20 row of the top-left tile of the block
+        levels (int): the zoom levels between the coarse and the zoom 20 mosaics
+        layout (SimpleNamespace): the layout of the zoom 20 mosaics, see `get_mosaic_layout` (optional)
+        confidence (float): the lowest confidence of a coarse detection that is refined (optional)
+        margin (float): the zoom 20 pixels added around the coarse detections (optional)
 
     Returns:
-        session: a new session
+        list: the (col, row) of the zoom 20 mosaics to detect in processing order
     """
-    retries = 3
-    backoff_factor = 0.3
-    status_forcelist = (500, 502, 504)
-
-    new_session = requests.Session()
-
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=status_forcelist,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    new_session.mount("https://", adapter)
+    layout = layout or get_mosaic_layout()
+    scale = 2**levels
+    step = layout.grid * TILE_SIZE
+    boxes = results_df.loc[results_df["confidence"] >= confidence, ["xmin", "ymin", "xmax", "ymax"]]
+    candidates = set()
+
+    for x_min, y_min, x_max, y_max in boxes.to_numpy(dtype=np.float64) * scale:
+        #: mosaic i of the block covers the zoom 20 pixels from i * step to i * step + size
+        columns = range(
+            max(math.floor((x_min - margin - layout.size) / step) + 1, 0),
+            min(math.floor((x_max + margin) / step), scale - 1) + 1,
+        )
+        rows = range(
+            max(math.floor((y_min - margin - layout.size) / step) + 1, 0),
+            min(math.floor((y_max + margin) / step), scale - 1) + 1,
+        )
 
-    return new_session
+        candidates.update((col + i * layout.grid, row + j * layout.grid) for i in columns for j in rows)
 
+    return sorted(candidates, key=lambda key: (key[1], key[0]))
 
-def get_tile(url):
-    """Makes a requests.get call to the geocoding API.
 
-    Meant to be called through a retry wrapper so that the RuntimeErrors get tried again a couple times before
-        finally raising the error.
+def get_pipeline_workers():
+    """read the number of workers for each pipeline stage from the environment
 
     Args:
-        url (str): url for GET request
-
-    Raises:
-        RuntimeError: If the server does not return response and request.get returns a falsy object.
-        RuntimeError: If the server returns a status code other than 200 or 404
+        None
 
     Returns:
-        dict: The 'results' dictionary of the response json (location, score, and matchAddress)
+        dict: the number of workers keyed by stage name
     """
+    return {
+        "download": int(getenv("DOWNLOAD_WORKERS") or 4),
+        "mosaic": int(getenv("MOSAIC_WORKERS") or 1),
+        "detect": int(getenv("DETECT_WORKERS") or 1),
+        "locate": int(getenv("LOCATE_WORKERS") or 1),
+        "persist": int(getenv("PERSIST_WORKERS") or 1),
+    }
 
-    session = _get_retry_session()
 
-    try:
-        response = session.get(url, timeout=5)
-        response.raise_for_status()  #: raise an exception if the status code is not 200 OK
-    except requests.exceptions.Timeout:
-        #: timeout occurred
-        logging.debug("Timeout error occurred")
+def process_rows_pipelined(rows, workers, writer, queue_size=None):
+    """run the processing chain with every stage working concurrently on different rows
 
-        return None
+    each stage is connected to the next by a bounded queue so the tiles for upcoming rows are downloaded
+    while the current mosaic is being scanned by tower scout
 
-    except requests.exceptions.RequestException as error:
-        #: other error occurred
-        logging.debug("Error occurred: %s", error)
+    Args:
+        rows (iterator): index rows with `col_num` and `row_num` attributes
+        workers (dict): the number of workers for each stage, see `get_pipeline_workers`
+        writer (ResultWriter): saves the results and marks the rows as processed
+        queue_size (int): the maximum number of rows waiting between two stages (optional)
 
-        return None
+    Returns:
+        None
+    """
+    queue_size = queue_size or int(getenv("PIPELINE_QUEUE_SIZE") or 8)
+
+    #: the detect stage waits at most this long for a full batch before running the mosaics it has
+    batch_wait = float(getenv("DETECT_BATCH_WAIT") or 0.5)
+
+    #: name, work, batch size, batch wait. stages without a batch size work on one row at a time
+    stages = [
+        ("download", _download_stage, None, 0),
+        ("mosaic", _mosaic_stage, None, 0),
+        ("detect", _detect_stage, _get_detect_batch_size(), batch_wait),
+        ("locate", _locate_stage, _get_detect_batch_size(), 0),
+        ("persist", partial(_persist_stage, writer=writer), None, 0),
+    ]
+    queues = [Queue(maxsize=queue_size) for _ in stages]
+
+    threads = []
+    for i, (name, work, batch_size, stage_wait) in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(queues) else None
+        threads.extend(_start_stage(name, work, queues[i], outbox, workers.get(name, 1), batch_size, stage_wait))
 
-    #: the server times out and doesn't respond...is this needed??
-    if response is None:
-        logging.debug("GET call did not return a response")
-        raise RuntimeError("No response from GET; request timeout?")
+    for row in rows:
+        logging.info("%i, %i start", row.col_num, row.row_num)
 
-    #: the tile request is successful
-    if response.status_code == 200:
-        return response
+        queues[0].put(SimpleNamespace(col_num=row.col_num, row_num=row.row_num, row_start=perf_counter()))
 
-    return None
+    queues[0].put(_STAGE_DONE)
+
+    for thread in threads:
+        thread.join()
 
 
-def download_tiles(col, row, out_dir):
-    """downloads image at specified col/row and each neighbor to the right, down, and right-down,
-    then converts them to cv2 images and returns the list
+def _start_stage(name, work, inbox, outbox, workers, batch_size=None, batch_wait=0):
+    """start the worker threads for a pipeline stage
 
     Args:
-        col (str): the column of the WMTS index for the tile of interest (top-left tile)
-        row (str): the row of the WMTS index for the tile of interest (top-left tile)
+        name (str): the name of the stage used for the thread names
+        work (function): the function to call with each item. returning None drops the item. when
+            batch_size is set it is called with a list of items and returns a list of items
+        inbox (Queue): the queue to read items from
+        outbox (Queue): the queue to put finished items on, None for the last stage
+        workers (int): the number of threads to start
+        batch_size (int): the maximum number of items to collect for each call to work (optional)
+        batch_wait (float): the seconds to wait for a full batch after the first item arrives (optional)
 
     Returns:
-        cv2_images (list): list of cv2 images
+        list: the started threads
     """
-    global SECRETS  # pylint: disable=global-statement
+    workers = max(workers, 1)
+    lock = Lock()
+    running = [workers]
 
-    if SECRETS is None:
-        logging.info("loading secrets")
-        SECRETS = SimpleNamespace(**_get_secrets())
+    def worker():
+        done = False
 
-    base_url = f"https://discover.agrc.utah.gov/login/path/{SECRETS.QUAD_WORD}/tiles/utah/20"
-    col_num = int(col)
-    row_num = int(row)
+        while not done:
+            items, done = _take_batch(inbox, batch_size or 1, batch_wait)
 
-    urls = []
-    #: build url for primary tile (top-left)
-    urls.append(f"{base_url}/{col_num}/{row_num}")
-    #: build url for top-right tile
-    urls.append(f"{base_url}/{col_num + 1}/{row_num}")
-    #: build url for bottom-left tile
-    urls.append(f"{base_url}/{col_num}/{row_num + 1}")
-    #: build url for bottom-right tile
-    urls.append(f"{base_url}/{col_num + 1}/{row_num + 1}")
-
-    #: make requests for each url/tile in the url list
-    tile_list = []
-    for url in urls:
-        tile = get_tile(url)
-
-        if tile is None:
-            continue
+            if done:
+                #: put the marker back so the other workers in this stage see it too
+                inbox.put(_STAGE_DONE)
 
-        tile_list.append(tile.content)
+            if not items:
+                continue
 
-    if not all(tile_list):
-        logging.debug("at least one tile failed to download; aborting...")
+            try:
+                items = work(items) if batch_size else [work(items[0])]
+            except Exception as ex:
+                for item in items:
+                    logging.error("%s stage failed on col: %i row: %i, %s", name, item.col_num, item.row_num, ex)
 
-        return None
+                continue
 
-    if out_dir:
-        if not out_dir.exists():
-            out_dir.mkdir(parents=True)
+            for item in items:
+                if item is not None and outbox is not None:
+                    outbox.put(item)
 
-        i = 0
-        for tile in tile_list:
-            img = convert_to_cv2_image(tile)
-            logging.debug("download is saving from %s", type(img))
-            tile_outfile = out_dir / f"{col}_{row}_{i}.jpg"
-            logging.info("saving to %s", tile_outfile)
-            cv2.imwrite(str(tile_outfile), img)
+        with lock:
+            running[0] -= 1
 
-            i += 1
+            if running[0] == 0 and outbox is not None:
+                outbox.put(_STAGE_DONE)
 
-        return tile_list
+    threads = [Thread(target=worker, name=f"{name}-{i}", daemon=True) for i in range(workers)]
 
-    logging.debug("no output directory provided")
+    for thread in threads:
+        thread.start()
 
-    return tile_list
+    return threads
 
 
-def build_mosaic_image(tiles, col, row, out_dir):
-    """build a mosaic image from a list of cv2 images
+def _take_batch(inbox, batch_size, batch_wait):
+    """take up to batch_size items from a pipeline queue
 
     Args:
-        images (list): list of cv2 images to mosaic together
-        col (str): the column of the WMTS index for the tile of interest (top-left tile)
-        row (str): the row of the WMTS index for the tile of interest (top-left tile)
-        out_dir (Path): location to save the result
+        inbox (Queue): the queue to read items from
+        batch_size (int): the maximum number of items to take
+        batch_wait (float): the seconds to wait for more items after the first item arrives
 
     Returns:
-        mosaic_image (np.ndarray): composite mosaic of smaller images
+        tuple: the list of items and whether the end of the queue was reached
     """
+    item = inbox.get()
 
-    tile_name = f"{col}_{row}"
+    if item is _STAGE_DONE:
+        return [], True
 
-    if tiles is None or len(tiles) == 0:
-        logging.info("no images to mosaic for %s", tile_name)
+    items = [item]
+    deadline = perf_counter() + batch_wait
 
-        return None
+    while len(items) < batch_size:
+        try:
+            item = inbox.get(timeout=max(deadline - perf_counter(), 0))
+        except Empty:
+            break
 
-    #: Set up parameters for images, mosaic, number of cols/rows (every image will be 256x256)
-    tile_width = 256
-    number_columns = 2
-    number_rows = 2
+        if item is _STAGE_DONE:
+            return items, True
 
-    #: Build mosaic image with white background
-    total_height = tile_width * number_rows
-    total_width = tile_width * number_columns
+        items.append(item)
 
-    logging.debug("mosaicking images for %s", tile_name)
+    return items, False
 
-    mosaic_image = np.zeros((total_height, total_width, 3), dtype=np.uint8)
-    mosaic_image[:, :] = (255, 255, 255)
 
-    logging.debug("mosaic is starting with %s", type(tiles[0]))
+def _download_stage(item):
+    """pipeline stage to download the tiles for a row"""
+    start = perf_counter()
+    item.tiles = download_tiles(item.col_num, item.row_num, None)
+    _log_stage(item.col_num, item.row_num, "download", perf_counter() - start)
 
-    i = 0
-    for tile in tiles:
-        #: convert from bytes to cv2
-        img = convert_to_cv2_image(tile)
-        #: add image into the mosaic
-        row_start = (math.floor(i / number_columns)) * tile_width
-        col_start = (i % number_columns) * tile_width
-        mosaic_image[row_start : row_start + tile_width, col_start : col_start + tile_width] = img
+    return item
 
-        i += 1
 
-    logging.debug("mosaic is returning %s", type(mosaic_image))
+def _mosaic_stage(item):
+    """pipeline stage to build the mosaic image for a row"""
+    start = perf_counter()
+    buffer = acquire_mosaic_buffer()
+    item.mosaic_image = build_mosaic_image(item.tiles, item.col_num, item.row_num, None, buffer=buffer, rgb=True)
+    item.prescreened = prescreen_mosaic(item.tiles, item.mosaic_image, item.col_num, item.row_num) is not None
+    item.tiles = None
 
-    if out_dir:
-        if not out_dir.exists():
-            out_dir.mkdir(parents=True)
+    if item.mosaic_image is None or item.prescreened:
+        item.mosaic_image = None
+        release_mosaic_buffer(buffer)
 
-        mosaic_outfile = out_dir / f"{tile_name}_mosaic.jpg"
-        logging.debug("saving to %s", mosaic_outfile)
-        cv2.imwrite(str(mosaic_outfile), mosaic_image)
+    _log_stage(item.col_num, item.row_num, "mosaic", perf_counter() - start)
 
-        return mosaic_image
+    return item
 
-    logging.debug("no output directory provided")
 
-    return mosaic_image
+def _detect_stage(items):
+    """pipeline stage to run tower scout on the mosaic images for a batch of rows"""
+    start = perf_counter()
+    images = [item.mosaic_image for item in items]
 
+    try:
+        results = detect_towers_batch(images, [(item.col_num, item.row_num) for item in items], rgb=True)
+    finally:
+        #: the model is done with the mosaics so their buffers can be reused
+        for image in images:
+            release_mosaic_buffer(image)
 
-def load_pytorch_model():
-    """load pytorch model with tower scout weights
+    elapsed = perf_counter() - start
 
-    Args:
-        None
+    detected = []
+    for item, (_, result) in zip(items, results):
+        item.results = result
+        item.mosaic_image = None
 
-    Returns:
-        pytorch model: model ready for scanning
-    """
-    model_weight_path = Path(__file__).parent / "tower_scout" / "xl_250_best.pt"
-    yolov5_path = Path(__file__).parent / "yolov5"
+        #: skipped mosaics go straight to the persist stage so they are marked as processed
+        if item.prescreened:
+            detected.append(item)
 
-    if not model_weight_path.is_file():
-        logging.error("the model weights file does not exist: %s", model_weight_path)
+            continue
 
-        raise FileNotFoundError("the model weights file does not exist")
+        _log_stage(item.col_num, item.row_num, "towerscout", elapsed, len(items))
 
-    if not yolov5_path.is_dir():
+        if not item.results:
+            _log_stage(item.col_num, item.row_num, "finish", perf_counter() - item.row_start)
+
+            continue
+
+        detected.append(item)
+
+    return detected
+
+
+def _locate_stage(items):
+    """pipeline stage to georeference the detections for a batch of rows"""
+    start = perf_counter()
+    detected = [item for item in items if item.results is not None]
+    located = locate_results_batch(
+        [item.results for item in detected], [(item.col_num, item.row_num) for item in detected]
+    )
+    elapsed = perf_counter() - start
+
+    for item in items:
+        item.results_df = None
+
+    for item, (_, results_df) in zip(detected, located):
+        item.results_df = results_df
+        item.results = None
+        _log_stage(item.col_num, item.row_num, "georeference", elapsed, len(detected))
+
+    return items
+
+
+def _persist_stage(item, writer):
+    """pipeline stage to save the detections and mark a row as processed"""
+    if item.results_df is not None:
+        logging.debug(
+            "buffering %i results for col: %i row: %i", len(item.results_df.index), item.col_num, item.row_num
+        )
+
+    writer.add(item.col_num, item.row_num, item.results_df)
+
+    _log_stage(item.col_num, item.row_num, "finish", perf_counter() - item.row_start)
+
+
+def process_rows_forked(rows, workers, writer, threads=None):
+    """download the tiles in this process and run the mosaic, model, and georeferencing in forked worker processes
+
+    the model is loaded before forking so every worker shares the same weights through copy on write memory
+
+    Args:
+        rows (iterator): index rows with `col_num` and `row_num` attributes
+        workers (int): the number of inference processes
+        writer (ResultWriter): saves the results and marks the rows as processed
+        threads (int): the torch threads for each worker, defaults to `INFERENCE_THREADS` or the cpus per worker
+
+    Returns:
+        int: the number of rows processed
+    """
+    depth = max(int(getenv("PREFETCH_ROWS") or 0), workers)
+    processed = 0
+
+    for col, row, results_df, timings in infer_rows_forked(prefetch_tiles(rows, depth), workers, threads):
+        processed += 1
+
+        _log_stage(col, row, "mosaic", timings["mosaic"])
+        _log_stage(col, row, "towerscout", timings["towerscout"])
+
+        if results_df is not None:
+            _log_stage(col, row, "georeference", timings["georeference"])
+            writer.add(col, row, results_df)
+        elif timings.get("prescreen"):
+            cool_metrics.increment("rows_prescreened")
+            logging.info("%i, %i prescreen: skipped by %s", col, row, timings["prescreen"])
+            writer.add(col, row)
+
+        _log_stage(col, row, "finish", perf_counter() - timings["start"])
+
+    return processed
+
+
+def get_inference_threads(workers):
+    """get the number of torch threads each inference process should use
+
+    Args:
+        workers (int): the number of inference processes
+
+    Returns:
+        int: `INFERENCE_THREADS` or the cpus divided between the workers
+    """
+    return int(getenv("INFERENCE_THREADS") or 0) or max(1, (cpu_count() or 1) // workers)
+
+
+def infer_rows_forked(downloads, workers, threads=None):
+    """run downloaded rows through the model in forked worker processes
+
+    Args:
+        downloads (iterator): (row, tiles) tuples from `prefetch_tiles`
+        workers (int): the number of inference processes
+        threads (int): the torch threads for each worker (optional)
+
+    Yields:
+        tuple: the col, row, located results or None, and stage timings of each row as they finish
+    """
+    threads = threads or get_inference_threads(workers)
+    logging.info("starting %i inference processes with %i threads each", workers, threads)
+
+    #: load the model once in this process so the forked workers share it
+    _get_model()
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_inference_worker,
+        initargs=(threads,),
+    )
+
+    try:
+        #: fork every worker before this function starts downloading, the other threads of the task are already
+        #: running so `_init_inference_worker` replaces the locks they could have held
+        for future in [executor.submit(cpu_count) for _ in range(workers)]:
+            future.result()
+
+        downloads = iter(downloads)
+        pending = set()
+        exhausted = False
+
+        while pending or not exhausted:
+            #: keep every worker busy without downloading or claiming rows too far ahead
+            while not exhausted and len(pending) < workers * 2:
+                row_start = perf_counter()
+                row, tiles = next(downloads, (None, None))
+
+                if row is None:
+                    exhausted = True
+
+                    break
+
+                _log_stage(row.col_num, row.row_num, "download", perf_counter() - row_start)
+                pending.add(executor.submit(_infer_row, row.col_num, row.row_num, tiles, row_start))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _init_inference_worker(threads):
+    """set up a forked inference process"""
+    global SESSION, TILE_EXECUTOR, TILE_STORE, DECODE_EXECUTOR  # pylint: disable=global-statement
+    global _MOSAIC_BUFFERS, _SESSION_LOCK  # pylint: disable=global-statement
+
+    #: threads, executors and connections do not survive a fork, the workers create their own when needed
+    SESSION = TILE_EXECUTOR = TILE_STORE = DECODE_EXECUTOR = None
+    _MOSAIC_BUFFERS = Queue()
+    #: a lock held by a thread of the parent while forking would never be released in the worker
+    _SESSION_LOCK = Lock()
+    cool_metrics.METRICS.after_fork()
+
+    if POOL is not None:
+        POOL.dispose(close=False)
+
+    import torch  # pylint: disable=import-outside-toplevel
+
+    torch.set_num_threads(threads)
+
+
+def _infer_row(col, row, tiles, row_start):
+    """mosaic, detect, and georeference one row in an inference process"""
+    timings = {"start": row_start}
+    buffer = acquire_mosaic_buffer()
+
+    try:
+        start = perf_counter()
+        mosaic_image = build_mosaic_image(tiles, col, row, None, buffer=buffer, rgb=True)
+        timings["mosaic"] = perf_counter() - start
+        timings["prescreen"] = None
+
+        if mosaic_image is not None:
+            timings["prescreen"] = cool_prescreen.screen(tiles, mosaic_image, cool_prescreen.get_checks())
+
+        start = perf_counter()
+        results = None if timings["prescreen"] else detect_towers(mosaic_image, rgb=True)
+        timings["towerscout"] = perf_counter() - start
+    finally:
+        release_mosaic_buffer(buffer)
+
+    if not results:
+        return col, row, None, timings
+
+    start = perf_counter()
+    results_df = locate_results(results, col, row)
+    timings["georeference"] = perf_counter() - start
+
+    return col, row, results_df, timings
+
+
+def tune_workers(col, row, worker_counts, rows=20):
+    """measure the rows per second of each number of inference processes on the same mosaic
+
+    the tiles are downloaded once so only the mosaic, model, and georeferencing are measured
+
+    Args:
+        col (int): the column of the WMTS index for the tile of interest (top-left tile)
+        row (int): the row of the WMTS index for the tile of interest (top-left tile)
+        worker_counts (list): the numbers of inference processes to try
+        rows (int): the number of rows to process for each worker count (optional)
+
+    Returns:
+        list: a dictionary of workers, threads, rows, seconds, and rows_per_second for each worker count
+    """
+    tiles = download_tiles(col, row, None)
+    item = SimpleNamespace(col_num=int(col), row_num=int(row))
+    report = []
+
+    _get_model()
+
+    for workers in worker_counts:
+        threads = get_inference_threads(workers)
+        start = perf_counter()
+        count = sum(1 for _ in infer_rows_forked(((item, tiles) for _ in range(rows)), workers, threads))
+        seconds = perf_counter() - start
+
+        report.append(
+            {
+                "workers": workers,
+                "threads": threads,
+                "rows": count,
+                "seconds": seconds,
+                "rows_per_second": count / seconds,
+            }
+        )
+        logging.info("%i workers with %i threads each: %.2f rows/sec", workers, threads, count / seconds)
+
+    return report
+
+
+def evaluate_cascade(blocks, levels, thresholds, truth_confidence=0.25, margin=16):
+    """measure the zoom 20 towers each coarse confidence threshold of the zoom cascade keeps and the work it saves
+
+    every zoom 20 mosaic of each block is detected to find the towers a full scan finds. a tower is kept when the
+    cascade refines its mosaic since the refined mosaic is detected the same way
+
+    Args:
+        blocks (iterable): the (col, row) of the top-left zoom 20 tile of each block
+        levels (int): the zoom levels between the coarse and the zoom 20 mosaics
+        thresholds (list): the `CASCADE_CONFIDENCE` values to compare
+        truth_confidence (float): the lowest confidence of a zoom 20 detection that counts as a tower (optional)
+        margin (float): the zoom 20 pixels added around the coarse detections (optional)
+
+    Returns:
+        list: a dictionary for each threshold
+    """
+    layout = get_mosaic_layout()
+    scale = 2**levels
+    found = {threshold: 0 for threshold in thresholds}
+    refined = {threshold: 0 for threshold in thresholds}
+    downloads = {threshold: 0 for threshold in thresholds}
+    count = towers = 0
+
+    for col, row in blocks:
+        col, row = int(col), int(row)
+        coarse_df = detect_coarse(col, row, levels, layout)
+
+        if coarse_df is None:
+            logging.warning("skipping the block at %i, %i without imagery", col, row)
+
+            continue
+
+        block = {}
+        for j in range(scale):
+            for i in range(scale):
+                results_df = detect_fine(col + i * layout.grid, row + j * layout.grid, layout)
+                confident = 0 if results_df is None else int((results_df["confidence"] >= truth_confidence).sum())
+                block[(col + i * layout.grid, row + j * layout.grid)] = confident
+
+        count += 1
+        towers += sum(block.values())
+
+        for threshold in thresholds:
+            candidates = cascade_candidates(coarse_df, col, row, levels, layout, threshold, margin)
+            found[threshold] += sum(block[key] for key in candidates)
+            refined[threshold] += len(candidates)
+            downloads[threshold] += get_coarse_layout(col, row, levels, layout).tiles ** 2
+            downloads[threshold] += len(candidates) * layout.tiles**2
+
+    mosaics = count * scale**2
+
+    return [
+        {
+            "threshold": threshold,
+            "blocks": count,
+            "mosaics": mosaics,
+            "refined": refined[threshold],
+            "towers": towers,
+            "towers_found": found[threshold],
+            "recall": found[threshold] / towers if towers else 1.0,
+            "inference_ratio": (count + refined[threshold]) / mosaics if mosaics else 0.0,
+            "download_ratio": downloads[threshold] / (mosaics * layout.tiles**2) if mosaics else 0.0,
+        }
+        for threshold in thresholds
+    ]
+
+
+def prescreen_mosaic(tiles, mosaic_image, col, row):
+    """run the cheap `PRESCREEN` checks to find mosaics that certainly have no cooling towers
+
+    Args:
+        tiles (list): the jpeg bytes of the tiles
+        mosaic_image (np.ndarray): the rgb mosaic image
+        col (int): the column of the WMTS index for the tile of interest (top-left tile)
+        row (int): the row of the WMTS index for the tile of interest (top-left tile)
+
+    Returns:
+        str: the name of the check that found the mosaic empty or None when the model should run
+    """
+    if mosaic_image is None:
+        return None
+
+    checks = cool_prescreen.get_checks()
+
+    if not checks:
+        return None
+
+    start = perf_counter()
+    skipped = cool_prescreen.screen(tiles, mosaic_image, checks)
+
+    if skipped:
+        cool_metrics.increment("rows_prescreened")
+        logging.info("%i, %i prescreen: skipped by %s %s", col, row, skipped, format_time(perf_counter() - start))
+
+    return skipped
+
+
+def convert_to_cv2_image(image):
+    """convert image (bytes) to a cv2 image object
+
+    Args:
+        image (bytes): The image (bytes) to convert
+
+    Returns:
+        cv2.Image: A cv2 image object
+    """
+    import cv2  # pylint: disable=import-outside-toplevel
+
+    return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), 1)  # 1 means flags=cv2.IMREAD_COLOR
+
+
+def reorder_colors_to_rgb(image):
+    """reorders np.ndarray image object from BGR to RGB
+
+    Args:
+        image (np.ndarray): The image to reorder colors
+
+    Returns:
+        np.ndarray: The image with reordered colors
+    """
+    import cv2  # pylint: disable=import-outside-toplevel
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def reorder_colors_to_bgr(image):
+    """reorders np.ndarray image object from RGB to BGR
+
+    Args:
+        image (np.ndarray): The image to reorder colors
+
+    Returns:
+        np.ndarray: The image with reordered colors
+    """
+    import cv2  # pylint: disable=import-outside-toplevel
+
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+
+def get_rows(skip, take, page_size=None):
+    """grab rows to process from the indices table
+
+    the first page skips `skip` rows and the later pages start after the last row of the previous page, each page
+    is read on its own short lived connection so no connection is held while the rows are processed
+
+    Args:
+        skip (string): the number of leading rows to skip
+        take (string): the number of rows to get form the table
+        page_size (int): the rows read with each query, defaults to `ROWS_PAGE_SIZE` or 1000 (optional)
+
+    Yields:
+        row: the next row so the rows are never all held in memory
+    """
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    page_size = page_size or int(getenv("ROWS_PAGE_SIZE") or 1000)
+    remaining = int(take)
+
+    #: order by row, col ascending to ensure consistent processing order
+    first_page = sqlalchemy.text(
+        """
+    SELECT * FROM images_within_habitat
+    WHERE processed = false
+    ORDER BY row_num, col_num
+    LIMIT :limit OFFSET :skip
+    """
+    )
+    next_page = sqlalchemy.text(
+        """
+    SELECT * FROM images_within_habitat
+    WHERE processed = false AND (row_num, col_num) > (:row_num, :col_num)
+    ORDER BY row_num, col_num
+    LIMIT :limit
+    """
+    )
+    last = None
+
+    while remaining > 0:
+        task_start = perf_counter()
+        limit = min(page_size, remaining)
+
+        with _get_pool().connect() as conn:
+            if last is None:
+                rows = conn.execute(first_page, {"limit": limit, "skip": int(skip)}).fetchall()
+            else:
+                rows = conn.execute(next_page, {"limit": limit, "row_num": last[0], "col_num": last[1]}).fetchall()
+
+            conn.commit()
+
+        cool_metrics.observe("query_seconds", perf_counter() - task_start)
+        logging.info("get rows query: %s", format_time(perf_counter() - task_start))
+
+        yield from rows
+
+        if len(rows) < limit:
+            return
+
+        remaining -= len(rows)
+        last = (rows[-1].row_num, rows[-1].col_num)
+
+
+def create_work_queue(path, parquet=None):
+    """create a local work queue of the unprocessed rows of the indices table or of a habitat parquet file
+
+    Args:
+        path (Path): the queue file
+        parquet (Path): a parquet file with `col_num` and `row_num` columns to use instead of the database (optional)
+
+    Returns:
+        cool_queue.WorkQueue: the queue
+    """
+    if parquet:
+        import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+        table = pq.read_table(parquet, columns=["col_num", "row_num"])
+
+        return cool_queue.WorkQueue.create(path, table.column("col_num").to_numpy(), table.column("row_num").to_numpy())
+
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    sql = sqlalchemy.text(
+        """
+    SELECT col_num, row_num FROM images_within_habitat
+    WHERE processed = false
+    ORDER BY row_num, col_num
+    """
+    )
+    cols, rows = [], []
+
+    with _get_pool().connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=100000).execute(sql)
+
+        for chunk in result.partitions():
+            chunk = np.asarray(chunk, dtype=np.int32).reshape(-1, 2)
+            cols.append(chunk[:, 0])
+            rows.append(chunk[:, 1])
+
+        conn.commit()
+
+    if not cols:
+        return cool_queue.WorkQueue.create(path, [], [])
+
+    return cool_queue.WorkQueue.create(path, np.concatenate(cols), np.concatenate(rows))
+
+
+def claim_rows(worker, take, lease_seconds):
+    """lease a chunk of unprocessed rows from the indices table so no other task works on them
+
+    rows locked by another task's claim are skipped instead of waited on and rows whose lease expired
+    without being processed can be claimed again
+
+    Args:
+        worker (str): the name of the task claiming the rows
+        take (int): the maximum number of rows to claim
+        lease_seconds (float): the seconds the claim lasts before the rows can be claimed by another task
+
+    Returns:
+        rows (list): the claimed rows ordered by row, col
+    """
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    sql = sqlalchemy.text(
+        """
+    UPDATE images_within_habitat AS claimed
+    SET claimed_by = :worker, claimed_at = now(), lease_expires_at = now() + :lease * interval '1 second'
+    FROM (
+        SELECT row_num, col_num FROM images_within_habitat
+        WHERE processed = false AND (lease_expires_at IS NULL OR lease_expires_at < now())
+        ORDER BY row_num, col_num
+        LIMIT :take
+        FOR UPDATE SKIP LOCKED
+    ) AS available
+    WHERE claimed.row_num = available.row_num AND claimed.col_num = available.col_num
+    RETURNING claimed.row_num, claimed.col_num
+    """
+    )
+
+    task_start = perf_counter()
+
+    with _get_pool().connect() as conn:
+        rows = conn.execute(sql, {"worker": worker, "lease": lease_seconds, "take": take}).fetchall()
+        conn.commit()
+
+    cool_metrics.observe("claim_seconds", perf_counter() - task_start)
+    logging.info("claim rows query: %i rows %s", len(rows), format_time(perf_counter() - task_start))
+
+    #: returning does not keep the order of the select
+    return sorted(rows, key=lambda row: (row.row_num, row.col_num))
+
+
+class ClaimSizer:
+    """sizes claims from the measured seconds per row so every claim holds about the same amount of work
+
+    a task that lands on slow rows claims fewer of them at a time and leaves the rest to faster tasks
+
+    Args:
+        initial (int): the number of rows to claim before any have been timed
+        target_seconds (float): the seconds of work to claim at once
+        lease_seconds (float): the seconds each claim lasts, a claim never holds more than half a lease of work
+        maximum (int): the most rows to claim at once (optional)
+        smoothing (float): the weight of the latest chunk in the moving average of the seconds per row (optional)
+    """
+
+    def __init__(self, initial, target_seconds, lease_seconds, maximum=None, smoothing=0.3):
+        self.initial = initial
+        self.target_seconds = target_seconds
+        self.lease_seconds = lease_seconds
+        self.maximum = maximum or int(getenv("CLAIM_MAX_SIZE") or 100)
+        self.smoothing = smoothing
+        self.seconds_per_row = None
+
+    def observe(self, rows, seconds):
+        """add the time a chunk of rows took to the moving average
+
+        Args:
+            rows (int): the number of rows processed
+            seconds (float): the time they took
+
+        Returns:
+            None
+        """
+        if rows <= 0:
+            return
+
+        per_row = max(seconds / rows, 1e-3)
+
+        if self.seconds_per_row is None:
+            self.seconds_per_row = per_row
+        else:
+            self.seconds_per_row += self.smoothing * (per_row - self.seconds_per_row)
+
+    def size(self):
+        """the number of rows to claim next
+
+        Returns:
+            int: the claim size
+        """
+        if self.seconds_per_row is None:
+            return self.initial
+
+        rows = min(self.target_seconds, self.lease_seconds / 2) / self.seconds_per_row
+
+        return int(min(max(rows, 1), self.maximum))
+
+
+def count_remaining_rows():
+    """count the unprocessed rows in the indices table
+
+    Returns:
+        int: the number of unprocessed rows
+    """
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    with _get_pool().connect() as conn:
+        return conn.execute(
+            sqlalchemy.text("SELECT count(*) FROM images_within_habitat WHERE processed = false")
+        ).scalar()
+
+
+def estimate_completion(previous, current):
+    """estimate when the whole job finishes from two counts of the remaining rows
+
+    the rate covers every task that is running, not just this one
+
+    Args:
+        previous (tuple): the perf_counter seconds and remaining rows of the earlier count
+        current (tuple): the perf_counter seconds and remaining rows of the later count
+
+    Returns:
+        tuple: the rows per hour of the job and the estimated seconds until it finishes or None when no progress was
+            made
+    """
+    seconds = current[0] - previous[0]
+    rows = previous[1] - current[1]
+
+    if seconds <= 0 or rows <= 0:
+        return 0, None
+
+    rate = rows / seconds
+
+    return rate * 3600, current[1] / rate
+
+
+def _log_progress(baseline, count=None):
+    """log the remaining rows and the estimated completion time of the job
+
+    the rate is averaged from the first count since the saves of every task arrive in bursts
+
+    Args:
+        baseline (tuple): the perf_counter seconds and remaining rows of the first count or None
+        count (callable): counts the remaining rows, defaults to `count_remaining_rows` (optional)
+
+    Returns:
+        tuple: the baseline to pass to the next call
+    """
+    try:
+        current = (perf_counter(), (count or count_remaining_rows)())
+    except Exception as ex:  # pylint: disable=broad-except
+        logging.warning("unable to count the remaining rows: %s", ex)
+
+        return baseline
+
+    if baseline is None:
+        logging.info("job progress: %i rows remaining", current[1])
+
+        return current
+
+    rate, seconds = estimate_completion(baseline, current)
+    logging.info(
+        "job progress: %i rows remaining at %i rows per hour, estimated completion in %s",
+        current[1],
+        rate,
+        "unknown" if seconds is None else format_time(seconds),
+    )
+
+    return baseline
+
+
+def iter_claimed_rows(
+    worker,
+    chunk_size,
+    lease_seconds,
+    limit=None,
+    target_seconds=None,
+    progress_seconds=None,
+    queue=None,
+    completed=None,
+):  # pylint: disable=too-many-arguments
+    """claim small chunks of rows one after another until there is no work left
+
+    when `target_seconds` is set the chunks are sized from the time the rows take. with `completed` the time is
+    measured from the rows that finished between claims since the prefetch and pipeline queues hold rows that were
+    yielded but not finished. rows left in a chunk that would not finish before its lease expires are dropped since
+    another task may claim them
+
+    Args:
+        worker (str): the name of the task claiming the rows
+        chunk_size (int): the number of rows to claim at once, or the first claim with `target_seconds`
+        lease_seconds (float): the seconds each claim lasts
+        limit (int): the maximum number of rows to process in total (optional)
+        target_seconds (float): the seconds of work to claim at once (optional)
+        progress_seconds (float): the seconds between logs of the job's estimated completion (optional)
+        queue (cool_queue.WorkQueue): a local work queue to claim the rows from instead of the database (optional)
+        completed (callable): returns the number of rows finished so far, e.g. `ResultWriter.completed` (optional)
+
+    Yields:
+        row: the next claimed row
+    """
+    claim = claim_rows if queue is None else queue.claim
+    count = count_remaining_rows if queue is None else queue.remaining
+    sizer = ClaimSizer(chunk_size, target_seconds or lease_seconds, lease_seconds)
+    baseline = None
+    next_progress = perf_counter() + progress_seconds if progress_seconds else None
+    claimed = 0
+    last_claim = None
+
+    while limit is None or claimed < limit:
+        take = sizer.size() if target_seconds else chunk_size
+        take = take if limit is None else min(take, limit - claimed)
+        rows = claim(worker, take, lease_seconds)
+        lease_start = perf_counter()
+
+        if completed is not None:
+            #: the rate the rows finish at between claims, however many rows are queued in between
+            if last_claim is not None:
+                sizer.observe(completed() - last_claim[1], lease_start - last_claim[0])
+
+            last_claim = (lease_start, completed())
+
+        if not rows:
+            logging.info("no rows left to claim")
+
+            return
+
+        if next_progress is not None and lease_start >= next_progress:
+            baseline = _log_progress(baseline, count)
+            next_progress = lease_start + progress_seconds
+
+        started = 0
+
+        for row in rows:
+            #: the rows yielded before this one that have not finished are worked on first
+            waiting = max(claimed + started - completed(), 0) if completed is not None else 0
+            finishes = perf_counter() - lease_start + (sizer.seconds_per_row or 0) * (waiting + 1)
+
+            if started and finishes > lease_seconds or perf_counter() - lease_start > lease_seconds:
+                cool_metrics.increment("rows_lease_expired", len(rows) - started)
+                logging.warning(
+                    "the lease expires before %i claimed rows would finish, leaving them to other tasks",
+                    len(rows) - started,
+                )
+
+                break
+
+            started += 1
+
+            yield row
+
+        claimed += started
+
+        if completed is None:
+            #: the caller finished each row before asking for the next one
+            sizer.observe(started, perf_counter() - lease_start)
+
+
+def _get_retry_session():
+    """create a requests session that has a retry built into it
+
+    Args:
+        None
+
+    Raises:
+        error: The final error that causes worker_method to fail after 3 retries
+
+    Returns:
+        session: a new session
+    """
+    retries = 3
+    backoff_factor = 0.3
+    status_forcelist = (500, 502, 504)
+    pool_size = _get_tile_workers()
+
+    new_session = requests.Session()
+
+    retry = Retry(
+        total=retries,
+        read=retries,
+        connect=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+    new_session.mount("https://", adapter)
+    #: a TILE_URL override may point at a local tile server
+    new_session.mount("http://", adapter)
+
+    return new_session
+
+
+def _get_session():
+    """gets the requests session using logic to ensure it's only created once so the keep-alive connections
+    in its pool are reused for every tile in the task
+
+    Args:
+        None
+
+    Returns:
+        session: the shared session
+    """
+    global SESSION  # pylint: disable=global-statement
+
+    with _SESSION_LOCK:
+        if SESSION is None:
+            logging.info("creating tile session")
+            SESSION = _get_retry_session()
+
+    return SESSION
+
+
+def _get_tile_workers():
+    """the number of tiles allowed to download at the same time
+
+    Args:
+        None
+
+    Returns:
+        int: the number of tile download threads
+    """
+    return int(getenv("TILE_WORKERS") or 16)
+
+
+def _get_tile_executor():
+    """gets the thread pool used to download tiles using logic to ensure it's only created once
+
+    Args:
+        None
+
+    Returns:
+        ThreadPoolExecutor: the shared tile download thread pool
+    """
+    global TILE_EXECUTOR  # pylint: disable=global-statement
+
+    with _SESSION_LOCK:
+        if TILE_EXECUTOR is None:
+            TILE_EXECUTOR = ThreadPoolExecutor(max_workers=_get_tile_workers(), thread_name_prefix="tile")
+
+    return TILE_EXECUTOR
+
+
+def get_tile(url):
+    """Makes a requests.get call to the geocoding API.
+
+    Meant to be called through a retry wrapper so that the RuntimeErrors get tried again a couple times before
+        finally raising the error.
+
+    Args:
+        url (str): url for GET request
+
+    Raises:
+        RuntimeError: If the server does not return response and request.get returns a falsy object.
+        RuntimeError: If the server returns a status code other than 200 or 404
+
+    Returns:
+        dict: The 'results' dictionary of the response json (location, score, and matchAddress)
+    """
+
+    session = _get_session()
+
+    try:
+        response = session.get(url, timeout=5)
+        response.raise_for_status()  #: raise an exception if the status code is not 200 OK
+    except requests.exceptions.Timeout:
+        #: timeout occurred
+        logging.debug("Timeout error occurred")
+
+        return None
+
+    except requests.exceptions.RequestException as error:
+        #: other error occurred
+        logging.debug("Error occurred: %s", error)
+
+        return None
+
+    #: the server times out and doesn't respond...is this needed??
+    if response is None:
+        logging.debug("GET call did not return a response")
+        raise RuntimeError("No response from GET; request timeout?")
+
+    #: the tile request is successful
+    if response.status_code == 200:
+        return response
+
+    return None
+
+
+def get_mosaic_layout(grid=None, overlap=None):
+    """the shape of the mosaics built for each index row
+
+    a mosaic is `grid` by `grid` tiles starting at the index row's tile and the index steps `grid` tiles between
+    rows. the overlap adds pixels to the right and bottom of each mosaic from the next mosaics so a tower split by
+    the edge is still whole in one of them. the origin stays on the top-left tile so the detections are located the
+    same way for every layout
+
+    Args:
+        grid (int): the tiles on each side of the mosaic, defaults to `MOSAIC_GRID` or 2 (optional)
+        overlap (int): the pixels shared with the next mosaics, defaults to `MOSAIC_OVERLAP` or 0 (optional)
+
+    Returns:
+        SimpleNamespace: the grid, the overlap, the tiles downloaded on each side, and the size in pixels
+    """
+    grid = int(grid or getenv("MOSAIC_GRID") or 2)
+    overlap = int(overlap if overlap is not None else getenv("MOSAIC_OVERLAP") or 0)
+
+    if grid < 1 or not 0 <= overlap <= grid * TILE_SIZE:
+        raise ValueError(f"invalid mosaic layout: a {grid}x{grid} grid with {overlap} pixels of overlap")
+
+    return SimpleNamespace(
+        grid=grid,
+        overlap=overlap,
+        tiles=grid + math.ceil(overlap / TILE_SIZE),
+        size=grid * TILE_SIZE + overlap,
+        offset=(0, 0),
+    )
+
+
+def get_cascade_levels(zoom=None):
+    """the zoom levels between the coarse mosaics of the zoom cascade and the zoom 20 mosaics
+
+    Args:
+        zoom (int): the zoom of the coarse mosaics, defaults to `CASCADE_ZOOM` (optional)
+
+    Returns:
+        int: the number of levels, 0 when the cascade is off
+    """
+    zoom = zoom or getenv("CASCADE_ZOOM")
+
+    if not zoom:
+        return 0
+
+    levels = 20 - int(zoom)
+
+    if not 1 <= levels <= 4:
+        raise ValueError(f"the cascade zoom must be between 16 and 19, not {zoom}")
+
+    return levels
+
+
+def get_coarse_layout(col, row, levels, layout=None):
+    """the layout of the coarse mosaic covering the block of zoom 20 mosaics of an index row in the zoom cascade
+
+    the block is 2**levels by 2**levels mosaics so the coarse mosaic is the same size in pixels. a block that does
+    not start on a coarse tile is cropped from one more column and row of coarse tiles
+
+    Args:
+        col (int): the zoom 20 column of the top-left tile of the block
+        row (int): the zoom 20 row of the top-left tile of the block
+        levels (int): the zoom levels between the coarse and the zoom 20 mosaics
+        layout (SimpleNamespace): the layout of the zoom 20 mosaics, see `get_mosaic_layout` (optional)
+
+    Returns:
+        SimpleNamespace: the grid, the overlap, the tiles downloaded on each side, the size, and the pixel offset
+    """
+    layout = layout or get_mosaic_layout()
+    scale = 2**levels
+    offset = ((int(col) % scale) * TILE_SIZE // scale, (int(row) % scale) * TILE_SIZE // scale)
+
+    return SimpleNamespace(
+        grid=layout.grid,
+        overlap=0,
+        tiles=layout.grid + (1 if any(offset) else 0),
+        size=layout.grid * TILE_SIZE,
+        offset=offset,
+    )
+
+
+def get_inference_size(layout=None):
+    """the model input size that keeps the imagery at the scale the model sees the 2x2 mosaics
+
+    Args:
+        layout (SimpleNamespace): the mosaic layout, see `get_mosaic_layout` (optional)
+
+    Returns:
+        int: the input size in pixels, a multiple of the 32 pixel model stride
+    """
+    layout = layout or get_mosaic_layout()
+
+    return math.ceil(layout.size * INFERENCE_SCALE / 32) * 32
+
+
+def download_tiles(col, row, out_dir, layout=None, zoom=20):
+    """downloads image at specified col/row and its neighbors to the right and down that make up the mosaic,
+    then returns the list of tile bytes ordered by row then column
+
+    Args:
+        col (str): the column of the WMTS index for the tile of interest (top-left tile)
+        row (str): the row of the WMTS index for the tile of interest (top-left tile)
+        out_dir (Path): location to save the tiles (optional)
+        layout (SimpleNamespace): the mosaic layout, see `get_mosaic_layout` (optional)
+        zoom (int): the WMTS zoom level of the col and row (optional)
+
+    Returns:
+        list: the tile bytes or None when any tile failed to download
+    """
+    global SECRETS  # pylint: disable=global-statement
+
+    store = _get_tile_store()
+    replaying = store is not None and store.mode == cool_store.REPLAY
+    tile_url = getenv("TILE_URL") or TILE_URL
+
+    #: replaying a tile store or a tile url without the quad word works offline without the secrets
+    if SECRETS is None and not replaying and "{quad_word}" in tile_url:
+        logging.info("loading secrets")
+        SECRETS = SimpleNamespace(**_get_secrets())
+
+    quad_word = SECRETS.QUAD_WORD if SECRETS is not None else ""
+    base_url = f"{tile_url.format(quad_word=quad_word)}/{zoom}"
+    col_num = int(col)
+    row_num = int(row)
+    side = (layout or get_mosaic_layout()).tiles
+
+    #: the primary tile (top-left) first, then across each row of the mosaic
+    addresses = [(zoom, col_num + x, row_num + y) for y in range(side) for x in range(side)]
+    urls = [f"{base_url}/{tile_col}/{tile_row}" for _, tile_col, tile_row in addresses]
+
+    #: make requests for each url/tile in the url list at the same time
+    tile_list = list(_get_tile_executor().map(_fetch_tile, urls, addresses))
+
+    if not all(tile_list):
+        logging.debug("at least one tile failed to download; aborting...")
+        cool_metrics.increment("tile_failures", sum(1 for tile in tile_list if not tile))
+
+        return None
+
+    if out_dir:
+        if not out_dir.exists():
+            out_dir.mkdir(parents=True)
+
+        i = 0
+        for tile in tile_list:
+            #: the tiles are already jpgs so they are saved without decoding them
+            tile_outfile = out_dir / f"{col}_{row}_{i}.jpg"
+            logging.info("saving to %s", tile_outfile)
+            tile_outfile.write_bytes(tile)
+
+            i += 1
+
+        return tile_list
+
+    logging.debug("no output directory provided")
+
+    return tile_list
+
+
+def _fetch_tile(url, address):
+    """get the bytes for a tile from the tile store or the tile server
+
+    Args:
+        url (str): the url of the tile
+        address (tuple): the zoom, col, and row of the tile
+
+    Returns:
+        bytes: the tile or None if it is not available
+    """
+    store = _get_tile_store()
+
+    if store is not None and store.mode != cool_store.RECORD:
+        content = store.get(*address)
+
+        if content is not None:
+            return content
+
+        if store.mode == cool_store.REPLAY:
+            logging.debug("tile %s is not in the tile store", address)
+
+            return None
+
+    response = get_tile(url)
+
+    if response is None:
+        return None
+
+    if store is not None and response.content:
+        store.put(*address, response.content)
+
+    return response.content
+
+
+def _get_tile_store():
+    """gets the optional on-disk tile store using logic to ensure it's only opened once
+
+    the store is enabled by setting `TILE_STORE` to a folder
+
+    Args:
+        None
+
+    Returns:
+        cool_store.TileStore: the tile store or None when it is not configured
+    """
+    global TILE_STORE  # pylint: disable=global-statement
+
+    folder = getenv("TILE_STORE")
+
+    if not folder:
+        return None
+
+    with _SESSION_LOCK:
+        if TILE_STORE is None:
+            logging.info("opening tile store %s", folder)
+            TILE_STORE = cool_store.TileStore(
+                folder,
+                mode=getenv("TILE_STORE_MODE") or cool_store.CACHE,
+                max_bytes=int(getenv("TILE_STORE_MAX_BYTES") or 0),
+            )
+
+    return TILE_STORE
+
+
+def _close_tile_store():
+    """close the tile store if it was opened
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    global TILE_STORE  # pylint: disable=global-statement
+
+    with _SESSION_LOCK:
+        if TILE_STORE is not None:
+            TILE_STORE.close()
+            TILE_STORE = None
+
+
+def prefetch_tiles(rows, depth):
+    """download the tiles for upcoming rows while the caller works on the current row
+
+    Args:
+        rows (iterator): index rows with `col_num` and `row_num` attributes
+        depth (int): the number of rows to download ahead of the caller
+
+    Yields:
+        tuple: the row and its tiles from `download_tiles`
+    """
+    if depth < 1:
+        for row in rows:
+            yield row, download_tiles(row.col_num, row.row_num, None)
+
+        return
+
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=depth, thread_name_prefix="prefetch") as executor:
+        for row in rows:
+            pending.append((row, executor.submit(download_tiles, row.col_num, row.row_num, None)))
+
+            if len(pending) > depth:
+                row, future = pending.popleft()
+
+                yield row, future.result()
+
+        while pending:
+            row, future = pending.popleft()
+
+            yield row, future.result()
+
+
+def build_mosaic_image(tiles, col, row, out_dir, buffer=None, rgb=False, layout=None):
+    """build a mosaic image from a list of cv2 images
+
+    Args:
+        images (list): list of cv2 images to mosaic together
+        col (str): the column of the WMTS index for the tile of interest (top-left tile)
+        row (str): the row of the WMTS index for the tile of interest (top-left tile)
+        out_dir (Path): location to save the result
+        buffer (np.ndarray): a reusable array to build the mosaic in, see `acquire_mosaic_buffer` (optional)
+        rgb (bool): True to build the mosaic in the RGB order the model expects (optional)
+        layout (SimpleNamespace): the mosaic layout, see `get_mosaic_layout` (optional)
+
+    Returns:
+        mosaic_image (np.ndarray): composite mosaic of smaller images
+    """
+    import cv2  # pylint: disable=import-outside-toplevel
+
+    tile_name = f"{col}_{row}"
+
+    if tiles is None or len(tiles) == 0:
+        logging.info("no images to mosaic for %s", tile_name)
+
+        return None
+
+    logging.debug("mosaicking images for %s", tile_name)
+    logging.debug("mosaic is starting with %s", type(tiles[0]))
+
+    mosaic_image = assemble_mosaic(tiles, buffer, rgb, layout)
+
+    logging.debug("mosaic is returning %s", type(mosaic_image))
+
+    if out_dir:
+        if not out_dir.exists():
+            out_dir.mkdir(parents=True)
+
+        mosaic_outfile = out_dir / f"{tile_name}_mosaic.jpg"
+        logging.debug("saving to %s", mosaic_outfile)
+        cv2.imwrite(str(mosaic_outfile), reorder_colors_to_bgr(mosaic_image) if rgb else mosaic_image)
+
+        return mosaic_image
+
+    logging.debug("no output directory provided")
+
+    return mosaic_image
+
+
+def assemble_mosaic(tiles, buffer=None, rgb=True, layout=None):
+    """decode tiles straight into their place in a mosaic image
+
+    the tiles are decoded at the same time since cv2 releases the GIL and each decoded tile is color converted
+    directly into a view of the mosaic so the mosaic is never copied
+
+    Args:
+        tiles (list): list of tile bytes ordered by row then column, see `download_tiles`
+        buffer (np.ndarray): a size x size x 3 array to reuse for the mosaic, see `acquire_mosaic_buffer` (optional)
+        rgb (bool): True to store the colors as RGB for the model, False to keep the cv2 BGR order (optional)
+        layout (SimpleNamespace): the mosaic layout, see `get_mosaic_layout` (optional)
+
+    Returns:
+        mosaic_image (np.ndarray): composite mosaic of smaller images
+    """
+    import cv2  # pylint: disable=import-outside-toplevel
+
+    layout = layout or get_mosaic_layout()
+    #: every image is 256x256 and the tiles on the edges are cropped to the offset and the overlap
+    tile_width = TILE_SIZE
+    number_columns = layout.tiles
+    size = layout.size
+    offset_x, offset_y = layout.offset
+
+    if buffer is None or buffer.shape[:2] != (size, size):
+        buffer = np.empty((size, size, 3), dtype=np.uint8)
+
+    #: missing tiles leave a white background
+    if len(tiles) < number_columns * number_columns:
+        buffer[:, :] = (255, 255, 255)
+
+    code = cv2.COLOR_BGR2RGB if rgb else None
+
+    def paste(i):
+        #: find the place of the image in the mosaic
+        row_start = (math.floor(i / number_columns)) * tile_width - offset_y
+        col_start = (i % number_columns) * tile_width - offset_x
+        view = buffer[max(row_start, 0) : row_start + tile_width, max(col_start, 0) : col_start + tile_width]
+
+        if not view.size:
+            return
+
+        #: convert from bytes to cv2
+        img = convert_to_cv2_image(tiles[i])
+
+        if img is None:
+            raise ValueError(f"tile {i} could not be decoded")
+
+        #: add image into the mosaic
+        top, left = max(-row_start, 0), max(-col_start, 0)
+        img = img[top : top + view.shape[0], left : left + view.shape[1]]
+
+        if code is None:
+            view[:] = img
+        else:
+            cv2.cvtColor(img, code, dst=view)
+
+    #: list forces any decoding errors to be raised here
+    list(_get_decode_executor().map(paste, range(len(tiles))))
+
+    return buffer
+
+
+def _get_decode_executor():
+    """gets the thread pool used to decode tiles using logic to ensure it's only created once
+
+    Args:
+        None
+
+    Returns:
+        ThreadPoolExecutor: the shared tile decoding thread pool
+    """
+    global DECODE_EXECUTOR  # pylint: disable=global-statement
+
+    with _SESSION_LOCK:
+        if DECODE_EXECUTOR is None:
+            DECODE_EXECUTOR = ThreadPoolExecutor(
+                max_workers=int(getenv("DECODE_WORKERS") or 4), thread_name_prefix="decode"
+            )
+
+    return DECODE_EXECUTOR
+
+
+def acquire_mosaic_buffer(layout=None):
+    """take a mosaic buffer from the pool of reusable buffers, creating one when the pool is empty
+
+    Args:
+        layout (SimpleNamespace): the mosaic layout, see `get_mosaic_layout` (optional)
+
+    Returns:
+        np.ndarray: a size x size x 3 array, 512x512x3 for the default 2x2 mosaics
+    """
+    size = (layout or get_mosaic_layout()).size
+
+    while True:
+        try:
+            buffer = _MOSAIC_BUFFERS.get_nowait()
+        except Empty:
+            return np.empty((size, size, 3), dtype=np.uint8)
+
+        #: buffers of another layout are dropped
+        if buffer.shape[:2] == (size, size):
+            return buffer
+
+
+def release_mosaic_buffer(buffer):
+    """return a mosaic buffer to the pool once the model is done with it
+
+    Args:
+        buffer (np.ndarray): the buffer from `acquire_mosaic_buffer`
+
+    Returns:
+        None
+    """
+    if buffer is not None:
+        _MOSAIC_BUFFERS.put(buffer)
+
+
+def load_pytorch_model(backend=None):
+    """load pytorch model with tower scout weights
+
+    Args:
+        backend (str): the inference backend, one of `MODEL_WEIGHTS`. defaults to `INFERENCE_BACKEND` (optional)
+
+    Returns:
+        pytorch model: model ready for scanning
+    """
+    import torch  # pylint: disable=import-outside-toplevel
+
+    model_weight_path = get_model_weight_path(backend)
+    yolov5_path = Path(__file__).parent / "yolov5"
+
+    if not model_weight_path.is_file():
+        logging.error("the model weights file does not exist: %s", model_weight_path)
+
+        raise FileNotFoundError("the model weights file does not exist")
+
+    if not yolov5_path.is_dir():
         logging.error("the yolov5 directory does not exist, was it cloned? %s", yolov5_path)
 
         raise FileNotFoundError("the yolov5 directory does not exist")
@@ -486,6 +2123,57 @@ def load_pytorch_model():
     return model
 
 
+def get_model_weight_path(backend=None):
+    """get the path to the tower scout weights for an inference backend
+
+    Args:
+        backend (str): the inference backend, one of `MODEL_WEIGHTS`. defaults to `INFERENCE_BACKEND` (optional)
+
+    Returns:
+        Path: the weights file
+    """
+    backend = backend or getenv("INFERENCE_BACKEND") or "pytorch"
+
+    if backend not in MODEL_WEIGHTS:
+        raise ValueError(f"unknown inference backend: {backend}")
+
+    return Path(__file__).parent / "tower_scout" / MODEL_WEIGHTS[backend]
+
+
+def export_model(formats=("onnx",)):
+    """export the tower scout pytorch weights for the other inference backends with the yolov5 exporter
+
+    the exported files are written next to the pytorch weights
+
+    Args:
+        formats (tuple): the yolov5 export formats e.g. onnx, torchscript (optional)
+
+    Returns:
+        list: the paths of the exported weights
+    """
+    model_weight_path = get_model_weight_path("pytorch")
+    export_path = Path(__file__).parent / "yolov5" / "export.py"
+
+    if not model_weight_path.is_file():
+        logging.error("the model weights file does not exist: %s", model_weight_path)
+
+        raise FileNotFoundError("the model weights file does not exist")
+
+    if not export_path.is_file():
+        logging.error("the yolov5 directory does not exist, was it cloned? %s", export_path.parent)
+
+        raise FileNotFoundError("the yolov5 directory does not exist")
+
+    #: a dynamic batch axis lets batched detection run through the exported model
+    command = [sys.executable, str(export_path), "--weights", str(model_weight_path), "--imgsz", "640", "--dynamic"]
+    command += ["--include", *formats]
+
+    logging.info("exporting the model: %s", " ".join(command))
+    subprocess.run(command, check=True)
+
+    return [get_model_weight_path(backend) for backend in formats]
+
+
 def _get_model():
     """gets pytorch model using logic to ensure it's only loaded once
 
@@ -499,25 +2187,20 @@ def _get_model():
 
     if MODEL is None:
         logging.info("loading pytorch model")
-        MODEL = load_pytorch_model()
+        MODEL = configure_model(load_pytorch_model())
 
     return MODEL
 
 
-def detect_towers(image):
-    """run pytorch model with tower scout weight on an image to detect cooling towers
+def configure_model(model):
+    """set the detection thresholds used for every scan on a model
 
     Args:
-        image (obj): Path object to local image file or np.ndarray object of in-memory file
+        model: loaded pytorch model
 
     Returns:
-        result (obj): pytorch result object
+        model: the model ready for use
     """
-    if image is None:
-        logging.warning("no image to detect towers on: %s", type(image))
-        return None
-
-    towerscout_model = _get_model()
 
     #: adjust model confidence threshold for accepting a detection
     #: model.conf - range of values is 0 to 1
@@ -525,34 +2208,102 @@ def detect_towers(image):
     #: default value is 0.25, but we've noticed it missing some cooling towers
     #: 0.005 gets more, but 0.007 seems to be a decent distinguishing value
     #: we want to detect more than necessary, we can always weed out bad ones with a query later
-    logging.debug("initial model confidence threshold: %s", towerscout_model.conf)
-    towerscout_model.conf = 0.007
-    logging.debug("adjusted model confidence threshold: %s", towerscout_model.conf)
+    logging.debug("initial model confidence threshold: %s", model.conf)
+    model.conf = 0.007
+    logging.debug("adjusted model confidence threshold: %s", model.conf)
 
     #: adjust model overlap threshold for accepting a detection (higher means more detections)
     #: model.iou - range of values is 0 to 1
     #: higher values mean greater overlap is allowed (more detections)
     #: lower values mean more spacing is required between detections (fewer detections)
     #: we want lower, so the same tower isn't detected multiple times
-    logging.debug("initial model confidence threshold: %s", towerscout_model.iou)
-    towerscout_model.iou = 0.25
-    logging.debug("adjusted model confidence threshold: %s", towerscout_model.iou)
+    logging.debug("initial model confidence threshold: %s", model.iou)
+    model.iou = 0.25
+    logging.debug("adjusted model confidence threshold: %s", model.iou)
+
+    return model
+
+
+def detect_towers(image, rgb=False, layout=None):
+    """run pytorch model with tower scout weight on an image to detect cooling towers
+
+    Args:
+        image (obj): Path object to local image file or np.ndarray object of in-memory file
+        rgb (bool): True when a np.ndarray image is already in RGB order and can be used without a copy (optional)
+        layout (SimpleNamespace): the layout of the mosaic for the model input size, see `get_mosaic_layout`
+            (optional)
+
+    Returns:
+        result (obj): pytorch result object
+    """
+    if image is None:
+        logging.warning("no image to detect towers on: %s", type(image))
+        return None
+
+    towerscout_model = _get_model()
 
-    if isinstance(image, np.ndarray):
+    if isinstance(image, np.ndarray) and not rgb:
         image = reorder_colors_to_rgb(image)
 
-    results = towerscout_model(image)
+    results = towerscout_model(image, size=get_inference_size(layout))
 
     return results
 
 
-def locate_results(results, col, row):
+def detect_towers_batch(images, keys, batch_size=None, rgb=False):
+    """run pytorch model with tower scout weights on many images at once to detect cooling towers
+
+    Args:
+        images (list): np.ndarray images or a stacked np.ndarray of images. None items are skipped
+        keys (list): the (col, row) of each image
+        batch_size (int): the maximum number of images in a single forward pass (optional)
+        rgb (bool): True when the images are already in RGB order and can be used without a copy (optional)
+
+    Returns:
+        list: a (key, result) tuple for each image. the result is None when the image is None
+    """
+    batch_size = batch_size or _get_detect_batch_size()
+    keys = list(keys)
+    results = [None] * len(keys)
+
+    #: keep track of the position of each real image so the results can be tied back to the keys
+    positions = [i for i, image in enumerate(images) if image is not None]
+
+    if positions:
+        towerscout_model = _get_model()
+        size = get_inference_size()
+
+        for start in range(0, len(positions), batch_size):
+            chunk = positions[start : start + batch_size]
+            batch = [images[i] if rgb else reorder_colors_to_rgb(images[i]) for i in chunk]
+
+            #: a single forward pass for every image in the chunk, then split it into one result per image
+            for i, result in zip(chunk, towerscout_model(batch, size=size).tolist()):
+                results[i] = result
+
+    return list(zip(keys, results))
+
+
+def _get_detect_batch_size():
+    """the number of mosaics to run through the model in one forward pass
+
+    Args:
+        None
+
+    Returns:
+        int: the batch size
+    """
+    return int(getenv("DETECT_BATCH_SIZE") or 1)
+
+
+def locate_results(results, col, row, zoom=20):
     """locate detection results and calculate coordinates
 
     Args:
         results_df (dataframe): dataframe with results from pytorch model
         col (str): the column of the WMTS index for the tile of interest (top-left tile)
         row (str): the row of the WMTS index for the tile of interest (top-left tile)
+        zoom (int): the WMTS zoom level of the tiles (optional)
 
     Returns:
         results_df (dataframe): results dataframe with additional columns that were calculated
@@ -565,19 +2316,118 @@ def locate_results(results, col, row):
 
         return results_df
 
-    zoom_level = 20
+    if not _is_valid_tile(col, row, zoom):
+        return results_df
+
+    return _locate_detections(results_df, int(col), int(row), zoom)
+
+
+def locate_results_batch(results, keys, zoom=20):
+    """locate the detection results for many mosaics at once
+
+    Args:
+        results (list): pytorch result objects, one for each mosaic
+        keys (list): the (col, row) of the top-left tile of each mosaic
+        zoom (int): the WMTS zoom level of the tiles (optional)
+
+    Returns:
+        list: a (key, results_df) tuple for each mosaic
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    keys = list(keys)
+    frames = [result.pandas().xyxy[0] for result in results]
+    located = list(frames)
+
+    #: mosaics with detections and valid tile coordinates are located together
+    positions = [i for i, (col, row) in enumerate(keys) if not frames[i].empty and _is_valid_tile(col, row, zoom)]
+
+    if positions:
+        sizes = [len(frames[i].index) for i in positions]
+        cols = np.repeat([int(keys[i][0]) for i in positions], sizes)
+        rows = np.repeat([int(keys[i][1]) for i in positions], sizes)
+
+        combined = _locate_detections(pd.concat([frames[i] for i in positions], ignore_index=True), cols, rows, zoom)
 
-    #: get upper-left coordinates of the primary tile (upper-left tile)
+        ends = np.cumsum(sizes)
+        for i, end, size in zip(positions, ends, sizes):
+            located[i] = combined.iloc[end - size : end].reset_index(drop=True)
+
+    return list(zip(keys, located))
+
+
+def _is_valid_tile(col, row, zoom):
+    """check that a col and row are inside the WMTS tile matrix
+
+    Args:
+        col (str): the column of the WMTS index
+        row (str): the row of the WMTS index
+        zoom (int): the WMTS zoom level
+
+    Returns:
+        bool: True when the tile exists
+    """
     try:
-        tile = mercantile.ul(int(col), int(row), zoom_level)
+        col, row = int(col), int(row)
     except ValueError as error:
         logging.error("error getting tile coordinates on %s, %s: %s", col, row, error, exc_info=True)
 
-        return results_df
+        return False
+
+    if not (0 <= col < 2**zoom and 0 <= row < 2**zoom):
+        logging.error("error getting tile coordinates on %s, %s: outside of zoom level %s", col, row, zoom)
+
+        return False
+
+    return True
+
+
+def tile_origins_3857(cols, rows, zoom=20):
+    """calculate the web mercator (3857) coordinates of the upper-left corner of tiles
+
+    Args:
+        cols (array-like): the columns of the WMTS index
+        rows (array-like): the rows of the WMTS index
+        zoom (int): the WMTS zoom level (optional)
+
+    Returns:
+        tuple: the np.ndarray x and y coordinates
+    """
+    tile_meters = 2 * WEB_MERCATOR_HALF_WIDTH / 2**zoom
+
+    x = np.asarray(cols, dtype=np.float64) * tile_meters - WEB_MERCATOR_HALF_WIDTH
+    y = WEB_MERCATOR_HALF_WIDTH - np.asarray(rows, dtype=np.float64) * tile_meters
+
+    return x, y
+
+
+def meters_per_pixel(zoom=20):
+    """the ground size of a tile pixel in web mercator (3857) meters
+
+    Args:
+        zoom (int): the WMTS zoom level (optional)
+
+    Returns:
+        float: the meters per pixel
+    """
+    return 2 * WEB_MERCATOR_HALF_WIDTH / (TILE_SIZE * 2**zoom)
+
+
+def _locate_detections(results_df, cols, rows, zoom):
+    """add the pixel and web mercator centroids to detections
+
+    Args:
+        results_df (dataframe): dataframe with results from pytorch model
+        cols (int or np.ndarray): the column of the top-left tile for every detection
+        rows (int or np.ndarray): the row of the top-left tile for every detection
+        zoom (int): the WMTS zoom level of the tiles
 
+    Returns:
+        results_df (dataframe): results dataframe with additional columns that were calculated
+    """
     #: calculate centroid in pixels
-    results_df["centroid_x_px"] = (results_df["xmin"] + results_df["xmax"]) / 2
-    results_df["centroid_y_px"] = (results_df["ymin"] + results_df["ymax"]) / 2
+    results_df["centroid_x_px"] = (results_df["xmin"].to_numpy() + results_df["xmax"].to_numpy()) / 2
+    results_df["centroid_y_px"] = (results_df["ymin"].to_numpy() + results_df["ymax"].to_numpy()) / 2
 
     results_df.rename(
         columns={
@@ -591,19 +2441,13 @@ def locate_results(results, col, row):
         inplace=True,
     )
 
-    #: project tile coords to web mercator (3857)
-    wgs84 = 4326
-    web_mercator = 3857
-
-    transformer = pyproj.Transformer.from_crs(
-        pyproj.CRS.from_epsg(wgs84), pyproj.CRS.from_epsg(web_mercator), always_xy=True
-    )
-    x, y = transformer.transform(tile.lng, tile.lat)  # pylint: disable=unpacking-non-sequence
+    #: get upper-left coordinates of the primary tile (upper-left tile) in web mercator (3857)
+    x, y = tile_origins_3857(cols, rows, zoom)
 
     #: calculate centroid x/y coords in web mercator
-    meters_per_pixel = 0.1492910708688
-    results_df["centroid_x_3857"] = x + results_df["centroid_x_px"] * meters_per_pixel
-    results_df["centroid_y_3857"] = y - results_df["centroid_y_px"] * meters_per_pixel
+    resolution = meters_per_pixel(zoom)
+    results_df["centroid_x_3857"] = x + results_df["centroid_x_px"].to_numpy() * resolution
+    results_df["centroid_y_3857"] = y - results_df["centroid_y_px"].to_numpy() * resolution
 
     return results_df
 
@@ -623,10 +2467,10 @@ def append_results(results_df):
     try:
         task_start = perf_counter()
 
-        rows = results_df.to_sql(
-            "cooling_tower_results", POOL, if_exists="append", index=False, method="multi", chunksize=1000
-        )
+        with _get_pool().begin() as conn:
+            rows = write_results(results_df, conn)
 
+        cool_metrics.observe("append_seconds", perf_counter() - task_start)
         logging.info("update cooling_tower_results query: %s", format_time(perf_counter() - task_start))
         if rows > 0:
             status = "SUCCESS"
@@ -636,38 +2480,351 @@ def append_results(results_df):
     return status
 
 
-def update_index(col, row):
-    """update the `images_within_habitat` table after a row is processed
+def write_results(results_df, conn, table=RESULTS_TABLE, method=None):
+    """append results into a results table with the configured writer
 
     Args:
-        col (str): the column of the WMTS index for the tile of interest (top-left tile)
-        row (str): the row of the WMTS index for the tile of interest (top-left tile)
+        results_df (dataframe): dataframe with cooling tower detection results
+        conn (sqlalchemy.engine.Connection): the connection and transaction to write with
+        table (str): the table to append to (optional)
+        method (str): `copy` to stream the rows with COPY or `insert` for a multi row INSERT (optional)
 
     Returns:
-        None
+        int: the number of rows written
     """
+    method = method or getenv("RESULTS_WRITER") or "copy"
 
-    #: create dml statement to update specific row
-    sql = sqlalchemy.text(
-        f"""
-    UPDATE images_within_habitat
+    if method == "copy" and conn.dialect.driver in COPY_DRIVERS:
+        return copy_results(results_df, conn, table)
+
+    if method == "copy":
+        logging.debug("the %s driver can not COPY, inserting the results", conn.dialect.driver)
+
+    return results_df.to_sql(table, conn, if_exists="append", index=False, method="multi", chunksize=1000)
+
+
+def copy_results(results_df, conn, table=RESULTS_TABLE):
+    """stream results into a results table with COPY FROM STDIN
+
+    the connection must use one of the `COPY_DRIVERS`
+
+    Args:
+        results_df (dataframe): dataframe with cooling tower detection results
+        conn (sqlalchemy.engine.Connection): the connection and transaction to write with
+        table (str): the table to append to (optional)
+
+    Returns:
+        int: the number of rows written
+    """
+    columns = ", ".join(f'"{column}"' for column in results_df.columns)
+
+    data = io.StringIO()
+    results_df.to_csv(data, index=False, header=False)
+    data.seek(0)
+
+    sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    #: the raw driver cursor shares the connection, and the transaction, of the sqlalchemy connection
+    cursor = conn.connection.cursor()
+
+    try:
+        #: each driver streams the rows with its own api
+        if conn.dialect.driver == "psycopg2":
+            cursor.copy_expert(sql, data)
+        elif conn.dialect.driver == "psycopg":
+            with cursor.copy(sql) as copy:
+                copy.write(data.getvalue())
+        else:
+            cursor.execute(sql, stream=data)
+    finally:
+        cursor.close()
+
+    return len(results_df.index)
+
+
+def create_staging_table(worker):
+    """create a per task table to collect results in until they are merged into the results table
+
+    Args:
+        worker (str): the name of the task
+
+    Returns:
+        str: the name of the staging table
+    """
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    table = f"{RESULTS_TABLE}_{re.sub(r'[^a-z0-9]+', '_', worker.lower())}"
+
+    with _get_pool().begin() as conn:
+        conn.execute(sqlalchemy.text(f"CREATE TABLE IF NOT EXISTS {table} (LIKE {RESULTS_TABLE} INCLUDING ALL)"))
+
+    logging.info("staging results in %s", table)
+
+    return table
+
+
+def merge_staging_table(table):
+    """move the results from a staging table into the results table and drop the staging table
+
+    Args:
+        table (str): the name of the staging table
+
+    Returns:
+        string: status of the merge operation FAIL or SUCCESS
+    """
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    try:
+        task_start = perf_counter()
+
+        with _get_pool().begin() as conn:
+            rows = conn.execute(sqlalchemy.text(f"INSERT INTO {RESULTS_TABLE} SELECT * FROM {table}")).rowcount
+            conn.execute(sqlalchemy.text(f"DROP TABLE {table}"))
+
+        logging.info("merged %i rows from %s: %s", rows, table, format_time(perf_counter() - task_start))
+    except Exception as ex:
+        logging.error("unable to merge the staging table %s! %s", table, ex)
+
+        return "FAIL"
+
+    return "SUCCESS"
+
+
+class ResultWriter:
+    """buffers processed rows and their detections and saves them together in a single transaction
+
+    the buffer is flushed when it holds `max_rows` rows, when the oldest row has waited `max_seconds`, and
+    when the writer is closed
+
+    Args:
+        max_rows (int): the number of buffered rows that triggers a flush (optional)
+        max_seconds (float): the age of the oldest buffered row that triggers a flush (optional)
+        table (str): the table to append the results to (optional)
+        spool (cool_spool.Spool): a local spool to write to instead of the database, the spool loads the rows into
+            the database in the background (optional)
+        queue (cool_queue.WorkQueue): a local work queue to mark the rows processed in (optional)
+        dedupe (cool_dedupe.DuplicateFilter): drops the detections already kept from a neighboring mosaic (optional)
+    """
+
+    def __init__(
+        self, max_rows=None, max_seconds=None, table=RESULTS_TABLE, spool=None, queue=None, dedupe=None
+    ):  # pylint: disable=too-many-arguments
+        self.table = table
+        self.spool = spool
+        self.queue = queue
+        self.dedupe = dedupe
+        self.max_rows = max_rows or int(getenv("PERSIST_FLUSH_ROWS") or 25)
+        self.max_seconds = max_seconds or float(getenv("PERSIST_FLUSH_SECONDS") or 30)
+
+        self._lock = Lock()
+        self._processed = []
+        self._results = []
+        self._oldest = None
+        self._completed = 0
+        self._closed = Event()
+        self._timer = Thread(target=self._flush_when_due, name="persist-timer", daemon=True)
+        self._timer.start()
+
+    def add(self, col, row, results_df=None):
+        """buffer a processed row and its detections
+
+        Args:
+            col (str): the column of the WMTS index for the tile of interest (top-left tile)
+            row (str): the row of the WMTS index for the tile of interest (top-left tile)
+            results_df (dataframe): the located detections for the row (optional)
+
+        Returns:
+            None
+        """
+        if self.dedupe is not None:
+            results_df = self.dedupe.filter(col, row, results_df)
+
+        detections = 0 if results_df is None else len(results_df.index)
+        cool_metrics.increment("rows_processed")
+        cool_metrics.increment("detections", detections)
+        cool_metrics.observe("detections_per_row", detections, cool_metrics.COUNT_BUCKETS)
+
+        with self._lock:
+            self._processed.append((int(col), int(row)))
+            self._completed += 1
+
+            if results_df is not None and len(results_df.index) > 0:
+                self._results.append(results_df)
+
+            if self._oldest is None:
+                self._oldest = perf_counter()
+
+            due = len(self._processed) >= self.max_rows
+
+        if due:
+            self.flush()
+
+    def completed(self):
+        """count the rows added to the writer
+
+        Args:
+            None
+
+        Returns:
+            int: the number of rows that finished processing
+        """
+        with self._lock:
+            return self._completed
+
+    def flush(self):
+        """save everything in the buffer
+
+        Args:
+            None
+
+        Returns:
+            string: status of the save operation FAIL or SUCCESS
+        """
+        with self._lock:
+            processed, results = self._processed, self._results
+            self._processed, self._results, self._oldest = [], [], None
+
+        if not processed:
+            return "SUCCESS"
+
+        if self.spool is not None:
+            try:
+                return self.spool.write(processed, results)
+            except OSError as ex:
+                logging.error("unable to spool %i processed rows, saving them directly! %s", len(processed), ex)
+
+        status = save_processed_rows(processed, results, self.table, queue=self.queue)
+
+        if status != "SUCCESS":
+            with self._lock:
+                #: keep the rows ahead of the newer ones so the next flush, at the latest on close, saves them
+                self._processed[:0] = processed
+                self._results[:0] = results
+
+                if self._oldest is None:
+                    self._oldest = perf_counter()
+
+        return status
+
+    def close(self):
+        """stop the flush timer and save everything in the buffer
+
+        Args:
+            None
+
+        Returns:
+            string: status of the final save operation FAIL or SUCCESS
+        """
+        self._closed.set()
+        status = self.flush()
+
+        if self.spool is not None:
+            status = self.spool.close()
+
+        return status
+
+    def _flush_when_due(self):
+        """flush the buffer from a background thread when the oldest row has waited too long"""
+        while not self._closed.wait(min(self.max_seconds, 1)):
+            with self._lock:
+                due = self._oldest is not None and perf_counter() - self._oldest >= self.max_seconds
+
+            if due:
+                self.flush()
+
+
+def _index_update_sql():
+    """the dml statement to mark every processed row at once from arrays of cols and rows"""
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    return sqlalchemy.text(
+        """
+    UPDATE images_within_habitat AS habitat
     SET processed = true
-    WHERE col_num = {col} AND row_num = {row}
+    FROM unnest(CAST(:cols AS int[]), CAST(:rows AS int[])) AS done(col_num, row_num)
+    WHERE habitat.col_num = done.col_num AND habitat.row_num = done.row_num
     """
     )
 
+
+def save_processed_rows(processed, results, table=RESULTS_TABLE, queue=None):
+    """append detections and mark their rows as processed in a single transaction
+
+    Args:
+        processed (list): (col, row) tuples of the processed rows
+        results (list): dataframes with cooling tower detection results
+        table (str): the table to append the results to (optional)
+        queue (cool_queue.WorkQueue): a local work queue to mark the rows processed in instead of the database,
+            once the results are committed (optional)
+
+    Returns:
+        string: status of the save operation FAIL or SUCCESS
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    cols = [col for col, _ in processed]
+    rows = [row for _, row in processed]
+
     try:
         task_start = perf_counter()
-        with POOL.connect() as conn:
-            conn.execute(sql)
-            conn.commit()
+        detections = 0
+
+        #: the queue is synced to the database separately so rows without detections need no transaction
+        if queue is None or results:
+            with _get_pool().begin() as conn:
+                if results:
+                    results_df = pd.concat(results, ignore_index=True)
+                    detections = len(results_df.index)
+
+                    write_results(results_df, conn, table)
+                    cool_metrics.observe("append_seconds", perf_counter() - task_start)
 
-            logging.info("update images_within_habitat query: %s", format_time(perf_counter() - task_start))
+                if queue is None:
+                    index_start = perf_counter()
+                    conn.execute(_index_update_sql(), {"cols": cols, "rows": rows})
+                    cool_metrics.observe("index_update_seconds", perf_counter() - index_start)
 
+        if queue is not None:
+            queue.mark_done(processed)
+
+        cool_metrics.observe("save_seconds", perf_counter() - task_start)
+        cool_metrics.increment("rows_saved", len(processed))
+        logging.info(
+            "saved %i rows with %i results: %s", len(processed), detections, format_time(perf_counter() - task_start)
+        )
     except Exception as ex:
-        logging.error("unable to update index on col: %i, row: %i, %s", col, row, ex)
+        cool_metrics.increment("save_failures")
+        logging.error("unable to save %i processed rows! %s", len(processed), ex)
 
-        return
+        return "FAIL"
+
+    return "SUCCESS"
+
+
+def update_index_rows(processed):
+    """mark rows as processed in the `images_within_habitat` table, e.g. to sync a local work queue
+
+    Args:
+        processed (list): (col, row) tuples of the processed rows
+
+    Returns:
+        string: status of the update operation FAIL or SUCCESS
+    """
+    try:
+        task_start = perf_counter()
+
+        with _get_pool().begin() as conn:
+            conn.execute(
+                _index_update_sql(), {"cols": [col for col, _ in processed], "rows": [row for _, row in processed]}
+            )
+
+        cool_metrics.observe("index_update_seconds", perf_counter() - task_start)
+        logging.info("synced %i processed rows: %s", len(processed), format_time(perf_counter() - task_start))
+    except Exception as ex:
+        logging.error("unable to sync %i processed rows! %s", len(processed), ex)
+
+        return "FAIL"
+
+    return "SUCCESS"
 
 
 def format_time(seconds):
@@ -8,12 +8,36 @@ Usage:
     cool_cli.py detect-towers <file_name> [(--locate-results <col> <row>)]
     cool_cli.py process-tiles <col> <row> [--save-to=location]
     cool_cli.py process-upload <skip> <take>
+    cool_cli.py export-model [--format=format...]
+    cool_cli.py quantize-model <mosaics> [--method=method --limit=count]
+    cool_cli.py recall-report <mosaics> [--backend=backend --iou=threshold --limit=count]
+    cool_cli.py tune-workers <col> <row> [--workers=counts --rows=count]
+    cool_cli.py evaluate-prescreen <labels> [--checks=names]
+    cool_cli.py create-queue <queue> [--parquet=file]
+    cool_cli.py queue-status <queue>
+    cool_cli.py sync-queue <queue> [--rewind]
+    cool_cli.py process-queue <queue> [--job-size=rows]
+    cool_cli.py evaluate-cascade <blocks> [--cascade-zoom=zoom --thresholds=list --truth-confidence=value]
 
 Options:
     --from=location                 The bucket or directory to operate on
     --task-index=index              The index of the task running
     --instances=size                The number of containers running the job [default: 10]
     --save-to=location              The location to output the stuff
+    --format=format                 The yolov5 export format e.g. onnx, torchscript [default: onnx]
+    --method=method                 The quantization method, static or dynamic [default: static]
+    --limit=count                   The maximum number of mosaics to use [default: 100]
+    --backend=backend               The inference backend compared to pytorch [default: onnx-int8]
+    --iou=threshold                 The overlap for a detection to match the pytorch model [default: 0.5]
+    --workers=counts                The comma separated numbers of inference processes to try [default: 1,2,4]
+    --rows=count                    The number of rows to process for each number of processes [default: 20]
+    --checks=names                  The comma separated pre-screen checks to evaluate [default: bytes,uniform,edges]
+    --parquet=file                  A habitat parquet file to fill the queue from instead of the unprocessed rows
+    --rewind                        Release every lease so rows claimed by processes that died are claimed again
+    --job-size=rows                 The most rows to process, 0 processes the whole queue [default: 0]
+    --cascade-zoom=zoom             The zoom of the coarse mosaics of the cascade [default: 19]
+    --thresholds=list               The comma separated coarse confidences to compare [default: 0.01,0.05,0.1,0.25]
+    --truth-confidence=value        The lowest confidence of a zoom 20 detection that counts as a tower [default: 0.25]
 Examples:
     python cool_cli.py download-tiles 198259 394029 --save-to=./tiles
     python cool_cli.py download-tiles 198259 394029 --save-to=./mosaics --mosaic
@@ -21,11 +45,22 @@ Examples:
     python cool_cli.py detect-towers ./mosaics/198263_394029_mosaic.jpg --locate-results 198263 394029
     python cool_cli.py process-tiles 198263 394029 --save-to=./results
     python cool_cli.py process-upload 10 20
+    python cool_cli.py export-model --format=onnx --format=torchscript
+    python cool_cli.py quantize-model ./mosaics --limit=200
+    python cool_cli.py recall-report ./mosaics --backend=onnx-int8
+    python cool_cli.py tune-workers 198263 394029 --workers=1,2,4,8
+    python cool_cli.py evaluate-prescreen ./labels.csv --checks=bytes,edges
+    python cool_cli.py create-queue ./queue.bin --parquet=./habitat.parquet
+    python cool_cli.py process-queue ./queue.bin
+    python cool_cli.py sync-queue ./queue.bin
+    python cool_cli.py evaluate-cascade ./blocks.csv --cascade-zoom=18 --thresholds=0.05,0.1
 
 
 """
 
+import csv
 import logging
+import os
 from pathlib import Path
 from sys import stdout
 
@@ -142,6 +177,137 @@ def main():
 
         return
 
+    if args["export-model"]:
+        print("exporting model ...")
+        for path in cool.export_model(tuple(args["--format"])):
+            print(f"exported {path}")
+
+        return
+
+    if args["quantize-model"]:
+        import cool_quantize  # pylint: disable=import-outside-toplevel
+
+        images = cool_quantize.find_images(args["<mosaics>"], args["--limit"])
+
+        print(f"quantizing model with {len(images)} mosaics ...")
+        path = cool_quantize.quantize_model(images, args["--method"])
+        print(f"quantized {path}")
+
+        return
+
+    if args["recall-report"]:
+        import cool_quantize  # pylint: disable=import-outside-toplevel
+
+        images = cool_quantize.find_images(args["<mosaics>"], args["--limit"])
+
+        print(f"comparing {args['--backend']} to pytorch on {len(images)} mosaics ...")
+        report = cool_quantize.recall_report(images, args["--backend"], threshold=float(args["--iou"]))
+
+        print(report.to_string())
+
+        for key, value in cool_quantize.summarize_report(report).items():
+            print(f"{key}: {value}")
+
+        return
+
+    if args["tune-workers"]:
+        worker_counts = [int(count) for count in args["--workers"].split(",")]
+
+        print(f"processing {args['--rows']} rows with {worker_counts} inference processes ...")
+        report = cool.tune_workers(args["<col>"], args["<row>"], worker_counts, int(args["--rows"]))
+
+        for run in report:
+            print(
+                f"workers: {run['workers']} threads: {run['threads']} rows/sec: {run['rows_per_second']:.2f} "
+                f"rows/sec/worker: {run['rows_per_second'] / run['workers']:.2f}"
+            )
+
+        return
+
+    if args["evaluate-prescreen"]:
+        import cool_prescreen  # pylint: disable=import-outside-toplevel
+
+        checks = cool_prescreen.get_checks(args["--checks"])
+
+        print("evaluating pre-screen checks ...")
+        with open(args["<labels>"], newline="", encoding="utf-8") as labels:
+            report = cool_prescreen.evaluate(_load_labelled_mosaics(csv.DictReader(labels)), checks)
+
+        for run in report:
+            print(
+                f"{run['check']}: skipped {run['skipped']} of {run['mosaics']} mosaics ({run['skip_rate']:.1%}) "
+                f"lost {run['towers_lost']} of {run['towers']} towers in {run['mosaics_with_towers_skipped']} "
+                f"mosaics, recall: {run['recall']:.1%}"
+            )
+
+        return
+
+    if args["create-queue"]:
+        print("creating work queue ...")
+        queue = cool.create_work_queue(args["<queue>"], args["--parquet"])
+        print(f"queued {queue.count} rows in {args['<queue>']}")
+
+        return
+
+    if args["queue-status"]:
+        import cool_queue  # pylint: disable=import-outside-toplevel
+
+        for key, value in cool_queue.WorkQueue(args["<queue>"]).status().items():
+            print(f"{key}: {value}")
+
+        return
+
+    if args["sync-queue"]:
+        import cool_queue  # pylint: disable=import-outside-toplevel
+
+        queue = cool_queue.WorkQueue(args["<queue>"])
+
+        if args["--rewind"]:
+            queue.rewind()
+            print("released every lease")
+
+        print(f"synced {queue.sync(cool.update_index_rows)} processed rows")
+
+        return
+
+    if args["process-queue"]:
+        os.environ["WORK_QUEUE"] = args["<queue>"]
+
+        cool.process_all_tiles(os.getenv("JOB_NAME") or "local", os.getpid(), int(args["--job-size"]), 0, 0)
+
+        return
+
+    if args["evaluate-cascade"]:
+        levels = cool.get_cascade_levels(args["--cascade-zoom"])
+        thresholds = [float(value) for value in args["--thresholds"].split(",")]
+
+        print(f"comparing the zoom {args['--cascade-zoom']} cascade to a zoom 20 scan ...")
+        with open(args["<blocks>"], newline="", encoding="utf-8") as blocks:
+            report = cool.evaluate_cascade(
+                ((block["col"], block["row"]) for block in csv.DictReader(blocks)),
+                levels,
+                thresholds,
+                float(args["--truth-confidence"]),
+            )
+
+        for run in report:
+            print(
+                f"{run['threshold']}: refined {run['refined']} of {run['mosaics']} mosaics in {run['blocks']} blocks, "
+                f"found {run['towers_found']} of {run['towers']} towers, recall: {run['recall']:.1%}, "
+                f"inferences: {run['inference_ratio']:.1%} downloads: {run['download_ratio']:.1%} of a zoom 20 scan"
+            )
+
+        return
+
+
+def _load_labelled_mosaics(labels):
+    """download and mosaic the labelled rows of a csv with col, row, and towers columns"""
+    for label in labels:
+        col, row = label["col"], label["row"]
+        tiles = cool.download_tiles(col, row, None)
+
+        yield int(label["towers"]), tiles, cool.build_mosaic_image(tiles, col, row, None, rgb=True)
+
 
 if __name__ == "__main__":
     main()
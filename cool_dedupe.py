@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+DHHS Cooling Tower object detection
+Streaming suppression of the duplicate detections of neighboring mosaics
+
+A tower on the edge between two mosaics is detected once in each of them, either whole in both when the mosaics
+overlap or as two halves that meet at the shared edge. The detections kept from recent mosaics are held in a
+spatial hash grid in web mercator (3857) so each new detection is only compared to the few boxes near it. The rows
+are processed in `row_num, col_num` order so the boxes of the tile rows above the previous band of mosaics can no
+longer have a neighbor and are dropped, which keeps the memory bounded.
+
+Detections that are already kept have been buffered for the database so the first detection of a tower is the one
+that is saved. Duplicates across tasks are not suppressed.
+"""
+import logging
+import math
+from collections import defaultdict, namedtuple
+from os import getenv
+from threading import Lock
+
+import numpy as np
+
+import cool_metrics
+
+#: the mosaic edges a box touches
+LEFT, RIGHT, TOP, BOTTOM = 1, 2, 4, 8
+
+_Box = namedtuple("_Box", ["x_min", "y_min", "x_max", "y_max", "edges", "mosaic", "row"])
+
+
+def _overlap(low_a, high_a, low_b, high_b):
+    return min(high_a, high_b) - max(low_a, low_b)
+
+
+class DuplicateFilter:
+    """drops the detections that repeat a detection kept from a neighboring mosaic
+
+    Args:
+        resolution (float): the meters per mosaic pixel
+        mosaic_size (int): the width and height of the mosaics in pixels
+        keep_rows (int): the tile rows behind the newest row whose detections are kept for comparison
+        overlap (float): the share of the smaller box covered by a kept box that makes it a duplicate, defaults to
+            `DEDUPE_OVERLAP` or 0.5 (optional)
+        edge_pixels (float): the pixels from a mosaic edge a box has to reach to be half of a split tower, defaults
+            to `DEDUPE_EDGE_PIXELS` or 2 (optional)
+        cell_meters (float): the size of the hash grid cells (optional)
+    """
+
+    def __init__(
+        self, resolution, mosaic_size, keep_rows, overlap=None, edge_pixels=None, cell_meters=32
+    ):  # pylint: disable=too-many-arguments
+        self.resolution = resolution
+        self.mosaic_size = mosaic_size
+        self.keep_rows = keep_rows
+        self.overlap = overlap or float(getenv("DEDUPE_OVERLAP") or 0.5)
+        self.edge_pixels = edge_pixels if edge_pixels is not None else float(getenv("DEDUPE_EDGE_PIXELS") or 2)
+        self.cell_meters = cell_meters
+
+        self._lock = Lock()
+        self._cells = defaultdict(list)
+        #: the cells holding the boxes of each tile row so the old rows can be dropped
+        self._rows = defaultdict(set)
+        self._newest = None
+
+    def __len__(self):
+        with self._lock:
+            return len({box for cell in self._cells.values() for box in cell})
+
+    def filter(self, col, row, results_df):
+        """remove the detections of a mosaic that were already kept from a neighboring mosaic
+
+        Args:
+            col (int): the column of the top-left tile of the mosaic
+            row (int): the row of the top-left tile of the mosaic
+            results_df (dataframe): the located detections of the mosaic from `cool.locate_results`
+
+        Returns:
+            dataframe: the detections that are not duplicates
+        """
+        if results_df is None or results_df.empty:
+            return results_df
+
+        mosaic = (int(col), int(row))
+        boxes = self._to_boxes(results_df, mosaic)
+        keep = np.ones(len(boxes), dtype=bool)
+
+        with self._lock:
+            self._drop_old_rows(mosaic[1])
+
+            #: like non maximum suppression the most confident boxes of the mosaic are kept first
+            for i in np.argsort(-results_df["confidence"].to_numpy(), kind="stable"):
+                if self._is_duplicate(boxes[i]):
+                    keep[i] = False
+                else:
+                    self._add(boxes[i])
+
+        suppressed = len(boxes) - int(keep.sum())
+
+        if not suppressed:
+            return results_df
+
+        cool_metrics.increment("detections_suppressed", suppressed)
+        logging.debug("%i, %i suppressed %i duplicate detections", mosaic[0], mosaic[1], suppressed)
+
+        return results_df[keep].reset_index(drop=True)
+
+    def _to_boxes(self, results_df, mosaic):
+        """the web mercator boxes of the detections and the mosaic edges they touch"""
+        half_width = (results_df["envelope_x_max"].to_numpy() - results_df["envelope_x_min"].to_numpy()) / 2
+        half_height = (results_df["envelope_y_max"].to_numpy() - results_df["envelope_y_min"].to_numpy()) / 2
+        x = results_df["centroid_x_3857"].to_numpy()
+        y = results_df["centroid_y_3857"].to_numpy()
+        far = self.mosaic_size - self.edge_pixels
+
+        edges = (
+            np.where(results_df["envelope_x_min"].to_numpy() <= self.edge_pixels, LEFT, 0)
+            | np.where(results_df["envelope_x_max"].to_numpy() >= far, RIGHT, 0)
+            | np.where(results_df["envelope_y_min"].to_numpy() <= self.edge_pixels, TOP, 0)
+            | np.where(results_df["envelope_y_max"].to_numpy() >= far, BOTTOM, 0)
+        )
+
+        return [
+            _Box(*values, mosaic, mosaic[1])
+            for values in zip(
+                (x - half_width * self.resolution).tolist(),
+                (y - half_height * self.resolution).tolist(),
+                (x + half_width * self.resolution).tolist(),
+                (y + half_height * self.resolution).tolist(),
+                edges.tolist(),
+            )
+        ]
+
+    def _cell_keys(self, box, margin=0):
+        first_x, last_x = (math.floor(value / self.cell_meters) for value in (box.x_min - margin, box.x_max + margin))
+        first_y, last_y = (math.floor(value / self.cell_meters) for value in (box.y_min - margin, box.y_max + margin))
+
+        return [(x, y) for x in range(first_x, last_x + 1) for y in range(first_y, last_y + 1)]
+
+    def _add(self, box):
+        for key in self._cell_keys(box):
+            self._cells[key].append(box)
+            self._rows[box.row].add(key)
+
+    def _drop_old_rows(self, row):
+        if self._newest is not None and row <= self._newest:
+            return
+
+        self._newest = row
+        oldest = row - self.keep_rows
+
+        for old_row in [old_row for old_row in self._rows if old_row < oldest]:
+            for key in self._rows.pop(old_row):
+                kept = [box for box in self._cells.get(key, []) if box.row >= oldest]
+
+                if kept:
+                    self._cells[key] = kept
+                else:
+                    self._cells.pop(key, None)
+
+    def _is_duplicate(self, box):
+        tolerance = self.edge_pixels * self.resolution
+        seen = set()
+
+        for key in self._cell_keys(box, tolerance):
+            for kept in self._cells.get(key, []):
+                #: the model already suppressed the duplicates inside a mosaic
+                if kept.mosaic == box.mosaic or kept in seen:
+                    continue
+
+                seen.add(kept)
+
+                if self._overlaps(box, kept) or self._is_split(box, kept, tolerance):
+                    return True
+
+        return False
+
+    def _overlaps(self, box, kept):
+        """the same tower seen by two overlapping mosaics"""
+        width = _overlap(box.x_min, box.x_max, kept.x_min, kept.x_max)
+        height = _overlap(box.y_min, box.y_max, kept.y_min, kept.y_max)
+
+        if width <= 0 or height <= 0:
+            return False
+
+        smaller = min(
+            (box.x_max - box.x_min) * (box.y_max - box.y_min), (kept.x_max - kept.x_min) * (kept.y_max - kept.y_min)
+        )
+
+        return smaller > 0 and width * height >= self.overlap * smaller
+
+    def _is_split(self, box, kept, tolerance):
+        """the halves of a tower cut by the shared edge of two mosaics"""
+        width = _overlap(box.x_min, box.x_max, kept.x_min, kept.x_max)
+        height = _overlap(box.y_min, box.y_max, kept.y_min, kept.y_max)
+
+        #: the halves touch across a vertical edge and line up along it
+        if (box.edges & LEFT and kept.edges & RIGHT) or (box.edges & RIGHT and kept.edges & LEFT):
+            shorter = min(box.y_max - box.y_min, kept.y_max - kept.y_min)
+
+            if width >= -2 * tolerance and height >= self.overlap * shorter:
+                return True
+
+        if (box.edges & TOP and kept.edges & BOTTOM) or (box.edges & BOTTOM and kept.edges & TOP):
+            shorter = min(box.x_max - box.x_min, kept.x_max - kept.x_min)
+
+            if height >= -2 * tolerance and width >= self.overlap * shorter:
+                return True
+
+        return False
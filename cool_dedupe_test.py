@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+cool_dedupe_test.py
+A module that contains tests for the duplicate detection filter.
+"""
+
+import pandas as pd
+
+import cool
+import cool_dedupe
+
+
+def _detections(col, row, *boxes):
+    """locate (xmin, ymin, xmax, ymax, confidence) pixel boxes in the mosaic of col and row"""
+    results_df = pd.DataFrame(boxes, columns=["xmin", "ymin", "xmax", "ymax", "confidence"])
+    results_df["class"] = 0
+    results_df["name"] = "tower"
+
+    return cool._locate_detections(results_df, col, row, 20)
+
+
+def _filter(mosaic_size=512, keep_rows=4):
+    return cool_dedupe.DuplicateFilter(cool.meters_per_pixel(), mosaic_size, keep_rows, overlap=0.5, edge_pixels=2)
+
+
+def test_towers_seen_whole_by_overlapping_mosaics_are_kept_once():
+    dedupe = _filter(mosaic_size=576)
+
+    first = dedupe.filter(100, 200, _detections(100, 200, (520, 100, 560, 140, 0.9)))
+    #: the next mosaic starts 512 pixels to the right
+    second = dedupe.filter(102, 200, _detections(102, 200, (9, 101, 48, 140, 0.4), (200, 200, 240, 240, 0.5)))
+
+    assert len(first.index) == 1
+    assert second["confidence"].tolist() == [0.5]
+
+
+def test_the_halves_of_a_split_tower_are_kept_once():
+    dedupe = _filter()
+
+    dedupe.filter(100, 200, _detections(100, 200, (490, 100, 511, 140, 0.9), (100, 490, 140, 511, 0.9)))
+    right = dedupe.filter(102, 200, _detections(102, 200, (0, 102, 18, 138, 0.3), (0, 300, 18, 340, 0.3)))
+    below = dedupe.filter(100, 202, _detections(100, 202, (98, 0, 142, 20, 0.3), (300, 0, 340, 20, 0.3)))
+
+    assert right["envelope_y_min"].tolist() == [300]
+    assert below["envelope_x_min"].tolist() == [300]
+
+
+def test_boxes_that_do_not_reach_the_edge_are_not_split_towers():
+    dedupe = _filter()
+
+    dedupe.filter(100, 200, _detections(100, 200, (470, 100, 500, 140, 0.9)))
+    right = dedupe.filter(102, 200, _detections(102, 200, (0, 100, 18, 140, 0.3)))
+
+    assert len(right.index) == 1
+
+
+def test_detections_of_the_same_mosaic_are_left_to_the_model():
+    dedupe = _filter()
+
+    results_df = dedupe.filter(100, 200, _detections(100, 200, (10, 10, 50, 50, 0.9), (12, 12, 52, 52, 0.8)))
+
+    assert len(results_df.index) == 2
+    assert dedupe.filter(100, 200, None) is None
+
+
+def test_old_rows_are_dropped():
+    dedupe = _filter(keep_rows=4)
+
+    for col in range(100, 110, 2):
+        dedupe.filter(col, 200, _detections(col, 200, (10, 10, 50, 50, 0.9)))
+
+    assert len(dedupe) == 5
+
+    dedupe.filter(100, 204, _detections(100, 204, (10, 10, 50, 50, 0.9)))
+
+    assert len(dedupe) == 6
+
+    dedupe.filter(100, 206, _detections(100, 206, (10, 10, 50, 50, 0.9)))
+
+    assert len(dedupe) == 2
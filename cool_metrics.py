@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+DHHS Cooling Tower object detection
+Counters and latency histograms for the processing stages
+
+Recording a value only takes a short lock to update a few numbers so it is safe on the hot path. The metrics are
+written as JSON or OpenMetrics text by a background reporter and when the task finishes.
+"""
+import json
+import logging
+import math
+from bisect import bisect_left
+from os import getenv
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+#: upper bounds in seconds for the stage latency histograms
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300)
+#: upper bounds for the number of detections in a mosaic
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+PERCENTILES = (0.5, 0.95, 0.99)
+PREFIX = "cool"
+
+
+class Histogram:
+    """counts observations in fixed buckets to estimate percentiles without keeping every value
+
+    Args:
+        buckets (tuple): the sorted upper bound of each bucket, values above the last bound go in an overflow bucket
+    """
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        """add a value to the histogram
+
+        Args:
+            value (float): the observation
+
+        Returns:
+            None
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, quantile):
+        """estimate a percentile by interpolating inside the bucket that holds it
+
+        Args:
+            quantile (float): the percentile from 0 to 1
+
+        Returns:
+            float: the estimated value or None when nothing has been observed
+        """
+        if not self.count:
+            return None
+
+        rank = quantile * self.count
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else self.min
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+
+                return lower + (upper - lower) * max(rank - seen, 0) / count
+
+            seen += count
+
+        return self.max
+
+    def merge(self, summary):
+        """add the observations of another histogram with the same buckets
+
+        Args:
+            summary (dict): the other histogram's `summary`
+
+        Returns:
+            None
+        """
+        if tuple(summary["bounds"]) != self.buckets:
+            raise ValueError("only histograms with the same buckets can be merged")
+
+        self.counts = [count + other for count, other in zip(self.counts, summary["buckets"])]
+        self.count += summary["count"]
+        self.sum += summary["sum"]
+
+        if summary["count"]:
+            self.min = min(self.min, summary["min"])
+            self.max = max(self.max, summary["max"])
+
+    def copy(self):
+        """a copy that can be read without holding the registry lock"""
+        histogram = Histogram(self.buckets)
+        histogram.counts = list(self.counts)
+        histogram.count, histogram.sum, histogram.min, histogram.max = self.count, self.sum, self.min, self.max
+
+        return histogram
+
+    def summary(self):
+        """the count, sum, min, max, mean and percentiles of the histogram
+
+        Returns:
+            dict: the summary
+        """
+        summary = {"count": self.count, "sum": self.sum, "bounds": list(self.buckets), "buckets": list(self.counts)}
+
+        if self.count:
+            summary.update({"min": self.min, "max": self.max, "mean": self.sum / self.count})
+            summary.update({f"p{round(quantile * 100)}": self.percentile(quantile) for quantile in PERCENTILES})
+
+        return summary
+
+
+class Registry:
+    """the counters and histograms of a task
+
+    Args:
+        labels (dict): the labels added to every metric e.g. the job and task (optional)
+    """
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, value=1):
+        """add to a counter
+
+        Args:
+            name (str): the counter name
+            value (int): the amount to add (optional)
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS):
+        """add a value to a histogram
+
+        Args:
+            name (str): the histogram name, including the unit e.g. download_seconds
+            value (float): the observation
+            buckets (tuple): the bucket upper bounds used when the histogram is created (optional)
+
+        Returns:
+            None
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+
+            histogram.observe(value)
+
+    def snapshot(self):
+        """copy the metrics so they can be formatted without blocking the tasks recording them
+
+        Returns:
+            tuple: the counters and histograms dictionaries
+        """
+        with self._lock:
+            return dict(self._counters), {name: histogram.copy() for name, histogram in self._histograms.items()}
+
+    def merge(self, document):
+        """add the counters and histograms of another registry
+
+        Args:
+            document (dict): the other registry's parsed `to_json` document
+
+        Returns:
+            None
+        """
+        with self._lock:
+            for name, value in document["counters"].items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+            for name, summary in document["histograms"].items():
+                histogram = self._histograms.get(name)
+
+                if histogram is None:
+                    histogram = self._histograms[name] = Histogram(summary["bounds"])
+
+                histogram.merge(summary)
+
+    def reset(self):
+        """remove every metric"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def after_fork(self):
+        """replace the lock in a forked process, another thread may have held it when the process was forked"""
+        self._lock = Lock()
+
+    def to_json(self):
+        """the metrics as a JSON document
+
+        Returns:
+            str: the labels, counters and histogram summaries
+        """
+        counters, histograms = self.snapshot()
+
+        return json.dumps(
+            {
+                "labels": self.labels,
+                "counters": counters,
+                "histograms": {name: histogram.summary() for name, histogram in sorted(histograms.items())},
+            }
+        )
+
+    def to_openmetrics(self):
+        """the metrics in the OpenMetrics text format
+
+        Returns:
+            str: the exposition text
+        """
+        counters, histograms = self.snapshot()
+        lines = []
+
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {PREFIX}_{name} counter")
+            lines.append(f"{PREFIX}_{name}_total{_format_labels(self.labels)} {value}")
+
+        for name, histogram in sorted(histograms.items()):
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            cumulative = 0
+
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                labels = _format_labels({**self.labels, "le": str(bound)})
+                lines.append(f"{PREFIX}_{name}_bucket{labels} {cumulative}")
+
+            lines.append(f"{PREFIX}_{name}_sum{_format_labels(self.labels)} {histogram.sum}")
+            lines.append(f"{PREFIX}_{name}_count{_format_labels(self.labels)} {histogram.count}")
+
+        lines.append("# EOF")
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+    return f"{{{pairs}}}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+#: the metrics of this process
+METRICS = Registry()
+
+
+def increment(name, value=1):
+    """add to a counter in `METRICS`, see `Registry.increment`"""
+    METRICS.increment(name, value)
+
+
+def observe(name, value, buckets=SECONDS_BUCKETS):
+    """add a value to a histogram in `METRICS`, see `Registry.observe`"""
+    METRICS.observe(name, value, buckets)
+
+
+def merge(documents):
+    """combine the JSON metrics of many tasks, e.g. to find the percentiles of a whole job
+
+    Args:
+        documents (list): the `Registry.to_json` documents, as strings or dictionaries
+
+    Returns:
+        Registry: the summed counters and merged histograms
+    """
+    registry = Registry()
+
+    for document in documents:
+        registry.merge(json.loads(document) if isinstance(document, str) else document)
+
+    return registry
+
+
+def report(registry=None):
+    """log the metrics and write them to `METRICS_FILE` when it is set
+
+    the file is written in the OpenMetrics format when it ends with .prom or .txt and as JSON otherwise
+
+    Args:
+        registry (Registry): the metrics to report, defaults to `METRICS` (optional)
+
+    Returns:
+        None
+    """
+    registry = registry or METRICS
+    document = registry.to_json()
+
+    logging.info("metrics: %s", document)
+
+    path = getenv("METRICS_FILE")
+
+    if not path:
+        return
+
+    path = Path(path)
+
+    if path.suffix in (".prom", ".txt"):
+        document = registry.to_openmetrics()
+
+    #: replace the file in one step so a scraper never reads half of it
+    temporary = path.with_name(f".{path.name}.tmp")
+    temporary.write_text(document, encoding="utf-8")
+    temporary.replace(path)
+
+
+class Reporter:
+    """reports the metrics from a background thread every interval until it is closed
+
+    Args:
+        interval (float): the seconds between reports, defaults to `METRICS_INTERVAL` or 60. 0 disables it (optional)
+        registry (Registry): the metrics to report, defaults to `METRICS` (optional)
+    """
+
+    def __init__(self, interval=None, registry=None):
+        self.interval = float(getenv("METRICS_INTERVAL") or 60) if interval is None else interval
+        self.registry = registry or METRICS
+        self._closed = Event()
+        self._thread = None
+
+        if self.interval > 0:
+            self._thread = Thread(target=self._report_when_due, name="metrics-reporter", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """stop the thread and make a final report
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._closed.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        report(self.registry)
+
+    def _report_when_due(self):
+        while not self._closed.wait(self.interval):
+            try:
+                report(self.registry)
+            except Exception as ex:  # pylint: disable=broad-except
+                logging.warning("unable to report metrics: %s", ex)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+cool_metrics_test.py
+A module that contains tests for the metrics module.
+"""
+
+import json
+from time import sleep
+from unittest import mock
+
+import pytest
+
+import cool
+import cool_metrics
+
+
+def test_histogram_estimates_percentiles():
+    histogram = cool_metrics.Histogram((1, 2, 5, 10))
+
+    for value in range(1, 101):
+        histogram.observe(value / 10)
+
+    summary = histogram.summary()
+
+    assert summary["count"] == 100
+    assert summary["min"] == 0.1
+    assert summary["max"] == 10
+    assert summary["mean"] == pytest.approx(5.05)
+    assert summary["p50"] == pytest.approx(5, abs=0.1)
+    assert summary["p95"] == pytest.approx(9.5, abs=0.1)
+    assert cool_metrics.Histogram().percentile(0.5) is None
+
+
+def test_histogram_keeps_values_over_the_last_bucket():
+    histogram = cool_metrics.Histogram((1,))
+    histogram.observe(0.5)
+    histogram.observe(30)
+
+    assert histogram.counts == [1, 1]
+    assert histogram.percentile(1) == 30
+
+
+def test_registry_formats_json_and_openmetrics():
+    registry = cool_metrics.Registry({"job": "alligator", "task": 3})
+    registry.increment("tile_failures", 2)
+    registry.observe("download_seconds", 0.3)
+    registry.observe("download_seconds", 7)
+
+    document = json.loads(registry.to_json())
+
+    assert document["labels"] == {"job": "alligator", "task": 3}
+    assert document["counters"] == {"tile_failures": 2}
+    assert document["histograms"]["download_seconds"]["count"] == 2
+
+    text = registry.to_openmetrics()
+
+    assert '# TYPE cool_tile_failures counter\ncool_tile_failures_total{job="alligator",task="3"} 2' in text
+    assert 'cool_download_seconds_bucket{job="alligator",task="3",le="0.25"} 0' in text
+    assert 'cool_download_seconds_bucket{job="alligator",task="3",le="0.5"} 1' in text
+    assert 'cool_download_seconds_bucket{job="alligator",task="3",le="+Inf"} 2' in text
+    assert 'cool_download_seconds_count{job="alligator",task="3"} 2' in text
+    assert text.endswith("# EOF\n")
+
+
+@pytest.mark.parametrize("name,load", [("metrics.json", json.loads), ("metrics.prom", str)])
+def test_report_writes_the_metrics_file(tmp_path, monkeypatch, name, load):
+    registry = cool_metrics.Registry()
+    registry.increment("rows_processed")
+    monkeypatch.setenv("METRICS_FILE", str(tmp_path / name))
+
+    cool_metrics.report(registry)
+
+    document = load((tmp_path / name).read_text(encoding="utf-8"))
+
+    assert "rows_processed" in (document if isinstance(document, str) else document["counters"])
+
+
+def test_reporter_reports_periodically_and_when_closed():
+    registry = cool_metrics.Registry()
+
+    with mock.patch("cool_metrics.report") as report_mock:
+        reporter = cool_metrics.Reporter(0.05, registry)
+        sleep(0.2)
+        periodic = report_mock.call_count
+        reporter.close()
+
+    assert periodic >= 2
+    assert report_mock.call_count == periodic + 1
+    assert cool_metrics.Reporter(0, registry)._thread is None
+
+
+def test_stages_record_latency_and_detections(monkeypatch):
+    registry = cool_metrics.Registry()
+    monkeypatch.setattr(cool_metrics, "METRICS", registry)
+
+    cool._log_stage(1, 2, "towerscout", 0.4, batch=4)
+    writer = cool.ResultWriter(max_rows=10, max_seconds=60)
+    writer.add(1, 2, None)
+    writer._closed.set()
+
+    counters, histograms = registry.snapshot()
+
+    assert histograms["detect_seconds"].sum == pytest.approx(0.1)
+    assert counters["rows_processed"] == 1
+    assert histograms["detections_per_row"].counts[0] == 1
+
+
+def test_merge_combines_the_metrics_of_many_tasks():
+    first, second = cool_metrics.Registry({"task": 0}), cool_metrics.Registry({"task": 1})
+    first.increment("rows_processed", 3)
+    second.increment("rows_processed", 2)
+
+    for value in range(1, 51):
+        first.observe("row_seconds", value / 10)
+        second.observe("row_seconds", (value + 50) / 10)
+
+    merged = cool_metrics.merge([first.to_json(), json.loads(second.to_json())])
+    counters, histograms = merged.snapshot()
+
+    assert counters == {"rows_processed": 5}
+    assert histograms["row_seconds"].count == 100
+    assert histograms["row_seconds"].min == 0.1
+    assert histograms["row_seconds"].max == 10
+    assert histograms["row_seconds"].percentile(0.5) == pytest.approx(5, abs=0.1)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+DHHS Cooling Tower object detection
+Cheap checks to find mosaics that certainly have no cooling towers before running the model
+
+A check takes the tile bytes and the mosaic image and returns True when the mosaic is certainly empty. Checks
+are registered by name with `register` and selected with the PRESCREEN environment variable e.g. `bytes,edges`.
+"""
+import logging
+from os import getenv
+
+import numpy as np
+
+#: the checks available to PRESCREEN by name
+CHECKS = {}
+
+
+def register(name):
+    """add a check to the registry
+
+    Args:
+        name (str): the name used to select the check in PRESCREEN
+
+    Returns:
+        function: the decorator
+    """
+
+    def decorator(check):
+        CHECKS[name] = check
+
+        return check
+
+    return decorator
+
+
+def _to_gray(mosaic, step=2):
+    """a downsampled grayscale copy of the mosaic, the statistics do not need every pixel"""
+    import cv2  # pylint: disable=import-outside-toplevel
+
+    return cv2.cvtColor(np.ascontiguousarray(mosaic[::step, ::step]), cv2.COLOR_RGB2GRAY)
+
+
+@register("bytes")
+def is_small(tiles, mosaic):  # pylint: disable=unused-argument
+    """featureless imagery like water, snow, and bare ground compresses to small jpegs
+
+    Args:
+        tiles (list): the jpeg bytes of the tiles
+        mosaic (np.ndarray): the mosaic image
+
+    Returns:
+        bool: True when the tiles total less than `PRESCREEN_MIN_BYTES` for each 4 tiles
+    """
+    tiles = tiles or []
+    #: the threshold is for the four tiles of a 2x2 mosaic and grows with the larger mosaics
+    threshold = int(getenv("PRESCREEN_MIN_BYTES") or 16000) * max(len(tiles), 4) / 4
+
+    return sum(len(tile) for tile in tiles if tile) < threshold
+
+
+@register("uniform")
+def is_uniform(tiles, mosaic):  # pylint: disable=unused-argument
+    """blank and no data mosaics are a single color
+
+    Args:
+        tiles (list): the jpeg bytes of the tiles
+        mosaic (np.ndarray): the mosaic image
+
+    Returns:
+        bool: True when the standard deviation of the brightness is less than `PRESCREEN_MIN_STD`
+    """
+    threshold = float(getenv("PRESCREEN_MIN_STD") or 8)
+
+    return float(_to_gray(mosaic, 4).std()) < threshold
+
+
+@register("edges")
+def is_smooth(tiles, mosaic):  # pylint: disable=unused-argument
+    """cooling towers and the roofs they sit on have sharp edges
+
+    Args:
+        tiles (list): the jpeg bytes of the tiles
+        mosaic (np.ndarray): the mosaic image
+
+    Returns:
+        bool: True when the share of edge pixels is less than `PRESCREEN_MIN_EDGES`
+    """
+    import cv2  # pylint: disable=import-outside-toplevel
+
+    threshold = float(getenv("PRESCREEN_MIN_EDGES") or 0.01)
+    edges = cv2.Canny(_to_gray(mosaic), 50, 150)
+
+    return np.count_nonzero(edges) / edges.size < threshold
+
+
+def get_checks(names=None):
+    """get the checks to run
+
+    Args:
+        names (str): comma separated check names, defaults to `PRESCREEN` (optional)
+
+    Returns:
+        list: (name, check) tuples, empty when pre-screening is disabled
+    """
+    names = getenv("PRESCREEN", "") if names is None else names
+    names = [name.strip() for name in names.split(",") if name.strip()]
+
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        raise ValueError(f"unknown pre-screen checks: {unknown}, expected some of {list(CHECKS)}")
+
+    return [(name, CHECKS[name]) for name in names]
+
+
+def screen(tiles, mosaic, checks):
+    """run the checks on a mosaic
+
+    Args:
+        tiles (list): the jpeg bytes of the tiles
+        mosaic (np.ndarray): the rgb mosaic image
+        checks (list): (name, check) tuples from `get_checks`
+
+    Returns:
+        str: the name of the first check that found the mosaic empty or None when the model should run
+    """
+    for name, check in checks:
+        if check(tiles, mosaic):
+            return name
+
+    return None
+
+
+def evaluate(samples, checks):
+    """measure how many mosaics each check skips and how many labelled towers would be lost
+
+    Args:
+        samples (iterable): (towers, tiles, mosaic) tuples where towers is the labelled number of cooling towers
+        checks (list): (name, check) tuples from `get_checks`
+
+    Returns:
+        list: a dictionary for each check and for all of the checks combined
+    """
+    names = [name for name, _ in checks] + ["all"]
+    skipped = {name: 0 for name in names}
+    lost = {name: 0 for name in names}
+    missed = {name: 0 for name in names}
+    mosaics = towers = 0
+
+    for count, tiles, mosaic in samples:
+        if mosaic is None:
+            logging.warning("skipping a labelled row without imagery")
+
+            continue
+
+        mosaics += 1
+        towers += count
+        flagged = [name for name, check in checks if check(tiles, mosaic)]
+
+        if flagged:
+            flagged.append("all")
+
+        for name in flagged:
+            skipped[name] += 1
+            lost[name] += count
+            missed[name] += count > 0
+
+    return [
+        {
+            "check": name,
+            "mosaics": mosaics,
+            "skipped": skipped[name],
+            "skip_rate": skipped[name] / mosaics if mosaics else 0.0,
+            "towers": towers,
+            "towers_lost": lost[name],
+            "mosaics_with_towers_skipped": missed[name],
+            "recall": 1 - lost[name] / towers if towers else 1.0,
+        }
+        for name in names
+    ]
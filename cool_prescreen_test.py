@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+cool_prescreen_test.py
+A module that contains tests for the pre-screen module.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import cool
+import cool_prescreen
+
+root = Path(__file__).parent / "test-data"
+
+
+def _mosaic(name):
+    return cool.reorder_colors_to_rgb(cool.convert_to_cv2_image((root / name).read_bytes()))
+
+
+@pytest.fixture(autouse=True)
+def _thresholds(monkeypatch):
+    for name in ["PRESCREEN", "PRESCREEN_MIN_BYTES", "PRESCREEN_MIN_STD", "PRESCREEN_MIN_EDGES"]:
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_checks_keep_real_imagery():
+    tiles = [(root / f"{name}.jpg").read_bytes() for name in ["1_2", "1_3", "2_2", "2_3"]]
+
+    for name in ["1_2_mosaic.jpg", "no_towers.jpg"]:
+        assert cool_prescreen.screen(tiles, _mosaic(name), cool_prescreen.get_checks("bytes,uniform,edges")) is None
+
+
+def test_checks_skip_blank_imagery():
+    blank = np.full((512, 512, 3), 200, dtype=np.uint8)
+
+    assert cool_prescreen.is_small([b"x" * 1000] * 4, blank)
+    assert cool_prescreen.is_uniform(None, blank)
+    assert cool_prescreen.is_smooth(None, blank)
+    assert cool_prescreen.screen([b"x" * 1000] * 4, blank, cool_prescreen.get_checks("uniform,edges")) == "uniform"
+
+
+def test_thresholds_come_from_the_environment(monkeypatch):
+    tiles = [(root / "1_2.jpg").read_bytes()]
+
+    assert cool_prescreen.is_small(tiles, None) is False
+
+    monkeypatch.setenv("PRESCREEN_MIN_BYTES", "30000")
+
+    assert cool_prescreen.is_small(tiles, None) is True
+
+
+def test_get_checks(monkeypatch):
+    assert cool_prescreen.get_checks() == []
+
+    monkeypatch.setenv("PRESCREEN", "edges, bytes")
+
+    assert [name for name, _ in cool_prescreen.get_checks()] == ["edges", "bytes"]
+
+    with pytest.raises(ValueError):
+        cool_prescreen.get_checks("bytes,classifier")
+
+
+def test_register_adds_a_check(monkeypatch):
+    monkeypatch.setattr(cool_prescreen, "CHECKS", dict(cool_prescreen.CHECKS))
+
+    @cool_prescreen.register("never")
+    def never(tiles, mosaic):  # pylint: disable=unused-argument
+        return False
+
+    assert cool_prescreen.get_checks("never") == [("never", never)]
+
+
+def test_evaluate_reports_the_skip_rate_and_recall():
+    blank = np.full((512, 512, 3), 200, dtype=np.uint8)
+    busy = _mosaic("1_2_mosaic.jpg")
+    samples = [(0, None, blank), (2, None, blank), (3, None, busy), (0, None, busy), (1, None, None)]
+
+    report = cool_prescreen.evaluate(samples, cool_prescreen.get_checks("uniform,edges"))
+
+    assert [run["check"] for run in report] == ["uniform", "edges", "all"]
+    assert report[-1]["mosaics"] == 4
+    assert report[-1]["skipped"] == 2
+    assert report[-1]["skip_rate"] == 0.5
+    assert report[-1]["towers_lost"] == 2
+    assert report[-1]["mosaics_with_towers_skipped"] == 1
+    assert report[-1]["recall"] == 0.6
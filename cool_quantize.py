@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+DHHS Cooling Tower object detection
+INT8 quantization of the exported tower scout model
+
+The ONNX export is quantized with ONNX Runtime. Static quantization calibrates the activation ranges on sample
+mosaics and stores the model in the QDQ format, dynamic quantization only quantizes the weights. The quantized
+model is compared to the float model with a recall report at the operating confidence threshold.
+"""
+import logging
+import re
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+import numpy as np
+import onnx
+import pandas as pd
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+import cool
+
+STATIC = "static"
+DYNAMIC = "dynamic"
+METHODS = (STATIC, DYNAMIC)
+
+#: the square image size the model was exported with
+IMAGE_SIZE = 640
+#: the yolov5 letterbox padding color
+PADDING = (114, 114, 114)
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+
+def find_images(folder, limit=None):
+    """find the sample mosaics in a folder
+
+    Args:
+        folder (Path): the folder containing the mosaics
+        limit (int): the maximum number of mosaics to use (optional)
+
+    Returns:
+        list: the mosaic paths in name order
+    """
+    images = sorted(path for path in Path(folder).iterdir() if path.suffix.lower() in IMAGE_SUFFIXES)
+
+    if limit:
+        images = images[: int(limit)]
+
+    return images
+
+
+def letterbox(image, size=IMAGE_SIZE):
+    """resize and pad an rgb image to the square model input like the yolov5 AutoShape does for exported models
+
+    Args:
+        image (np.ndarray): the rgb image
+        size (int): the width and height of the model input (optional)
+
+    Returns:
+        np.ndarray: the size x size rgb image
+    """
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = int(round(width * ratio)), int(round(height * ratio))
+
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    pad_width, pad_height = (size - new_width) / 2, (size - new_height) / 2
+    top, bottom = int(round(pad_height - 0.1)), int(round(pad_height + 0.1))
+    left, right = int(round(pad_width - 0.1)), int(round(pad_width + 0.1))
+
+    return cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=PADDING)
+
+
+class MosaicCalibrationReader(CalibrationDataReader):
+    """feeds sample mosaics to the ONNX Runtime calibrator one at a time
+
+    Args:
+        images (list): the mosaic paths
+        input_name (str): the name of the model input (optional)
+        size (int): the width and height of the model input (optional)
+    """
+
+    def __init__(self, images, input_name="images", size=IMAGE_SIZE):
+        self.images = list(images)
+        self.input_name = input_name
+        self.size = size
+        self._start = self._position = 0
+        self._end = len(self.images)
+
+    def __len__(self):
+        return len(self.images)
+
+    def get_next(self):
+        """read the next mosaic as a normalized nchw batch of one
+
+        Returns:
+            dict: the model inputs or None when every mosaic has been read
+        """
+        while self._position < self._end:
+            path = self.images[self._position]
+            self._position += 1
+
+            image = cv2.imread(str(path))
+
+            if image is None:
+                logging.warning("skipping unreadable calibration image: %s", path)
+
+                continue
+
+            image = letterbox(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), self.size)
+            batch = np.ascontiguousarray(image.transpose((2, 0, 1))[np.newaxis], dtype=np.float32) / 255
+
+            return {self.input_name: batch}
+
+        return None
+
+    def rewind(self):
+        """start reading from the first mosaic of the range again"""
+        self._position = self._start
+
+    def set_range(self, start_index, end_index):
+        """only read the mosaics from the start up to the end index, ONNX Runtime calibrates large sets in parts
+
+        Args:
+            start_index (int): the position of the first mosaic to read
+            end_index (int): the position after the last mosaic to read
+
+        Returns:
+            None
+        """
+        self._start = self._position = max(int(start_index), 0)
+        self._end = min(int(end_index), len(self.images))
+
+
+def get_detect_nodes(model_path):
+    """find the nodes after the final convolutions of the yolov5 detect head
+
+    the box decoding mixes values in pixels with values from 0 to 1, quantizing them to a single scale loses the
+    box coordinates, so they are left in float
+
+    Args:
+        model_path (Path): the onnx model
+
+    Returns:
+        list: the node names
+    """
+    nodes = onnx.load(str(model_path), load_external_data=False).graph.node
+    pattern = re.compile(r"model\.(\d+)")
+    layers = [int(match.group(1)) for node in nodes for match in [pattern.search(node.name)] if match]
+
+    if not layers:
+        return []
+
+    detect = f"model.{max(layers)}"
+
+    return [node.name for node in nodes if detect in node.name and node.op_type != "Conv"]
+
+
+def quantize_model(images, method=STATIC, source=None, destination=None):
+    """quantize the exported onnx model to int8
+
+    Args:
+        images (list): the mosaic paths to calibrate the activations with, unused for dynamic quantization
+        method (str): `STATIC` or `DYNAMIC` (optional)
+        source (Path): the float onnx model, defaults to the onnx backend weights (optional)
+        destination (Path): the quantized model, defaults to the onnx-int8 backend weights (optional)
+
+    Returns:
+        Path: the quantized model
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown quantization method: {method}")
+
+    source = Path(source or cool.get_model_weight_path("onnx"))
+    destination = Path(destination or cool.get_model_weight_path("onnx-int8"))
+
+    if not source.is_file():
+        logging.error("the onnx weights file does not exist, was the model exported? %s", source)
+
+        raise FileNotFoundError("the onnx weights file does not exist")
+
+    excluded = get_detect_nodes(source)
+    logging.info("quantizing %s with %s quantization, keeping %i nodes in float", source, method, len(excluded))
+
+    if method == DYNAMIC:
+        quantize_dynamic(source, destination, weight_type=QuantType.QUInt8, nodes_to_exclude=excluded)
+    else:
+        _quantize_static(source, destination, images, excluded)
+
+    copy_metadata(source, destination)
+
+    return destination
+
+
+def _quantize_static(source, destination, images, excluded):
+    reader = MosaicCalibrationReader(images)
+
+    if not reader.images:
+        raise ValueError("static quantization needs calibration images")
+
+    quantize_static(
+        source,
+        destination,
+        reader,
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        nodes_to_exclude=excluded,
+    )
+
+
+def copy_metadata(source, destination):
+    """copy the stride and class names yolov5 stores in the export to the quantized model
+
+    Args:
+        source (Path): the float onnx model
+        destination (Path): the quantized onnx model
+
+    Returns:
+        None
+    """
+    metadata = {prop.key: prop.value for prop in onnx.load(str(source), load_external_data=False).metadata_props}
+    model = onnx.load(str(destination))
+    existing = {prop.key for prop in model.metadata_props}
+
+    for key, value in metadata.items():
+        if key not in existing:
+            model.metadata_props.add(key=key, value=value)
+
+    onnx.save(model, str(destination))
+
+
+def box_iou(first, second):
+    """calculate the intersection over union of every pair of boxes
+
+    Args:
+        first (np.ndarray): n x 4 xmin, ymin, xmax, ymax boxes
+        second (np.ndarray): m x 4 xmin, ymin, xmax, ymax boxes
+
+    Returns:
+        np.ndarray: the n x m intersection over union
+    """
+    first = np.asarray(first, dtype=np.float64).reshape(-1, 4)
+    second = np.asarray(second, dtype=np.float64).reshape(-1, 4)
+
+    top_left = np.maximum(first[:, None, :2], second[None, :, :2])
+    bottom_right = np.minimum(first[:, None, 2:], second[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    first_area = (first[:, 2:] - first[:, :2]).prod(axis=1)
+    second_area = (second[:, 2:] - second[:, :2]).prod(axis=1)
+    union = first_area[:, None] + second_area[None, :] - intersection
+
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def match_detections(expected, actual, threshold=0.5):
+    """greedily match detections from the float model to the quantized model, most confident first
+
+    Args:
+        expected (pd.DataFrame): the reference xyxy detections
+        actual (pd.DataFrame): the candidate xyxy detections
+        threshold (float): the minimum intersection over union for a match (optional)
+
+    Returns:
+        int: the number of expected detections found in the actual detections
+    """
+    if expected.empty or actual.empty:
+        return 0
+
+    columns = ["xmin", "ymin", "xmax", "ymax"]
+    expected = expected.sort_values(by="confidence", ascending=False)
+    overlaps = box_iou(expected[columns].to_numpy(), actual[columns].to_numpy())
+    available = np.ones(overlaps.shape[1], dtype=bool)
+    matched = 0
+
+    for overlap in overlaps:
+        overlap = np.where(available, overlap, -1)
+        best = int(overlap.argmax())
+
+        if overlap[best] >= threshold:
+            available[best] = False
+            matched += 1
+
+    return matched
+
+
+def recall_report(images, backend="onnx-int8", reference="pytorch", threshold=0.5):
+    """compare the detections of a backend to the reference model on sample mosaics
+
+    both models use the thresholds from `cool.configure_model`
+
+    Args:
+        images (list): the mosaic paths
+        backend (str): the inference backend to evaluate (optional)
+        reference (str): the inference backend treated as the truth (optional)
+        threshold (float): the minimum intersection over union for a match (optional)
+
+    Returns:
+        pd.DataFrame: one row per mosaic with the detection counts, matches and inference seconds of each model
+    """
+    models = {
+        "reference": cool.configure_model(cool.load_pytorch_model(reference)),
+        "candidate": cool.configure_model(cool.load_pytorch_model(backend)),
+    }
+    report = []
+
+    for path in images:
+        image = cv2.imread(str(path))
+
+        if image is None:
+            logging.warning("skipping unreadable recall image: %s", path)
+
+            continue
+
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        row = {"image": Path(path).name}
+        detections = {}
+
+        for name, model in models.items():
+            start = perf_counter()
+            detections[name] = model(image).pandas().xyxy[0]
+            row[f"{name}_seconds"] = perf_counter() - start
+            row[f"{name}_detections"] = len(detections[name].index)
+
+        row["matched"] = match_detections(detections["reference"], detections["candidate"], threshold)
+        report.append(row)
+
+    return pd.DataFrame(
+        report,
+        columns=[
+            "image",
+            "reference_detections",
+            "candidate_detections",
+            "matched",
+            "reference_seconds",
+            "candidate_seconds",
+        ],
+    )
+
+
+def summarize_report(report):
+    """summarize a recall report
+
+    Args:
+        report (pd.DataFrame): the output of `recall_report`
+
+    Returns:
+        dict: the recall, precision and mean inference seconds of each model
+    """
+    expected = int(report["reference_detections"].sum())
+    actual = int(report["candidate_detections"].sum())
+    matched = int(report["matched"].sum())
+
+    return {
+        "images": len(report.index),
+        "recall": matched / expected if expected else 1.0,
+        "precision": matched / actual if actual else 1.0,
+        "reference_seconds": float(report["reference_seconds"].mean()),
+        "candidate_seconds": float(report["candidate_seconds"].mean()),
+    }
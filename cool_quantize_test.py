@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+cool_quantize_test.py
+A module that contains tests for the quantization module.
+"""
+
+from unittest import mock
+
+import cv2
+import numpy as np
+import onnx
+import onnx.numpy_helper
+import onnxruntime
+import pandas as pd
+import pytest
+
+import cool_quantize
+
+
+def _detections(boxes, confidence=None):
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    frame = pd.DataFrame(boxes, columns=["xmin", "ymin", "xmax", "ymax"])
+    frame["confidence"] = confidence if confidence is not None else np.linspace(0.9, 0.1, len(boxes))
+
+    return frame
+
+
+def _write_images(folder, count):
+    for index in range(count):
+        cv2.imwrite(str(folder / f"{index}_mosaic.jpg"), np.full((48, 64, 3), index * 40, dtype=np.uint8))
+
+    (folder / "notes.txt").write_text("not an image")
+
+
+def test_letterbox_pads_to_a_square_like_yolov5():
+    image = np.zeros((320, 640, 3), dtype=np.uint8)
+
+    boxed = cool_quantize.letterbox(image, 640)
+
+    assert boxed.shape == (640, 640, 3)
+    assert (boxed[:160] == 114).all()
+    assert (boxed[160:480] == 0).all()
+    assert (boxed[480:] == 114).all()
+
+    assert cool_quantize.letterbox(np.zeros((512, 512, 3), dtype=np.uint8)).shape == (640, 640, 3)
+
+
+def test_calibration_reader_reads_each_mosaic_once(tmp_path):
+    _write_images(tmp_path, 3)
+    images = cool_quantize.find_images(tmp_path, limit=2)
+
+    reader = cool_quantize.MosaicCalibrationReader(images, size=64)
+
+    batches = [reader.get_next(), reader.get_next(), reader.get_next()]
+
+    assert [image.name for image in images] == ["0_mosaic.jpg", "1_mosaic.jpg"]
+    assert batches[0]["images"].shape == (1, 3, 64, 64)
+    assert batches[0]["images"].dtype == np.float32
+    assert batches[1]["images"].max() <= 1
+    assert batches[2] is None
+
+    reader.rewind()
+
+    assert reader.get_next() is not None
+
+
+def test_calibration_reader_reads_a_range(tmp_path):
+    _write_images(tmp_path, 4)
+    reader = cool_quantize.MosaicCalibrationReader(cool_quantize.find_images(tmp_path), size=64)
+
+    reader.set_range(1, 3)
+    batches = list(reader)
+    reader.rewind()
+
+    assert [batch["images"][0, 0, 32, 32] for batch in batches] == pytest.approx([40 / 255, 80 / 255], abs=0.01)
+    assert reader.get_next() is not None
+    assert len(reader) == 4
+
+
+def test_match_detections_matches_each_box_once():
+    expected = _detections([[0, 0, 10, 10], [20, 20, 30, 30], [50, 50, 60, 60]])
+    actual = _detections([[1, 1, 10, 10], [0, 0, 10, 11], [22, 22, 30, 30]])
+
+    assert cool_quantize.match_detections(expected, actual, 0.5) == 2
+    assert cool_quantize.match_detections(expected, actual, 0.9) == 1
+    assert cool_quantize.match_detections(expected, actual.iloc[:0], 0.5) == 0
+
+
+def test_summarize_report():
+    report = pd.DataFrame(
+        {
+            "image": ["a", "b"],
+            "reference_detections": [3, 1],
+            "candidate_detections": [2, 3],
+            "matched": [2, 1],
+            "reference_seconds": [1.0, 3.0],
+            "candidate_seconds": [0.5, 0.5],
+        }
+    )
+
+    summary = cool_quantize.summarize_report(report)
+
+    assert summary["recall"] == 0.75
+    assert summary["precision"] == 0.6
+    assert summary["reference_seconds"] == 2.0
+    assert summary["candidate_seconds"] == 0.5
+
+
+def _export(folder):
+    """write a small onnx model named like the yolov5 export"""
+    rng = np.random.default_rng(0)
+    weights = [
+        onnx.numpy_helper.from_array(rng.standard_normal((4, 3, 3, 3)).astype(np.float32), "model.0.weight"),
+        onnx.numpy_helper.from_array(rng.standard_normal((2, 4, 1, 1)).astype(np.float32), "model.1.weight"),
+    ]
+    nodes = [
+        onnx.helper.make_node("Conv", ["images", "model.0.weight"], ["hidden"], name="/model.0/Conv", pads=[1] * 4),
+        onnx.helper.make_node("Conv", ["hidden", "model.1.weight"], ["raw"], name="/model.1/Conv"),
+        onnx.helper.make_node("Sigmoid", ["raw"], ["output0"], name="/model.1/Sigmoid"),
+    ]
+    graph = onnx.helper.make_graph(
+        nodes,
+        "towers",
+        [onnx.helper.make_tensor_value_info("images", onnx.TensorProto.FLOAT, ["batch", 3, "height", "width"])],
+        [onnx.helper.make_tensor_value_info("output0", onnx.TensorProto.FLOAT, None)],
+        weights,
+    )
+    exported = onnx.helper.make_model(graph, opset_imports=[onnx.helper.make_opsetid("", 13)], ir_version=8)
+    exported.metadata_props.add(key="stride", value="32")
+    source = folder / "model.onnx"
+    onnx.save(exported, str(source))
+
+    return source
+
+
+@pytest.mark.parametrize("method", [cool_quantize.STATIC, cool_quantize.DYNAMIC])
+def test_quantize_model_keeps_the_yolov5_metadata(tmp_path, method):
+    source = _export(tmp_path)
+    _write_images(tmp_path, 2)
+
+    destination = cool_quantize.quantize_model(
+        cool_quantize.find_images(tmp_path), method, source, tmp_path / "model.int8.onnx"
+    )
+
+    quantized = onnx.load(str(destination))
+    outputs = onnxruntime.InferenceSession(str(destination)).run(None, {"images": np.zeros((2, 3, 64, 64), np.float32)})
+
+    assert {prop.key: prop.value for prop in quantized.metadata_props}["stride"] == "32"
+    assert outputs[0].shape == (2, 2, 64, 64)
+
+
+def test_quantize_model_requires_calibration_images(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        cool_quantize.quantize_model([], source=tmp_path / "missing.onnx")
+
+    with pytest.raises(ValueError):
+        cool_quantize.quantize_model([], method="fp16")
+
+    with pytest.raises(ValueError, match="calibration images"):
+        cool_quantize.quantize_model([], cool_quantize.STATIC, _export(tmp_path), tmp_path / "model.int8.onnx")
+
+
+@mock.patch("cool_quantize.cool.load_pytorch_model")
+@mock.patch("cool_quantize.cool.configure_model")
+def test_recall_report_skips_unreadable_images(configure_mock, load_mock, tmp_path):
+    _write_images(tmp_path, 1)
+    (tmp_path / "broken.jpg").write_bytes(b"not a jpeg")
+    configure_mock.return_value.return_value.pandas.return_value.xyxy = [_detections([[0, 0, 10, 10]])]
+
+    report = cool_quantize.recall_report([tmp_path / "broken.jpg", tmp_path / "0_mosaic.jpg"])
+
+    assert report["image"].tolist() == ["0_mosaic.jpg"]
+    assert report["matched"].tolist() == [1]
@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+DHHS Cooling Tower object detection
+Local memory mapped work queue of index rows
+
+The columns and rows of the work index are stored as packed int32 arrays followed by their positions sorted by
+column and row, a processed bitset, a synced bitset, a uint32 lease expiry for each row, and the taken rows and
+earliest lease expiry of each block of `BLOCK_ROWS` rows, all in one memory mapped file. Claims move a cursor
+through the blocks that have free rows and marking a row processed sets a bit, so neither touches the database.
+Rows that were not claimed by the process, e.g. from a replayed spool, are found with a binary search of the
+sorted positions. The processed rows are synced back to the database in the background.
+
+Every change is made while holding an exclusive `flock` on the file so processes on the same machine can share a
+queue.
+"""
+import logging
+import mmap
+import struct
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import cool_metrics
+
+MAGIC = b"COOLQ002"
+#: magic, count, cursor
+_HEADER = struct.Struct("<8sQQ")
+HEADER_SIZE = 64
+#: the rows counted together so a claim can skip the blocks without free rows, a multiple of 8
+BLOCK_ROWS = 4096
+
+
+def _layout(count):
+    """the byte offsets of the sections of a queue file with count rows"""
+    bitset = (count + 7) // 8
+    blocks = -(-count // BLOCK_ROWS)
+    cols = HEADER_SIZE
+    rows = cols + 4 * count
+    order = rows + 4 * count
+    processed = order + 4 * count
+    synced = processed + bitset
+    leases = synced + bitset
+    #: keep the leases and counters aligned for the uint32 views
+    leases += -leases % 4
+    taken = leases + 4 * count
+    expiry = taken + 4 * blocks
+
+    return cols, rows, order, processed, synced, leases, taken, expiry, expiry + 4 * blocks
+
+
+def _get_bits(bitset, positions):
+    return (bitset[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1 == 1
+
+
+def _set_bits(bitset, positions):
+    np.bitwise_or.at(bitset, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8))
+
+
+def _count_bits(bitset):
+    return int(np.unpackbits(bitset).sum())
+
+
+def _keys(cols, rows):
+    """pack columns and rows into one sortable int64 key"""
+    return (np.asarray(cols, dtype=np.int64) << 32) | (np.asarray(rows, dtype=np.int64) & 0xFFFFFFFF)
+
+
+class WorkQueue:
+    """a queue of index rows in a memory mapped file shared by the processes on a machine
+
+    Args:
+        path (Path): the queue file made with `WorkQueue.create`
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = self.path.open("r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+        magic, self.count, _ = _HEADER.unpack_from(self._map)
+
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a work queue")
+
+        cols, rows, order, processed, synced, leases, taken, expiry, _ = _layout(self.count)
+        blocks = -(-self.count // BLOCK_ROWS)
+        self.cols = np.frombuffer(self._map, dtype="<i4", count=self.count, offset=cols)
+        self.rows = np.frombuffer(self._map, dtype="<i4", count=self.count, offset=rows)
+        #: the positions of the rows sorted by column and row to find rows without a claim
+        self._order = np.frombuffer(self._map, dtype="<u4", count=self.count, offset=order)
+        self._processed = np.frombuffer(self._map, dtype=np.uint8, count=synced - processed, offset=processed)
+        self._synced = np.frombuffer(self._map, dtype=np.uint8, count=synced - processed, offset=synced)
+        self._leases = np.frombuffer(self._map, dtype="<u4", count=self.count, offset=leases)
+        #: the processed or leased rows of each block and the earliest lease expiry in it, 0 when there is none
+        self._taken = np.frombuffer(self._map, dtype="<u4", count=blocks, offset=taken)
+        self._expiry = np.frombuffer(self._map, dtype="<u4", count=blocks, offset=expiry)
+        self._block_sizes = np.full(blocks, BLOCK_ROWS, dtype=np.uint32)
+
+        if blocks:
+            self._block_sizes[-1] = self.count - (blocks - 1) * BLOCK_ROWS
+
+        #: flock does not exclude the threads of one process since they share the file
+        self._lock = Lock()
+        #: the positions of the rows this process claimed and has not marked processed
+        self._claimed = {}
+
+    @classmethod
+    def create(cls, path, cols, rows):
+        """write a new queue file, replacing any existing one
+
+        Args:
+            path (Path): the queue file
+            cols (np.ndarray): the column of each index row
+            rows (np.ndarray): the row of each index row
+
+        Returns:
+            WorkQueue: the queue
+        """
+        path = Path(path)
+        cols = np.asarray(cols, dtype="<i4")
+        rows = np.asarray(rows, dtype="<i4")
+
+        if cols.shape != rows.shape:
+            raise ValueError("there must be a row for every column")
+
+        count = len(cols)
+        col_offset, row_offset, order_offset, *_, size = _layout(count)
+        temporary = path.with_name(f".{path.name}.tmp")
+
+        with temporary.open("wb") as queue:
+            #: the bitsets, leases, and counters start as zeros in the sparse file
+            queue.truncate(size)
+            queue.write(_HEADER.pack(MAGIC, count, 0))
+            queue.seek(col_offset)
+            queue.write(cols.tobytes())
+            queue.seek(row_offset)
+            queue.write(rows.tobytes())
+            queue.seek(order_offset)
+            queue.write(np.lexsort((rows, cols)).astype("<u4").tobytes())
+
+        temporary.replace(path)
+        logging.info("created a work queue of %i rows in %s", count, path)
+
+        return cls(path)
+
+    def close(self):
+        """unmap and close the queue file"""
+        with self._lock:
+            del self.cols, self.rows, self._order, self._processed, self._synced, self._leases
+            del self._taken, self._expiry
+            self._map.close()
+            self._file.close()
+
+    def _locked(self):
+        return _FileLock(self._lock, self._file)
+
+    def _block_positions(self, block):
+        low = block * BLOCK_ROWS
+
+        return np.arange(low, min(low + BLOCK_ROWS, self.count), dtype=np.int64)
+
+    def _recount(self, block, now):
+        """release the expired leases of a block and count its taken rows again, the caller holds the lock"""
+        positions = self._block_positions(block)
+        unprocessed = ~_get_bits(self._processed, positions)
+        leases = self._leases[positions]
+        live = unprocessed & (leases > now)
+
+        self._leases[positions[unprocessed & ~live]] = 0
+        self._taken[block] = len(positions) - np.count_nonzero(unprocessed) + np.count_nonzero(live)
+        self._expiry[block] = leases[live].min() if live.any() else 0
+
+    def claim(self, worker, take, lease_seconds):
+        """lease the next unprocessed rows whose lease is free or expired
+
+        the claim starts in the block where the last claim in any process stopped and only looks at the blocks
+        with free rows or expired leases, wrapping around to pick up the rows whose lease expired
+
+        Args:
+            worker (str): the name of the task claiming the rows, only used in the logs
+            take (int): the maximum number of rows to claim
+            lease_seconds (float): the seconds the claim lasts before the rows can be claimed again
+
+        Returns:
+            list: the claimed rows with `col_num` and `row_num` attributes
+        """
+        now = int(time())
+        until = min(now + int(lease_seconds), 2**32 - 1)
+        claimed = []
+        rows = []
+
+        with self._locked():
+            first = _HEADER.unpack_from(self._map)[2] // BLOCK_ROWS
+            expired = (self._expiry > 0) & (self._expiry <= now)
+            blocks = np.flatnonzero((self._taken < self._block_sizes) | expired)
+            block = first
+
+            for block in np.concatenate([blocks[blocks >= first], blocks[blocks < first]]).tolist():
+                if expired[block]:
+                    self._recount(block, now)
+
+                positions = self._block_positions(block)
+                free = positions[~_get_bits(self._processed, positions) & (self._leases[positions] == 0)]
+                found = free[: take - len(claimed)]
+
+                if len(found):
+                    self._leases[found] = until
+                    self._taken[block] += len(found)
+                    self._expiry[block] = min(int(self._expiry[block]) or until, until)
+                    claimed.extend(found.tolist())
+
+                if len(claimed) >= take:
+                    break
+
+            #: the next claim starts in the last block used since the rest of it can still be free
+            struct.pack_into("<Q", self._map, 16, block * BLOCK_ROWS)
+
+            for position in claimed:
+                col, row = int(self.cols[position]), int(self.rows[position])
+                self._claimed[(col, row)] = position
+                rows.append(SimpleNamespace(col_num=col, row_num=row))
+
+        logging.info("%s claimed %i rows from the work queue", worker, len(rows))
+
+        return rows
+
+    def _find(self, pairs):
+        """binary search the sorted order for the positions of (col, row) pairs, -1 for the pairs not in the queue"""
+        cols, rows = np.array(pairs, dtype=np.int64).reshape(-1, 2).T
+        keys = _keys(cols, rows)
+
+        if not self.count:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        low = np.zeros(len(keys), dtype=np.int64)
+        high = np.full(len(keys), self.count, dtype=np.int64)
+
+        #: only the few rows each search compares are read from the file
+        while (low < high).any():
+            searching = low < high
+            middle = (low + high) // 2
+            position = self._order[np.minimum(middle, self.count - 1)]
+            below = _keys(self.cols[position], self.rows[position]) < keys
+            low = np.where(searching & below, middle + 1, low)
+            high = np.where(searching & ~below, middle, high)
+
+        position = self._order[np.minimum(low, self.count - 1)].astype(np.int64)
+        found = (low < self.count) & (_keys(self.cols[position], self.rows[position]) == keys)
+
+        return np.where(found, position, -1)
+
+    def mark_done(self, processed):
+        """mark rows as processed
+
+        the rows claimed by this process are found from the claim, other rows, e.g. from a spool replayed after a
+        restart, are looked up in the queue
+
+        Args:
+            processed (list): (col, row) tuples of the processed rows
+
+        Returns:
+            None
+        """
+        with self._locked():
+            positions = [self._claimed.pop((int(col), int(row)), None) for col, row in processed]
+            unclaimed = [pair for pair, position in zip(processed, positions) if position is None]
+            positions = [position for position in positions if position is not None]
+
+            if unclaimed:
+                found = self._find(unclaimed)
+                missing = int(np.count_nonzero(found < 0))
+
+                if missing:
+                    logging.warning("%i processed rows are not in the work queue", missing)
+
+                positions.extend(found[found >= 0].tolist())
+
+            positions = np.unique(np.array(positions, dtype=np.int64))
+            positions = positions[~_get_bits(self._processed, positions)]
+
+            if not len(positions):
+                return
+
+            #: a row without a lease was not taken when it was claimed
+            released = positions[self._leases[positions] == 0]
+            np.add.at(self._taken, released // BLOCK_ROWS, np.uint32(1))
+            _set_bits(self._processed, positions)
+
+    def remaining(self):
+        """count the unprocessed rows
+
+        Returns:
+            int: the number of rows that are not processed
+        """
+        return self.count - _count_bits(self._processed)
+
+    def status(self):
+        """count the rows in each state
+
+        Returns:
+            dict: the total, processed, synced, and currently leased rows
+        """
+        now = int(time())
+
+        with self._locked():
+            processed = np.unpackbits(self._processed, count=self.count, bitorder="little").astype(bool)
+            leased = int(np.count_nonzero(~processed & (self._leases > now)))
+
+            return {
+                "rows": self.count,
+                "processed": int(processed.sum()),
+                "synced": _count_bits(self._synced),
+                "leased": leased,
+            }
+
+    def rewind(self):
+        """release every lease and move the cursor to the start, e.g. after the processes using the queue died
+
+        Returns:
+            None
+        """
+        with self._locked():
+            self._leases[:] = 0
+            self._expiry[:] = 0
+
+            if self.count:
+                processed = np.unpackbits(self._processed, count=self.count, bitorder="little").astype(np.uint32)
+                self._taken[:] = np.add.reduceat(processed, np.arange(0, self.count, BLOCK_ROWS))
+
+            struct.pack_into("<Q", self._map, 16, 0)
+
+    def sync(self, update, batch_size=50000):
+        """send the processed rows that have not been synced to the database
+
+        only one process syncs at a time, the others return immediately
+
+        Args:
+            update (callable): marks lists of (col, row) tuples as processed in the database and returns "SUCCESS"
+                or "FAIL", e.g. `cool.update_index_rows`
+            batch_size (int): the most rows updated at once (optional)
+
+        Returns:
+            int: the number of rows synced
+        """
+        with _SyncLock(self.path) as acquired:
+            if not acquired:
+                return 0
+
+            pending = np.flatnonzero(
+                np.unpackbits(self._processed & ~self._synced, count=self.count, bitorder="little")
+            )
+            synced = 0
+
+            for start in range(0, len(pending), batch_size):
+                positions = pending[start : start + batch_size]
+
+                if update(list(zip(self.cols[positions].tolist(), self.rows[positions].tolist()))) != "SUCCESS":
+                    break
+
+                with self._locked():
+                    _set_bits(self._synced, positions)
+
+                synced += len(positions)
+
+            cool_metrics.increment("queue_rows_synced", synced)
+
+            return synced
+
+
+class _FileLock:
+    """hold a thread lock and an exclusive flock on the queue file"""
+
+    def __init__(self, lock, file):
+        self.lock = lock
+        self.file = file
+
+    def __enter__(self):
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        self.lock.acquire()
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.lock.release()
+
+
+class _SyncLock:
+    """try to take the sync lock file next to the queue without waiting"""
+
+    def __init__(self, path):
+        self.path = path.with_name(f".{path.name}.sync")
+        self.file = None
+
+    def __enter__(self):
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        self.file = self.path.open("a")
+
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+
+            return False
+
+        return True
+
+    def __exit__(self, *args):
+        if self.file is not None:
+            self.file.close()
+
+
+class Syncer:
+    """syncs a queue to the database from a background thread every interval until it is closed
+
+    Args:
+        queue (WorkQueue): the queue
+        update (callable): see `WorkQueue.sync`
+        interval (float): the seconds between syncs, 0 only syncs when closed (optional)
+    """
+
+    def __init__(self, queue, update, interval=60):
+        self.queue = queue
+        self.update = update
+        self.interval = interval
+        self._closed = Event()
+        self._thread = None
+
+        if interval > 0:
+            self._thread = Thread(target=self._sync_when_due, name="queue-syncer", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """stop the thread and sync one last time
+
+        Returns:
+            int: the number of rows synced in the last sync
+        """
+        self._closed.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        return self.queue.sync(self.update)
+
+    def _sync_when_due(self):
+        while not self._closed.wait(self.interval):
+            try:
+                self.queue.sync(self.update)
+            except Exception as ex:  # pylint: disable=broad-except
+                logging.warning("unable to sync the work queue: %s", ex)
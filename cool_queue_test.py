@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+cool_queue_test.py
+A module that contains tests for the local work queue.
+"""
+
+import multiprocessing
+from unittest import mock
+
+import numpy as np
+import pytest
+
+import cool_queue
+import cool_spool
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = cool_queue.WorkQueue.create(tmp_path / "queue.bin", np.arange(10), np.arange(10) + 100)
+
+    yield queue
+
+    queue.close()
+
+
+def _pairs(rows):
+    return [(row.col_num, row.row_num) for row in rows]
+
+
+def test_create_lays_out_the_rows_in_order(queue, tmp_path):
+    reopened = cool_queue.WorkQueue(tmp_path / "queue.bin")
+
+    assert reopened.count == 10
+    assert list(zip(reopened.cols.tolist(), reopened.rows.tolist())) == [(i, i + 100) for i in range(10)]
+    assert reopened.status() == {"rows": 10, "processed": 0, "synced": 0, "leased": 0}
+
+    reopened.close()
+
+
+def test_create_rejects_mismatched_columns_and_rows(tmp_path):
+    with pytest.raises(ValueError):
+        cool_queue.WorkQueue.create(tmp_path / "queue.bin", [1, 2], [1])
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / "queue.bin"
+    path.write_bytes(b"\0" * 128)
+
+    with pytest.raises(ValueError):
+        cool_queue.WorkQueue(path)
+
+
+def test_claims_do_not_overlap_and_skip_processed_rows(queue):
+    first = queue.claim("task", 4, 600)
+    second = queue.claim("task", 4, 600)
+
+    assert _pairs(first) == [(i, i + 100) for i in range(4)]
+    assert _pairs(second) == [(i, i + 100) for i in range(4, 8)]
+
+    queue.mark_done(_pairs(first))
+
+    assert queue.remaining() == 6
+    assert _pairs(queue.claim("task", 4, 600)) == [(8, 108), (9, 109)]
+    assert queue.claim("task", 4, 600) == []
+    assert queue.status() == {"rows": 10, "processed": 4, "synced": 0, "leased": 6}
+
+
+def test_expired_leases_are_claimed_again(queue):
+    queue.claim("task", 10, 0)
+
+    assert _pairs(queue.claim("task", 3, 600)) == [(0, 100), (1, 101), (2, 102)]
+
+
+def test_rewind_releases_every_lease(queue):
+    queue.claim("task", 10, 600)
+    queue.rewind()
+
+    assert queue.status()["leased"] == 0
+    assert len(queue.claim("task", 10, 600)) == 10
+
+
+def test_mark_done_finds_rows_that_were_not_claimed_and_ignores_rows_not_in_the_queue(queue):
+    queue.claim("task", 2, 600)
+
+    queue.mark_done([(0, 100), (5, 105), (5, 106)])
+
+    assert queue.status()["processed"] == 2
+    assert _pairs(queue.claim("task", 10, 600)) == [(i, i + 100) for i in range(2, 10) if i != 5]
+
+
+def test_spooled_rows_replayed_after_a_restart_are_marked_processed(queue, tmp_path):
+    #: the task was killed after spooling the rows it claimed
+    (tmp_path / "spool").mkdir()
+    cool_spool.write_segment(tmp_path / "spool" / "000000000000.arrow", _pairs(queue.claim("task", 6, 600)), [])
+    restarted = cool_queue.WorkQueue(tmp_path / "queue.bin")
+
+    spool = cool_spool.Spool(tmp_path / "spool", lambda processed, results: restarted.mark_done(processed) or "SUCCESS")
+
+    assert spool.close(timeout=5) == "SUCCESS"
+    assert restarted.remaining() == 4
+    assert queue.status()["processed"] == 6
+
+    restarted.close()
+
+
+def test_claims_skip_the_blocks_without_free_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(cool_queue, "BLOCK_ROWS", 8)
+    queue = cool_queue.WorkQueue.create(tmp_path / "queue.bin", np.arange(40), np.zeros(40))
+
+    queue.mark_done(_pairs(queue.claim("task", 20, 600)))
+    queue.claim("task", 3, 600)
+
+    assert queue._taken.tolist() == [8, 8, 7, 0, 0]
+    assert _pairs(queue.claim("task", 6, 600)) == [(23, 0)] + [(i, 0) for i in range(24, 29)]
+
+    queue.rewind()
+
+    assert queue._taken.tolist() == [8, 8, 4, 0, 0]
+    assert queue.claim("task", 1, 600)[0].col_num == 20
+
+    queue.close()
+
+
+def test_mark_done_finds_unclaimed_rows_in_any_order(tmp_path):
+    rng = np.random.default_rng(0)
+    cols, rows = rng.permutation(1000), rng.integers(0, 3, 1000)
+    queue = cool_queue.WorkQueue.create(tmp_path / "queue.bin", cols, rows)
+    picked = rng.choice(1000, 100, replace=False)
+
+    queue.mark_done([(cols[i], rows[i]) for i in picked] + [(5000, 0), (cols[0], 9)])
+
+    assert queue.remaining() == 900
+    assert np.flatnonzero(cool_queue._get_bits(queue._processed, np.arange(1000))).tolist() == sorted(picked)
+
+    queue.close()
+
+
+def _claim_all(path, results):
+    queue = cool_queue.WorkQueue(path)
+    claimed = []
+
+    while True:
+        rows = queue.claim("task", 7, 600)
+
+        if not rows:
+            break
+
+        claimed.extend(_pairs(rows))
+
+    results.put(claimed)
+
+
+def test_processes_never_claim_the_same_row(tmp_path):
+    path = tmp_path / "queue.bin"
+    cool_queue.WorkQueue.create(path, np.arange(2000), np.arange(2000)).close()
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=_claim_all, args=(path, results)) for _ in range(4)]
+
+    for process in processes:
+        process.start()
+
+    claimed = [pair for _ in processes for pair in results.get(timeout=30)]
+
+    for process in processes:
+        process.join()
+
+    assert len(claimed) == len(set(claimed)) == 2000
+
+
+def test_sync_sends_processed_rows_until_an_update_fails(queue):
+    queue.mark_done(_pairs(queue.claim("task", 5, 600)))
+    update = mock.Mock(side_effect=["SUCCESS", "FAIL"])
+
+    assert queue.sync(update, batch_size=2) == 2
+    assert update.call_args_list[0].args[0] == [(0, 100), (1, 101)]
+    assert queue.status()["synced"] == 2
+
+    update = mock.Mock(return_value="SUCCESS")
+
+    assert queue.sync(update) == 3
+    update.assert_called_once_with([(2, 102), (3, 103), (4, 104)])
+    assert queue.sync(update) == 0
+
+
+def test_syncer_syncs_when_closed(queue):
+    queue.mark_done(_pairs(queue.claim("task", 3, 600)))
+    update = mock.Mock(return_value="SUCCESS")
+
+    syncer = cool_queue.Syncer(queue, update, interval=0)
+
+    assert syncer.close() == 3
+    update.assert_called_once()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+DHHS Cooling Tower object detection
+Local spool of processed rows and their detections
+
+Every save is first written to an Arrow IPC segment on local disk and acknowledged. A background flusher bulk
+loads the pending segments into the database, deletes them once the transaction commits, and backs off while the
+database is unavailable. Segments left behind by a task that was killed are loaded by the next spool opened on
+the same folder.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Event, Lock, Thread
+from time import perf_counter, sleep
+
+import cool_metrics
+
+SUFFIX = ".arrow"
+#: the schema metadata key holding the (col, row) pairs of the processed rows
+PROCESSED_KEY = b"processed"
+
+
+def write_segment(path, processed, results):
+    """write processed rows and their detections to a segment file
+
+    the segment is written to a temporary file that is renamed when it is complete so a segment is never
+    read half written
+
+    Args:
+        path (Path): the segment file
+        processed (list): (col, row) tuples of the processed rows
+        results (list): dataframes with cooling tower detection results
+
+    Returns:
+        None
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+    if results:
+        table = pa.Table.from_pandas(pd.concat(results, ignore_index=True), preserve_index=False)
+    else:
+        table = pa.table({})
+
+    table = table.replace_schema_metadata({PROCESSED_KEY: json.dumps([[int(col), int(row)] for col, row in processed])})
+
+    temporary = path.with_name(f".{path.name}.tmp")
+
+    with pa.OSFile(str(temporary), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    #: the rename is only durable once the data it points to is
+    with temporary.open("rb") as segment:
+        os.fsync(segment.fileno())
+
+    temporary.replace(path)
+
+
+def read_segment(path):
+    """read the processed rows and detections from a segment file
+
+    Args:
+        path (Path): the segment file
+
+    Returns:
+        tuple: the (col, row) tuples of the processed rows and the detections dataframe or None
+    """
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+    with pa.memory_map(str(path), "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    processed = [tuple(pair) for pair in json.loads(table.schema.metadata[PROCESSED_KEY])]
+    results_df = table.to_pandas() if table.num_rows else None
+
+    return processed, results_df
+
+
+class Spool:
+    """an append only folder of segments that a background thread loads into the database
+
+    Args:
+        folder (Path): the folder holding the segments
+        save (callable): saves the processed rows and a list of detection dataframes in one transaction and
+            returns "SUCCESS" or "FAIL", e.g. `cool.save_processed_rows`
+        max_segments (int): the most segments loaded in one transaction, defaults to `SPOOL_FLUSH_SEGMENTS` or 40
+            (optional)
+        max_backoff (float): the longest wait between attempts while saving fails, defaults to
+            `SPOOL_MAX_BACKOFF` or 60 (optional)
+    """
+
+    def __init__(self, folder, save, max_segments=None, max_backoff=None):
+        self.folder = Path(folder)
+        self.save = save
+        self.max_segments = max_segments or int(os.getenv("SPOOL_FLUSH_SEGMENTS") or 40)
+        self.max_backoff = max_backoff or float(os.getenv("SPOOL_MAX_BACKOFF") or 60)
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+        #: a segment that was still being written when the task was killed was never acknowledged
+        for temporary in self.folder.glob(f".*{SUFFIX}.tmp"):
+            temporary.unlink()
+
+        pending = self.pending()
+        self._sequence = int(pending[-1].stem) + 1 if pending else 0
+
+        if pending:
+            cool_metrics.increment("segments_replayed", len(pending))
+            logging.warning("replaying %i spooled segments from %s", len(pending), self.folder)
+
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._written = Event()
+        self._closed = Event()
+        self._thread = Thread(target=self._flush_when_written, name="spool-flusher", daemon=True)
+        self._thread.start()
+
+    def pending(self):
+        """the segments that have not been loaded into the database
+
+        Returns:
+            list: the segment paths, oldest first
+        """
+        return sorted(self.folder.glob(f"*{SUFFIX}"))
+
+    def write(self, processed, results):
+        """spool processed rows and their detections
+
+        Args:
+            processed (list): (col, row) tuples of the processed rows
+            results (list): dataframes with cooling tower detection results
+
+        Returns:
+            string: SUCCESS once the segment is on disk
+        """
+        with self._lock:
+            path = self.folder / f"{self._sequence:012d}{SUFFIX}"
+            self._sequence += 1
+
+        write_segment(path, processed, results)
+        cool_metrics.increment("segments_spooled")
+        self._written.set()
+
+        return "SUCCESS"
+
+    def flush(self):
+        """load the oldest pending segments into the database in a single transaction
+
+        Returns:
+            string: status of the save operation FAIL or SUCCESS
+        """
+        with self._flush_lock:
+            segments = self.pending()[: self.max_segments]
+
+            if not segments:
+                return "SUCCESS"
+
+            processed, results = [], []
+
+            for segment in list(segments):
+                try:
+                    rows, results_df = read_segment(segment)
+                except (OSError, ValueError, KeyError) as ex:
+                    #: keep an unreadable segment for inspection without blocking the ones after it
+                    logging.error("setting aside the unreadable spooled segment %s! %s", segment, ex)
+                    segment.replace(segment.with_suffix(".corrupt"))
+                    segments.remove(segment)
+
+                    continue
+
+                processed.extend(rows)
+
+                if results_df is not None:
+                    results.append(results_df)
+
+            if not segments:
+                return "SUCCESS"
+
+            status = self.save(processed, results)
+
+            if status == "SUCCESS":
+                #: a task killed between the commit and the unlink loads these rows again on the next run
+                for segment in segments:
+                    segment.unlink()
+
+                cool_metrics.increment("segments_flushed", len(segments))
+
+            return status
+
+    def close(self, timeout=None):
+        """stop the flusher and load every pending segment, leaving any that fail on disk for the next run
+
+        Args:
+            timeout (float): the seconds to keep trying, defaults to `SPOOL_CLOSE_SECONDS` or 60 (optional)
+
+        Returns:
+            string: status of the final save operation FAIL or SUCCESS
+        """
+        timeout = float(os.getenv("SPOOL_CLOSE_SECONDS") or 60) if timeout is None else timeout
+
+        self._closed.set()
+        self._written.set()
+        self._thread.join()
+
+        deadline = perf_counter() + timeout
+        backoff = min(1, self.max_backoff)
+
+        while self.pending():
+            if self.flush() == "SUCCESS":
+                continue
+
+            if perf_counter() + backoff > deadline:
+                logging.error("leaving %i segments in %s for the next run", len(self.pending()), self.folder)
+
+                return "FAIL"
+
+            sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+        return "SUCCESS"
+
+    def _flush_when_written(self):
+        """load segments from a background thread as they are written, backing off while the database fails"""
+        backoff = 0
+
+        while not self._closed.is_set():
+            if backoff:
+                #: only close interrupts a backoff, new segments will be loaded with the next attempt
+                if self._closed.wait(backoff):
+                    return
+            elif not self.pending():
+                self._written.wait()
+
+            self._written.clear()
+
+            if self._closed.is_set():
+                return
+
+            try:
+                status = self.flush()
+            except Exception as ex:  # pylint: disable=broad-except
+                logging.error("unable to load spooled segments! %s", ex)
+                status = "FAIL"
+
+            if status == "SUCCESS":
+                backoff = 0
+            else:
+                backoff = min(max(backoff * 2, 1), self.max_backoff)
+                logging.warning("retrying %i spooled segments in %i seconds", len(self.pending()), backoff)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+cool_spool_test.py
+A module that contains tests for the result spool.
+"""
+
+from threading import Event
+from unittest import mock
+
+import pandas as pd
+
+import cool_spool
+
+
+def test_segments_round_trip_rows_and_results(tmp_path):
+    path = tmp_path / "000000000000.arrow"
+    results_df = pd.DataFrame({"confidence": [0.5, 0.25], "object_name": ["tower", "tower"]})
+
+    cool_spool.write_segment(path, [(1, 2), ("3", "2")], [results_df.iloc[:1], results_df.iloc[1:]])
+    processed, read_df = cool_spool.read_segment(path)
+
+    assert processed == [(1, 2), (3, 2)]
+    pd.testing.assert_frame_equal(read_df, results_df)
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_segments_without_results_keep_the_processed_rows(tmp_path):
+    path = tmp_path / "000000000000.arrow"
+
+    cool_spool.write_segment(path, [(1, 2)], [])
+
+    assert cool_spool.read_segment(path) == ([(1, 2)], None)
+
+
+def test_spool_loads_segments_in_the_background(tmp_path):
+    saved = Event()
+    save = mock.Mock(return_value="SUCCESS", side_effect=lambda *args: saved.set() or "SUCCESS")
+    spool = cool_spool.Spool(tmp_path, save)
+
+    assert spool.write([(1, 2)], [pd.DataFrame({"confidence": [0.5]})]) == "SUCCESS"
+    assert saved.wait(5)
+
+    spool.close()
+
+    processed, results = save.call_args.args
+    assert processed == [(1, 2)]
+    assert results[0]["confidence"].tolist() == [0.5]
+    assert not spool.pending()
+
+
+def test_spool_bulk_loads_many_segments_in_one_save(tmp_path):
+    save = mock.Mock(return_value="SUCCESS")
+    spool = cool_spool.Spool(tmp_path, save, max_segments=10)
+    spool.close()
+
+    for index in range(3):
+        cool_spool.write_segment(tmp_path / f"{index:012d}.arrow", [(index, 2)], [])
+
+    assert spool.flush() == "SUCCESS"
+    assert save.call_args.args == ([(0, 2), (1, 2), (2, 2)], [])
+    assert not spool.pending()
+
+
+def test_spool_keeps_segments_while_saving_fails(tmp_path):
+    save = mock.Mock(return_value="FAIL")
+    spool = cool_spool.Spool(tmp_path, save, max_backoff=0.1)
+
+    spool.write([(1, 2)], [])
+
+    assert spool.close(timeout=0.5) == "FAIL"
+    assert save.call_count > 1
+    assert len(spool.pending()) == 1
+
+
+def test_spool_replays_segments_left_by_a_killed_task(tmp_path):
+    cool_spool.write_segment(tmp_path / "000000000004.arrow", [(1, 2)], [])
+    (tmp_path / ".000000000005.arrow.tmp").write_bytes(b"half written")
+    save = mock.Mock(return_value="SUCCESS")
+
+    spool = cool_spool.Spool(tmp_path, save)
+    spool.write([(3, 2)], [])
+    spool.close()
+
+    assert [call.args[0] for call in save.call_args_list] in ([[(1, 2), (3, 2)]], [[(1, 2)], [(3, 2)]])
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spool_sets_aside_unreadable_segments(tmp_path):
+    (tmp_path / "000000000000.arrow").write_bytes(b"not arrow")
+    cool_spool.write_segment(tmp_path / "000000000001.arrow", [(1, 2)], [])
+    save = mock.Mock(return_value="SUCCESS")
+
+    spool = cool_spool.Spool(tmp_path, save)
+
+    assert spool.close() == "SUCCESS"
+    assert save.call_args.args == ([(1, 2)], [])
+    assert [path.name for path in tmp_path.iterdir()] == ["000000000000.corrupt"]
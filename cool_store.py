@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+DHHS Cooling Tower object detection
+Persistent on-disk tile store
+
+Tiles are appended to a single pack file and located through a fixed width index file. When the store opens the
+index records are sorted by key into a sorted index file that is memory mapped, so lookups are a binary search
+over the mapped keys and the index is never held in memory. Tiles added while the store is open are kept in a
+small dictionary and the sorted index is rebuilt once it holds `RECENT_TILES` tiles.
+
+The processes of a machine can share a store folder. Every append and rewrite holds an exclusive `flock` on a lock
+file next to the store and each tile is written at the current end of the pack file.
+"""
+import logging
+import mmap
+import os
+import struct
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+#: read from the store first and download on a miss
+CACHE = "cache"
+#: always download and save every tile to the store
+RECORD = "record"
+#: only read from the store and never download
+REPLAY = "replay"
+MODES = (CACHE, RECORD, REPLAY)
+
+PACK_FILE = "tiles.pack"
+INDEX_FILE = "tiles.idx"
+#: the keys, offsets, and lengths of the index file as three sorted sections
+SORTED_FILE = "tiles.sorted"
+LOCK_FILE = "tiles.lock"
+
+#: key, offset, length
+_RECORD = struct.Struct("<QQI")
+_INDEX_DTYPE = np.dtype([("key", "<u8"), ("offset", "<u8"), ("length", "<u4")])
+#: the tiles added while the store is open that are looked up in a dictionary before the sorted index is rebuilt
+RECENT_TILES = 4096
+
+
+def tile_key(zoom, col, row):
+    """pack a tile address into a single integer
+
+    Args:
+        zoom (int): the WMTS zoom level
+        col (int): the WMTS column
+        row (int): the WMTS row
+
+    Returns:
+        int: the key for the tile
+    """
+    return (int(zoom) << 58) | (int(col) << 29) | int(row)
+
+
+class TileStore:
+    """an append only store of tile bytes keyed by zoom, col, and row
+
+    Args:
+        folder (Path): the folder holding the pack and index files
+        mode (str): one of `CACHE`, `RECORD`, or `REPLAY`
+        max_bytes (int): the pack file size that triggers evicting the oldest tiles, never in `REPLAY` mode
+            (optional)
+    """
+
+    def __init__(self, folder, mode=CACHE, max_bytes=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown tile store mode: {mode}")
+
+        self.folder = Path(folder)
+        self.mode = mode
+        self.max_bytes = max_bytes or None
+        self._lock = Lock()
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._pack_path = self.folder / PACK_FILE
+        self._index_path = self.folder / INDEX_FILE
+        self._sorted_path = self.folder / SORTED_FILE
+        self._pack_path.touch()
+        self._index_path.touch()
+        #: the lock file is never replaced so every store on the folder locks the same file
+        self._lock_file = (self.folder / LOCK_FILE).open("a")
+
+        self._pack = None
+        self._index = None
+        #: the sorted index mapped from disk
+        self._keys = np.empty(0, dtype="<u8")
+        self._offsets = np.empty(0, dtype="<u8")
+        self._lengths = np.empty(0, dtype="<u4")
+        #: the tiles this store added since the sorted index was built
+        self._recent = {}
+        #: a read only map of the pack file, remapped when a tile past its end is read
+        self._map = None
+        self._map_size = 0
+
+        with self._locked():
+            self._open()
+
+            #: a replayed store is the captured imagery of a run so it is never evicted
+            if self.mode != REPLAY and self.max_bytes and self._pack.seek(0, 2) > self.max_bytes:
+                self._evict()
+
+    def __len__(self):
+        return len(self._keys) + len(self._recent)
+
+    def _locked(self):
+        return _FileLock(self._lock, self._lock_file)
+
+    def _open(self):
+        """open the pack and index files and map the sorted index, the caller holds the file lock"""
+        self._pack = self._pack_path.open("a+b")
+        self._index = self._index_path.open("ab")
+
+        #: drop a partially written trailing record from a killed task
+        count = self._index_path.stat().st_size // _RECORD.size
+        self._index.truncate(count * _RECORD.size)
+
+        if count and (not self._sorted_path.exists() or self._sorted_path.stat().st_size != count * _RECORD.size):
+            self._write_sorted(count)
+
+        if count:
+            self._keys = np.memmap(self._sorted_path, dtype="<u8", mode="r", shape=(count,))
+            self._offsets = np.memmap(self._sorted_path, dtype="<u8", mode="r", offset=8 * count, shape=(count,))
+            self._lengths = np.memmap(self._sorted_path, dtype="<u4", mode="r", offset=16 * count, shape=(count,))
+
+        self._recent = {}
+
+    def _write_sorted(self, count):
+        """sort the first count records of the index file into the sorted index file"""
+        index = np.fromfile(self._index_path, dtype=_INDEX_DTYPE, count=count)
+        #: a stable sort keeps the most recently added copy of a tile last
+        index = index[np.argsort(index["key"], kind="stable")]
+        temporary = self._sorted_path.with_name(f".{SORTED_FILE}.tmp")
+
+        with temporary.open("wb") as sorted_file:
+            for field in ("key", "offset", "length"):
+                sorted_file.write(np.ascontiguousarray(index[field]).tobytes())
+
+        #: a store mapping the previous sorted index keeps reading it until it reopens
+        temporary.replace(self._sorted_path)
+
+    def close(self):
+        """flush and close the underlying files"""
+        with self._lock:
+            self._close()
+            self._lock_file.close()
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_size = 0
+
+        self._keys = np.empty(0, dtype="<u8")
+        self._offsets = np.empty(0, dtype="<u8")
+        self._lengths = np.empty(0, dtype="<u4")
+        self._recent = {}
+        self._pack.close()
+        self._index.close()
+
+    def _reopen(self):
+        """pick up the tiles of the other stores on the folder and the files they rewrote"""
+        self._close()
+        self._open()
+
+    def _locate(self, key):
+        """find the offset and length of a tile in the pack file"""
+        if key in self._recent:
+            return self._recent[key]
+
+        #: compare as uint64, python ints would be compared as floats and lose precision
+        key = np.uint64(key)
+        #: the right side finds the most recently added copy of a tile
+        position = int(np.searchsorted(self._keys, key, side="right")) - 1
+
+        if position < 0 or self._keys[position] != key:
+            return None
+
+        return int(self._offsets[position]), int(self._lengths[position])
+
+    def get(self, zoom, col, row):
+        """read a tile from the store
+
+        Args:
+            zoom (int): the WMTS zoom level
+            col (int): the WMTS column
+            row (int): the WMTS row
+
+        Returns:
+            bytes: the tile or None if it is not in the store
+        """
+        with self._lock:
+            location = self._locate(tile_key(zoom, col, row))
+
+            if location is None:
+                return None
+
+            offset, length = location
+
+            if offset + length > self._map_size:
+                self._pack.flush()
+
+                if self._map is not None:
+                    self._map.close()
+
+                self._map = mmap.mmap(self._pack.fileno(), 0, access=mmap.ACCESS_READ)
+                self._map_size = len(self._map)
+
+            return self._map[offset : offset + length]
+
+    def put(self, zoom, col, row, content):
+        """append a tile to the store
+
+        Args:
+            zoom (int): the WMTS zoom level
+            col (int): the WMTS column
+            row (int): the WMTS row
+            content (bytes): the tile
+
+        Returns:
+            None
+        """
+        if self.mode == REPLAY:
+            return
+
+        key = tile_key(zoom, col, row)
+
+        with self._locked():
+            #: another store on the folder evicted tiles and replaced the files
+            if os.fstat(self._pack.fileno()).st_ino != self._pack_path.stat().st_ino:
+                self._reopen()
+
+            #: other stores append to the same files so the tile goes where the pack file ends now
+            offset = self._pack.seek(0, 2)
+            self._pack.write(content)
+            #: the index never points past the end of the pack file if the task is killed mid write
+            self._pack.flush()
+            self._index.write(_RECORD.pack(key, offset, len(content)))
+            #: a killed task keeps every tile it wrote
+            self._index.flush()
+            self._recent[key] = (offset, len(content))
+
+            if len(self._recent) >= RECENT_TILES:
+                self._reopen()
+
+            if self.max_bytes and offset + len(content) > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """rewrite the store keeping the most recently added tiles that fit in 80% of the size limit"""
+        self._pack.flush()
+        self._index.flush()
+
+        count = self._index_path.stat().st_size // _RECORD.size
+        index = np.fromfile(self._index_path, dtype=_INDEX_DTYPE, count=count)
+
+        #: keep the newest copy of each tile, newest first
+        _, newest = np.unique(index["key"][::-1], return_index=True)
+        keep = np.sort(count - 1 - newest)[::-1]
+        budget = int(self.max_bytes * 0.8)
+        keep = keep[np.cumsum(index["length"][keep].astype(np.int64)) <= budget][::-1]
+
+        logging.info("evicting %i tiles from the tile store", count - len(keep))
+
+        pack_tmp = self._pack_path.with_suffix(".tmp")
+        index_tmp = self._index_path.with_suffix(".idx.tmp")
+
+        with self._pack_path.open("rb") as source, pack_tmp.open("wb") as pack, index_tmp.open("wb") as index_file:
+            offset = 0
+            for record in index[keep]:
+                source.seek(int(record["offset"]))
+                pack.write(source.read(int(record["length"])))
+                index_file.write(_RECORD.pack(int(record["key"]), offset, int(record["length"])))
+                offset += int(record["length"])
+
+        self._close()
+        pack_tmp.replace(self._pack_path)
+        index_tmp.replace(self._index_path)
+        #: the sorted index could be the same size as the new index file
+        self._sorted_path.unlink(missing_ok=True)
+        self._open()
+
+
+class _FileLock:
+    """hold a thread lock and an exclusive flock on the lock file of the store"""
+
+    def __init__(self, lock, file):
+        self.lock = lock
+        self.file = file
+
+    def __enter__(self):
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        self.lock.acquire()
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.lock.release()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+cool_store_test.py
+A module that contains tests for the tile store module.
+"""
+
+from unittest import mock
+
+import numpy as np
+import pytest
+
+import cool
+import cool_store
+
+
+def test_tile_store_reads_tiles_after_reopening(tmp_path):
+    store = cool_store.TileStore(tmp_path)
+    store.put(20, 1, 2, b"first")
+    store.put(20, 2, 2, b"second")
+
+    assert store.get(20, 1, 2) == b"first"
+    assert store.get(20, 3, 2) is None
+
+    store.close()
+    store = cool_store.TileStore(tmp_path)
+
+    assert len(store) == 2
+    assert store.get(20, 1, 2) == b"first"
+    assert store.get(20, 2, 2) == b"second"
+    assert store.get(19, 1, 2) is None
+
+
+def test_tile_store_returns_the_newest_copy_of_a_tile(tmp_path):
+    store = cool_store.TileStore(tmp_path, mode=cool_store.RECORD)
+    store.put(20, 1, 2, b"old")
+    store.put(20, 1, 2, b"new")
+    store.close()
+
+    store = cool_store.TileStore(tmp_path)
+
+    assert store.get(20, 1, 2) == b"new"
+
+
+def test_tile_store_merges_recent_tiles_into_the_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(cool_store, "RECENT_TILES", 3)
+    store = cool_store.TileStore(tmp_path)
+
+    for col in [5, 1, 3, 1, 4, 2, 6]:
+        store.put(20, col, 0, f"{col}-{len(store)}".encode())
+
+    assert len(store._recent) == 1
+    assert store.get(20, 1, 0) == b"1-3"
+    assert store.get(20, 6, 0) == b"6-6"
+    assert [store.get(20, col, 0) for col in [2, 3, 4, 5]] == [b"2-5", b"3-2", b"4-4", b"5-0"]
+
+
+def test_tile_store_evicts_the_oldest_tiles(tmp_path):
+    store = cool_store.TileStore(tmp_path, max_bytes=100)
+
+    for col in range(10):
+        store.put(20, col, 0, bytes([col]) * 20)
+
+    assert (tmp_path / cool_store.PACK_FILE).stat().st_size <= 100
+    assert store.get(20, 0, 0) is None
+    assert store.get(20, 9, 0) == bytes([9]) * 20
+
+
+def test_tile_store_is_not_evicted_while_replaying(tmp_path):
+    store = cool_store.TileStore(tmp_path)
+
+    for col in range(10):
+        store.put(20, col, 0, bytes([col]) * 20)
+
+    store.close()
+    store = cool_store.TileStore(tmp_path, mode=cool_store.REPLAY, max_bytes=100)
+
+    assert len(store) == 10
+    assert store.get(20, 0, 0) == bytes([0]) * 20
+
+
+def test_stores_sharing_a_folder_append_to_the_end_of_the_pack(tmp_path):
+    first = cool_store.TileStore(tmp_path)
+    second = cool_store.TileStore(tmp_path)
+
+    first.put(20, 1, 2, b"AAAA")
+    second.put(20, 2, 2, b"BBBBBBBB")
+    first.put(20, 3, 2, b"CC")
+
+    assert second.get(20, 2, 2) == b"BBBBBBBB"
+    assert first.get(20, 3, 2) == b"CC"
+
+    first.close()
+    second.close()
+    store = cool_store.TileStore(tmp_path)
+
+    assert [store.get(20, col, 2) for col in [1, 2, 3]] == [b"AAAA", b"BBBBBBBB", b"CC"]
+
+
+def test_tiles_are_indexed_before_the_store_is_closed(tmp_path):
+    store = cool_store.TileStore(tmp_path)
+    store.put(20, 1, 2, b"tile")
+
+    #: a killed task never closes its store
+    reopened = cool_store.TileStore(tmp_path)
+
+    assert reopened.get(20, 1, 2) == b"tile"
+    assert isinstance(reopened._keys, np.memmap)
+
+
+def test_tile_store_rejects_unknown_modes(tmp_path):
+    with pytest.raises(ValueError):
+        cool_store.TileStore(tmp_path, mode="bogus")
+
+
+@mock.patch("cool.get_tile")
+def test_download_tiles_replays_from_the_tile_store(mock_get_tile, tmp_path, monkeypatch):
+    store = cool_store.TileStore(tmp_path)
+    for col, row in [(1, 2), (2, 2), (1, 3), (2, 3)]:
+        store.put(20, col, row, f"{col}_{row}".encode())
+    store.close()
+
+    monkeypatch.setenv("TILE_STORE", str(tmp_path))
+    monkeypatch.setenv("TILE_STORE_MODE", cool_store.REPLAY)
+    monkeypatch.setattr(cool, "TILE_STORE", None)
+
+    tiles = cool.download_tiles("1", "2", None)
+    missing = cool.download_tiles("5", "2", None)
+
+    assert tiles == [b"1_2", b"2_2", b"1_3", b"2_3"]
+    assert missing is None
+    mock_get_tile.assert_not_called()
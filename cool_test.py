@@ -5,17 +5,55 @@ cool_test.py
 A module that contains tests for the project module.
 """
 
+import multiprocessing
+import subprocess
+import sys
 from pathlib import Path
+from time import sleep
+from types import SimpleNamespace
 from unittest import mock
 
+import cv2
+import mercantile
+import numpy as np
+import pandas as pd
+import pyproj
 import pytest
 import requests
 
 import cool
+import cool_queue
 
 root = Path(__file__).parent / "test-data"
 
 
+def test_importing_cool_defers_the_heavy_dependencies():
+    heavy = ["torch", "cv2", "pandas", "sqlalchemy", "google.cloud.logging", "google.cloud.sql.connector"]
+    script = f"import json, sys; import cool; print(json.dumps([name for name in {heavy!r} if name in sys.modules]))"
+
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    assert output.stdout.strip() == "[]"
+
+    #: the cumulative microseconds spent importing cool and everything it imports
+    cumulative = [int(line.split("|")[1]) for line in output.stderr.splitlines() if line.rstrip().endswith("| cool")]
+
+    assert cumulative[0] < 1_000_000
+
+
+def test_get_pool_is_only_available_in_production(monkeypatch):
+    monkeypatch.delenv("PY_ENV", raising=False)
+
+    with pytest.raises(RuntimeError):
+        cool._get_pool()
+
+
 @mock.patch("cool.get_tile")
 @mock.patch("cool._get_secrets")
 def test_download_tiles_calls_get_tile_with_correct_urls(mock_get_secrets, mock_get_tile):
@@ -33,7 +71,77 @@ def test_download_tiles_calls_get_tile_with_correct_urls(mock_get_secrets, mock_
         mock.call("https://discover.agrc.utah.gov/login/path/test_string/tiles/utah/20/1/3"),
         mock.call("https://discover.agrc.utah.gov/login/path/test_string/tiles/utah/20/2/3"),
     ]
-    mock_get_tile.assert_has_calls(calls)
+    mock_get_tile.assert_has_calls(calls, any_order=True)
+
+
+@mock.patch("cool.get_tile")
+@mock.patch("cool._get_secrets")
+def test_download_tiles_downloads_the_mosaic_layout(mock_get_secrets, mock_get_tile, monkeypatch):
+    mock_get_secrets.return_value = {"QUAD_WORD": "test_string"}
+    mock_get_tile.side_effect = lambda url: mock.Mock(content=url.encode())
+    monkeypatch.setenv("MOSAIC_GRID", "3")
+
+    tiles = cool.download_tiles("1", "2", None)
+
+    assert [tile.decode().split("/20/")[1] for tile in tiles] == [
+        f"{col}/{row}" for row in range(2, 5) for col in range(1, 4)
+    ]
+
+    monkeypatch.setenv("MOSAIC_GRID", "2")
+    monkeypatch.setenv("MOSAIC_OVERLAP", "32")
+
+    assert len(cool.download_tiles("1", "2", None)) == 9
+
+    tiles = cool.download_tiles(3, 4, None, layout=cool.get_mosaic_layout(2, 0), zoom=19)
+
+    assert [tile.decode().split("/utah/")[1] for tile in tiles] == ["19/3/4", "19/4/4", "19/3/5", "19/4/5"]
+
+
+def test_get_mosaic_layout_reads_the_environment(monkeypatch):
+    layout = cool.get_mosaic_layout()
+
+    assert (layout.grid, layout.overlap, layout.tiles, layout.size) == (2, 0, 2, 512)
+    assert cool.get_inference_size(layout) == 640
+
+    monkeypatch.setenv("MOSAIC_GRID", "3")
+    monkeypatch.setenv("MOSAIC_OVERLAP", "64")
+    layout = cool.get_mosaic_layout()
+
+    assert (layout.grid, layout.overlap, layout.tiles, layout.size) == (3, 64, 4, 832)
+    assert cool.get_inference_size() == 1056
+
+    with pytest.raises(ValueError):
+        cool.get_mosaic_layout(2, -1)
+
+
+@mock.patch("cool.get_tile")
+@mock.patch("cool._get_secrets")
+def test_download_tiles_returns_none_when_any_tile_fails(mock_get_secrets, mock_get_tile):
+    mock_get_secrets.return_value = {"QUAD_WORD": "test_string"}
+    mock_get_tile.side_effect = lambda url: None if url.endswith("/2/3") else mock.Mock(content=b"tile")
+
+    assert cool.download_tiles("1", "2", None) is None
+
+
+@mock.patch("cool._get_retry_session")
+def test_get_session_is_reused(session_mock):
+    cool.SESSION = None
+
+    first = cool._get_session()
+    second = cool._get_session()
+
+    cool.SESSION = None
+
+    assert first is second
+    assert session_mock.call_count == 1
+
+
+@mock.patch("cool.download_tiles")
+def test_prefetch_tiles_keeps_row_order(mock_download):
+    mock_download.side_effect = lambda col, row, out_dir: [col, row]
+    rows = [SimpleNamespace(col_num=col, row_num=col + 1) for col in range(6)]
+
+    assert list(cool.prefetch_tiles(rows, 3)) == [(row, [row.col_num, row.row_num]) for row in rows]
 
 
 def test_build_mosaic_image():
@@ -54,6 +162,156 @@ def test_build_mosaic_image():
     assert actual_mosaic[384, 384, 1] == expected_mosaic[384, 384, 1]
 
 
+def test_build_mosaic_image_in_rgb_reuses_the_buffer():
+    test_data = ["1_2", "2_2", "1_3", "2_3"]
+    tiles = [(root / f"{name}.jpg").read_bytes() for name in test_data]
+    buffer = cool.acquire_mosaic_buffer()
+
+    bgr_mosaic = cool.build_mosaic_image(tiles, "1", "2", None)
+    rgb_mosaic = cool.build_mosaic_image(tiles, "1", "2", None, buffer=buffer, rgb=True)
+
+    assert rgb_mosaic is buffer
+    assert np.array_equal(rgb_mosaic, bgr_mosaic[:, :, ::-1])
+
+    cool.release_mosaic_buffer(buffer)
+
+    assert cool.acquire_mosaic_buffer() is buffer
+
+
+def test_assemble_mosaic_crops_the_overlap_tiles():
+    #: the tiles of each row are 1_2 and 2_2 then 1_3 and 2_3 and the third column and row repeat them
+    names = ["1_2", "2_2", "1_2", "1_3", "2_3", "1_3", "1_2", "2_2", "1_2"]
+    tiles = [(root / f"{name}.jpg").read_bytes() for name in names]
+    expected_mosaic = cool.convert_to_cv2_image((root / "1_2_mosaic.jpg").read_bytes())
+    layout = cool.get_mosaic_layout(2, 32)
+
+    mosaic = cool.assemble_mosaic(tiles, rgb=False, layout=layout)
+
+    assert mosaic.shape == (544, 544, 3)
+    assert np.array_equal(mosaic[:512, 512:], mosaic[:512, :32])
+    assert np.array_equal(mosaic[512:, :512], mosaic[:32, :512])
+    assert mosaic[384, 384, 1] == expected_mosaic[384, 384, 1]
+
+
+def test_assemble_mosaic_crops_the_offset_of_a_coarse_mosaic():
+    names = ["1_2", "2_2", "1_3", "2_3", "1_2", "2_2", "1_3", "2_3", "1_2"]
+    tiles = [(root / f"{name}.jpg").read_bytes() for name in names]
+    full = cool.assemble_mosaic(tiles, rgb=False, layout=cool.get_mosaic_layout(3)).copy()
+    coarse = cool.get_coarse_layout(197001, 394003, 1)
+
+    mosaic = cool.assemble_mosaic(tiles, rgb=False, layout=coarse)
+
+    assert (coarse.offset, coarse.tiles, coarse.size) == ((128, 128), 3, 512)
+    assert np.array_equal(mosaic, full[128:640, 128:640])
+
+
+def test_get_cascade_levels_reads_the_environment(monkeypatch):
+    assert cool.get_cascade_levels() == 0
+
+    monkeypatch.setenv("CASCADE_ZOOM", "18")
+
+    assert cool.get_cascade_levels() == 2
+    assert cool.get_coarse_layout(197004, 394000, 2).offset == (0, 0)
+    assert cool.get_coarse_layout(197004, 394000, 2).tiles == 2
+
+    with pytest.raises(ValueError):
+        cool.get_cascade_levels(20)
+
+
+def test_cascade_candidates_finds_the_mosaics_under_confident_detections():
+    results_df = pd.DataFrame(
+        [
+            #: inside the top-left mosaic
+            (10, 10, 40, 40, 0.5),
+            #: on the edge between the bottom mosaics, in zoom 20 pixels 500 to 520
+            (100, 250, 120, 260, 0.2),
+            (400, 10, 420, 40, 0.01),
+        ],
+        columns=["xmin", "ymin", "xmax", "ymax", "confidence"],
+    )
+
+    candidates = cool.cascade_candidates(results_df, 100, 200, 1, cool.get_mosaic_layout(), confidence=0.05, margin=0)
+
+    assert candidates == [(100, 200), (100, 202)]
+    assert cool.cascade_candidates(results_df, 100, 200, 1, confidence=0.01, margin=0) == [
+        (100, 200),
+        (102, 200),
+        (100, 202),
+    ]
+
+
+@mock.patch("cool.detect_fine")
+@mock.patch("cool.detect_coarse")
+def test_process_rows_cascade_only_refines_the_candidates(coarse_mock, fine_mock):
+    coarse_mock.side_effect = lambda col, row, levels, layout: (
+        None
+        if col == 9
+        else pd.DataFrame([(300, 300, 320, 320, 0.5)], columns=["xmin", "ymin", "xmax", "ymax", "confidence"])
+    )
+    fine_mock.side_effect = lambda col, row, layout, buffer: pd.DataFrame({"col": [col], "row": [row]})
+    writer = mock.Mock()
+
+    cool.process_rows_cascade([SimpleNamespace(col_num=1, row_num=2), SimpleNamespace(col_num=9, row_num=2)], writer, 1)
+
+    assert [call.args[:2] for call in fine_mock.call_args_list] == [(3, 4)]
+    writer.add.assert_called_once()
+    assert writer.add.call_args.args[:2] == (1, 2)
+    assert writer.add.call_args.args[2].to_dict("records") == [{"col": 3, "row": 4}]
+
+
+@mock.patch("cool.detect_fine")
+@mock.patch("cool.detect_coarse")
+def test_process_rows_cascade_leaves_rows_with_missing_imagery(coarse_mock, fine_mock):
+    coarse_mock.return_value = pd.DataFrame(
+        [(10, 10, 500, 500, 0.5)], columns=["xmin", "ymin", "xmax", "ymax", "confidence"]
+    )
+    fine_mock.side_effect = [pd.DataFrame({"confidence": [0.5]}), None, pd.DataFrame()]
+    writer = mock.Mock()
+
+    cool.process_rows_cascade([SimpleNamespace(col_num=1, row_num=2)], writer, 1)
+
+    assert fine_mock.call_count == 2
+    writer.add.assert_not_called()
+
+
+@mock.patch("cool.detect_fine")
+@mock.patch("cool.detect_coarse")
+def test_evaluate_cascade_reports_the_recall_of_each_threshold(coarse_mock, fine_mock):
+    coarse_mock.return_value = pd.DataFrame(
+        [(10, 10, 40, 40, 0.5), (300, 300, 320, 320, 0.1)], columns=["xmin", "ymin", "xmax", "ymax", "confidence"]
+    )
+    #: a tower in the top-left and bottom-right mosaics and a weak detection in the top-right mosaic
+    towers = {(100, 200): [0.9], (102, 200): [0.1], (100, 202): [], (102, 202): [0.6, 0.3]}
+    fine_mock.side_effect = lambda col, row, layout: pd.DataFrame({"confidence": towers[(col, row)]})
+
+    report = cool.evaluate_cascade([(100, 200)], 1, [0.05, 0.25], truth_confidence=0.25, margin=0)
+
+    assert [(run["refined"], run["towers_found"], run["recall"]) for run in report] == [(2, 3, 1.0), (1, 1, 1 / 3)]
+    assert report[1]["inference_ratio"] == 0.5
+    assert report[1]["download_ratio"] == (4 + 4) / 16
+
+
+def test_acquire_mosaic_buffer_drops_buffers_of_another_layout():
+    buffer = cool.acquire_mosaic_buffer()
+    cool.release_mosaic_buffer(buffer)
+
+    larger = cool.acquire_mosaic_buffer(cool.get_mosaic_layout(3))
+
+    assert larger.shape == (768, 768, 3)
+    assert cool.acquire_mosaic_buffer() is not buffer
+
+
+@mock.patch("cool.get_tile")
+@mock.patch("cool._get_secrets")
+def test_download_tiles_saves_the_original_tiles(mock_get_secrets, mock_get_tile, tmp_path):
+    mock_get_secrets.return_value = {"QUAD_WORD": "test_string"}
+    mock_get_tile.side_effect = lambda url: mock.Mock(content=url.encode())
+
+    tiles = cool.download_tiles("1", "2", tmp_path)
+
+    assert [(tmp_path / f"1_2_{i}.jpg").read_bytes() for i in range(4)] == tiles
+
+
 @pytest.mark.parametrize("input,expected", [("1_2_mosaic.jpg", 10), ("no_towers.jpg", 0)])
 def test_detect_towers_finds_correct_number_of_towers(input, expected):
     file_name = root / input
@@ -67,6 +325,51 @@ def test_detect_towers_finds_correct_number_of_towers(input, expected):
     assert len(results_df.index) == expected
 
 
+@pytest.mark.parametrize("input", ["1_2_mosaic.jpg", "no_towers.jpg"])
+def test_onnx_backend_matches_pytorch(input):
+    pytest.importorskip("onnxruntime")
+
+    if not cool.get_model_weight_path("onnx").is_file():
+        pytest.skip("the onnx weights have not been exported")
+
+    image = str(root / input)
+    expected = cool.configure_model(cool.load_pytorch_model("pytorch"))(image).pandas().xyxy[0]
+    actual = cool.configure_model(cool.load_pytorch_model("onnx"))(image).pandas().xyxy[0]
+
+    assert len(actual.index) == len(expected.index)
+
+    columns = ["xmin", "ymin", "xmax", "ymax"]
+    actual = actual.sort_values(by=columns, ignore_index=True)
+    expected = expected.sort_values(by=columns, ignore_index=True)
+
+    assert np.allclose(actual[columns], expected[columns], atol=1)
+    assert np.allclose(actual["confidence"], expected["confidence"], atol=0.01)
+
+
+def test_get_model_weight_path_uses_backend(monkeypatch):
+    monkeypatch.setenv("INFERENCE_BACKEND", "onnx")
+
+    assert cool.get_model_weight_path().name == "xl_250_best.onnx"
+    assert cool.get_model_weight_path("pytorch").name == "xl_250_best.pt"
+
+    with pytest.raises(ValueError):
+        cool.get_model_weight_path("tensorrt")
+
+
+@mock.patch("cool.subprocess.run")
+@mock.patch("cool.Path.is_file", return_value=True)
+def test_export_model_runs_yolov5_exporter(is_file_mock, run_mock):
+    paths = cool.export_model(("onnx", "torchscript"))
+
+    command = run_mock.call_args.args[0]
+
+    assert command[1].endswith("export.py")
+    assert command[command.index("--weights") + 1].endswith("xl_250_best.pt")
+    assert command[-3:] == ["--include", "onnx", "torchscript"]
+    assert "--dynamic" in command
+    assert [path.name for path in paths] == ["xl_250_best.onnx", "xl_250_best.torchscript"]
+
+
 @mock.patch("cool._get_retry_session")
 def test_get_tile_bad_url(session_mock):
     response_mock = mock.Mock()
@@ -77,3 +380,504 @@ def test_get_tile_bad_url(session_mock):
     response = cool.get_tile(url)
 
     assert response is None
+
+
+@mock.patch("cool.detect_towers")
+@mock.patch("cool.download_tiles")
+def test_process_rows_skips_prescreened_mosaics_but_marks_them_processed(download_mock, detect_mock, monkeypatch):
+    monkeypatch.setenv("PRESCREEN", "uniform")
+    blank = cool.convert_to_cv2_image((root / "1_2.jpg").read_bytes())
+    blank[:] = 255
+    _, tile = cv2.imencode(".jpg", blank)
+    download_mock.return_value = [tile.tobytes()] * 4
+    writer = mock.Mock()
+
+    cool.process_rows([SimpleNamespace(col_num=1, row_num=2)], writer)
+
+    detect_mock.assert_not_called()
+    writer.add.assert_called_once_with(1, 2)
+
+
+@mock.patch("cool._get_model")
+@mock.patch("cool.locate_results")
+@mock.patch("cool.detect_towers")
+@mock.patch("cool.download_tiles")
+def test_process_rows_forked_runs_rows_in_worker_processes(download_mock, detect_mock, locate_mock, model_mock):
+    tiles = [(root / f"{name}.jpg").read_bytes() for name in ["1_2", "1_3", "2_2", "2_3"]]
+    #: odd columns have imagery, the forked workers inherit these mocks
+    download_mock.side_effect = lambda col, row, out_dir: tiles if col % 2 else None
+    detect_mock.side_effect = lambda image, **kwargs: None if image is None else "results"
+    locate_mock.side_effect = lambda results, col, row: pd.DataFrame({"col": [col], "row": [row]})
+    rows = [SimpleNamespace(col_num=col, row_num=2) for col in range(1, 6)]
+    writer = mock.Mock()
+
+    processed = cool.process_rows_forked(rows, 2, writer, threads=1)
+
+    assert processed == 5
+    model_mock.assert_called_once()
+    assert sorted(call.args[0] for call in writer.add.call_args_list) == [1, 3, 5]
+
+    for call in writer.add.call_args_list:
+        assert call.args[2].to_dict("records") == [{"col": call.args[0], "row": 2}]
+
+
+def _acquire_after_init(results):
+    cool._init_inference_worker(1)
+
+    results.put([cool._SESSION_LOCK.acquire(timeout=5), cool.cool_metrics.METRICS._lock.acquire(timeout=5)])
+
+
+def test_inference_workers_replace_the_locks_held_while_forking():
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+
+    with cool._SESSION_LOCK, cool.cool_metrics.METRICS._lock:
+        process = context.Process(target=_acquire_after_init, args=(results,))
+        process.start()
+
+        acquired = results.get(timeout=30)
+
+    process.join()
+
+    assert acquired == [True, True]
+
+
+def test_get_inference_threads_divides_the_cpus(monkeypatch):
+    monkeypatch.delenv("INFERENCE_THREADS", raising=False)
+
+    with mock.patch("cool.cpu_count", return_value=8):
+        assert cool.get_inference_threads(2) == 4
+        assert cool.get_inference_threads(16) == 1
+
+        monkeypatch.setenv("INFERENCE_THREADS", "3")
+
+        assert cool.get_inference_threads(2) == 3
+
+
+@mock.patch("cool.release_mosaic_buffer")
+@mock.patch("cool.locate_results_batch")
+@mock.patch("cool.detect_towers_batch")
+@mock.patch("cool.build_mosaic_image")
+@mock.patch("cool.download_tiles")
+def test_process_rows_pipelined_runs_every_stage(
+    mock_download, mock_mosaic, mock_detect, mock_locate, mock_release, monkeypatch
+):
+    monkeypatch.setenv("DETECT_BATCH_SIZE", "2")
+    rows = [SimpleNamespace(col_num=col, row_num=2) for col in range(1, 11, 2)]
+    mock_detect.side_effect = lambda images, keys, **kwargs: [
+        (key, None if image is None else "results") for image, key in zip(images, keys)
+    ]
+    mock_mosaic.side_effect = lambda tiles, col, row, out_dir, **kwargs: None if col == 9 else "mosaic"
+    mock_locate.side_effect = lambda results, keys: [
+        (key, pd.DataFrame({"confidence": [0.5] * (key[0] % 3)})) for key in keys
+    ]
+    writer = mock.Mock()
+
+    workers = {"download": 3, "mosaic": 2, "detect": 1, "locate": 1, "persist": 2}
+    cool.process_rows_pipelined(rows, workers, writer, queue_size=1)
+
+    assert mock_download.call_count == 5
+    assert sum(len(call.args[0]) for call in mock_detect.call_args_list) == 5
+    assert all(len(call.args[0]) <= 2 for call in mock_detect.call_args_list)
+    assert sum(len(call.args[1]) for call in mock_locate.call_args_list) == 4
+    assert sorted(call.args[:2] for call in writer.add.call_args_list) == [(1, 2), (3, 2), (5, 2), (7, 2)]
+
+
+@mock.patch("cool._get_model")
+def test_detect_towers_batch_ties_results_to_keys(mock_get_model):
+    model = mock.Mock()
+    model.side_effect = lambda batch, size: mock.Mock(tolist=mock.Mock(return_value=[len(batch)] * len(batch)))
+    mock_get_model.return_value = model
+    image = np.zeros((512, 512, 3), dtype=np.uint8)
+
+    results = cool.detect_towers_batch([image, None, image, image], [(1, 2), (3, 2), (5, 2), (7, 2)], batch_size=2)
+
+    assert results == [((1, 2), 2), ((3, 2), None), ((5, 2), 2), ((7, 2), 1)]
+    assert model.call_count == 2
+    assert model.call_args.kwargs == {"size": 640}
+
+
+@mock.patch("cool.POOL")
+def test_get_rows_pages_after_the_last_row_on_new_connections(mock_pool):
+    conn = mock_pool.connect.return_value.__enter__.return_value
+    conn.execute.return_value.fetchall.side_effect = [
+        [SimpleNamespace(col_num=col, row_num=2) for col in (1, 3)],
+        [SimpleNamespace(col_num=col, row_num=row) for col, row in [(5, 2), (1, 4)]],
+        [SimpleNamespace(col_num=3, row_num=4)],
+    ]
+
+    rows = list(cool.get_rows("10", "5", page_size=2))
+
+    assert [(row.col_num, row.row_num) for row in rows] == [(1, 2), (3, 2), (5, 2), (1, 4), (3, 4)]
+    assert [call.args[1] for call in conn.execute.call_args_list] == [
+        {"limit": 2, "skip": 10},
+        {"limit": 2, "row_num": 2, "col_num": 3},
+        {"limit": 1, "row_num": 4, "col_num": 1},
+    ]
+    assert mock_pool.connect.call_count == 3
+
+
+@mock.patch("cool.POOL")
+def test_claim_rows_returns_rows_in_processing_order(mock_pool):
+    conn = mock_pool.connect.return_value.__enter__.return_value
+    conn.execute.return_value.fetchall.return_value = [
+        SimpleNamespace(col_num=3, row_num=2),
+        SimpleNamespace(col_num=1, row_num=4),
+        SimpleNamespace(col_num=1, row_num=2),
+    ]
+
+    rows = cool.claim_rows("alligator-1", 3, 600)
+
+    assert [(row.col_num, row.row_num) for row in rows] == [(1, 2), (3, 2), (1, 4)]
+    assert conn.execute.call_args.args[1] == {"worker": "alligator-1", "lease": 600, "take": 3}
+    assert "FOR UPDATE SKIP LOCKED" in str(conn.execute.call_args.args[0])
+    conn.commit.assert_called_once()
+
+
+@mock.patch("cool.claim_rows")
+def test_iter_claimed_rows_claims_chunks_until_the_limit(mock_claim_rows):
+    mock_claim_rows.side_effect = lambda worker, take, lease: [
+        SimpleNamespace(col_num=i, row_num=0) for i in range(take)
+    ]
+
+    rows = list(cool.iter_claimed_rows("alligator-1", 4, 600, limit=10))
+
+    assert len(rows) == 10
+    assert [call.args[1] for call in mock_claim_rows.call_args_list] == [4, 4, 2]
+
+
+@mock.patch("cool.claim_rows")
+def test_iter_claimed_rows_stops_when_no_rows_are_left(mock_claim_rows):
+    mock_claim_rows.side_effect = [[SimpleNamespace(col_num=1, row_num=2)], []]
+
+    rows = list(cool.iter_claimed_rows("alligator-1", 4, 600))
+
+    assert len(rows) == 1
+    assert mock_claim_rows.call_count == 2
+
+
+def test_claim_sizer_claims_the_target_seconds_of_work():
+    sizer = cool.ClaimSizer(10, target_seconds=60, lease_seconds=600, maximum=100)
+
+    assert sizer.size() == 10
+
+    sizer.observe(10, 20)
+
+    assert sizer.size() == 30
+
+    sizer.observe(10, 200)
+
+    assert sizer.seconds_per_row == pytest.approx(2 + 0.3 * 18)
+    assert sizer.size() == 8
+
+    sizer.observe(10, 0)
+
+    assert sizer.size() == 11
+
+
+def test_claim_sizer_keeps_claims_inside_the_lease_and_maximum():
+    sizer = cool.ClaimSizer(10, target_seconds=600, lease_seconds=60, maximum=20)
+
+    sizer.observe(1, 10)
+
+    assert sizer.size() == 3
+
+    sizer = cool.ClaimSizer(10, target_seconds=600, lease_seconds=60, maximum=20)
+    sizer.observe(100, 0.001)
+
+    assert sizer.size() == 20
+
+
+@mock.patch("cool.claim_rows")
+def test_iter_claimed_rows_sizes_chunks_from_the_time_per_row(mock_claim_rows):
+    mock_claim_rows.side_effect = lambda worker, take, lease: [
+        SimpleNamespace(col_num=i, row_num=0) for i in range(take)
+    ]
+    rows = cool.iter_claimed_rows("alligator-1", 2, 600, limit=20, target_seconds=0.2)
+
+    for _ in rows:
+        sleep(0.02)
+
+    first, second = [call.args[1] for call in mock_claim_rows.call_args_list][:2]
+
+    assert first == 2
+    assert 7 <= second <= 10
+
+
+@mock.patch("cool.claim_rows")
+def test_iter_claimed_rows_sizes_chunks_from_the_finished_rows(mock_claim_rows):
+    mock_claim_rows.side_effect = lambda worker, take, lease: [
+        SimpleNamespace(col_num=i, row_num=0) for i in range(take)
+    ]
+    finished = []
+    queued = []
+
+    #: like the prefetch, the rows are taken well before they finish
+    for row in cool.iter_claimed_rows("alligator-1", 2, 600, limit=40, target_seconds=0.2, completed=finished.__len__):
+        queued.append(row)
+
+        if len(queued) > 6:
+            sleep(0.02)
+            finished.append(queued.pop(0))
+
+    sizes = [call.args[1] for call in mock_claim_rows.call_args_list]
+
+    assert max(sizes) <= 12
+    assert 7 <= sizes[-2] <= 12
+
+
+@mock.patch("cool.claim_rows")
+def test_iter_claimed_rows_leaves_rows_with_an_expired_lease(mock_claim_rows):
+    mock_claim_rows.side_effect = lambda worker, take, lease: [
+        SimpleNamespace(col_num=i, row_num=0) for i in range(take)
+    ]
+    processed = []
+
+    for row in cool.iter_claimed_rows("alligator-1", 3, 0.05, limit=4):
+        processed.append(row.col_num)
+        sleep(0.06)
+
+    assert processed == [0, 0, 0, 0]
+    assert [call.args[1] for call in mock_claim_rows.call_args_list] == [3, 3, 2, 1]
+
+
+def test_estimate_completion_uses_the_job_rate():
+    assert cool.estimate_completion((0, 1000), (60, 900)) == (6000, 540)
+    assert cool.estimate_completion((0, 1000), (60, 1000)) == (0, None)
+
+
+@mock.patch("cool.count_remaining_rows")
+def test_log_progress_keeps_the_first_count(mock_count):
+    mock_count.side_effect = RuntimeError("no database")
+
+    assert cool._log_progress(None) is None
+
+    mock_count.side_effect = None
+    mock_count.return_value = 50
+    baseline = cool._log_progress(None)
+
+    assert baseline[1] == 50
+    assert cool._log_progress(baseline) == baseline
+
+
+@mock.patch("cool.save_processed_rows")
+def test_result_writer_flushes_when_full_and_on_close(mock_save):
+    mock_save.return_value = "SUCCESS"
+    writer = cool.ResultWriter(max_rows=2, max_seconds=60)
+    results_df = pd.DataFrame({"confidence": [0.5]})
+
+    writer.add(1, 2, results_df)
+    writer.add("3", "2", pd.DataFrame())
+    writer.add(5, 2)
+
+    assert mock_save.call_count == 1
+    assert mock_save.call_args.args == ([(1, 2), (3, 2)], [results_df], "cooling_tower_results")
+
+    writer.close()
+
+    assert mock_save.call_count == 2
+    assert mock_save.call_args.args == ([(5, 2)], [], "cooling_tower_results")
+
+
+@mock.patch("cool.save_processed_rows")
+def test_result_writer_flushes_old_rows(mock_save):
+    mock_save.return_value = "SUCCESS"
+    writer = cool.ResultWriter(max_rows=100, max_seconds=0.05)
+
+    writer.add(1, 2)
+    sleep(1.5)
+
+    assert mock_save.call_count == 1
+
+    writer.close()
+
+    assert mock_save.call_count == 1
+
+
+@mock.patch("cool.save_processed_rows")
+def test_result_writer_keeps_the_rows_of_a_failed_save(mock_save):
+    mock_save.side_effect = ["FAIL", "SUCCESS"]
+    writer = cool.ResultWriter(max_rows=1, max_seconds=60)
+    results_df = pd.DataFrame({"confidence": [0.5]})
+
+    writer.add(1, 2, results_df)
+    writer.add(3, 2)
+
+    assert mock_save.call_args.args == ([(1, 2), (3, 2)], [results_df], "cooling_tower_results")
+
+    writer.close()
+
+    assert mock_save.call_count == 2
+
+
+@mock.patch("cool.save_processed_rows")
+def test_result_writer_saves_directly_when_the_spool_fails(mock_save):
+    mock_save.return_value = "SUCCESS"
+    spool = mock.Mock()
+    spool.write.side_effect = OSError("disk full")
+    writer = cool.ResultWriter(max_rows=1, max_seconds=60, spool=spool)
+
+    writer.add(1, 2)
+    writer.close()
+
+    assert spool.write.call_args.args == ([(1, 2)], [])
+    assert mock_save.call_args.args == ([(1, 2)], [], "cooling_tower_results")
+    spool.close.assert_called_once()
+
+
+@mock.patch("cool.save_processed_rows")
+def test_result_writer_saves_the_detections_left_by_the_duplicate_filter(mock_save):
+    dedupe = mock.Mock()
+    dedupe.filter.return_value = None
+    writer = cool.ResultWriter(max_rows=1, max_seconds=60, dedupe=dedupe)
+
+    writer.add(1, 2, pd.DataFrame({"confidence": [0.5]}))
+    writer.close()
+
+    assert dedupe.filter.call_args.args[:2] == (1, 2)
+    assert mock_save.call_args.args == ([(1, 2)], [], "cooling_tower_results")
+
+
+@mock.patch("cool.POOL")
+def test_save_processed_rows_uses_one_transaction(mock_pool):
+    conn = mock_pool.begin.return_value.__enter__.return_value
+
+    with mock.patch("cool.write_results") as mock_write_results:
+        status = cool.save_processed_rows(
+            [(1, 2), (3, 2)], [pd.DataFrame({"confidence": [0.5]}), pd.DataFrame({"confidence": [0.2]})]
+        )
+
+    assert status == "SUCCESS"
+    assert len(mock_write_results.call_args.args[0].index) == 2
+    assert mock_write_results.call_args.args[1] is conn
+    assert conn.execute.call_args.args[1] == {"cols": [1, 3], "rows": [2, 2]}
+    mock_pool.begin.assert_called_once()
+
+
+@mock.patch("cool.POOL")
+def test_save_processed_rows_marks_the_queue_instead_of_the_index(mock_pool):
+    conn = mock_pool.begin.return_value.__enter__.return_value
+    queue = mock.Mock()
+
+    with mock.patch("cool.write_results") as mock_write_results:
+        assert cool.save_processed_rows([(1, 2)], [pd.DataFrame({"confidence": [0.5]})], queue=queue) == "SUCCESS"
+        assert cool.save_processed_rows([(3, 2)], [], queue=queue) == "SUCCESS"
+
+    mock_write_results.assert_called_once()
+    conn.execute.assert_not_called()
+    mock_pool.begin.assert_called_once()
+    assert queue.mark_done.call_args_list == [mock.call([(1, 2)]), mock.call([(3, 2)])]
+
+
+def test_iter_claimed_rows_claims_from_the_queue(tmp_path):
+    queue = cool_queue.WorkQueue.create(tmp_path / "queue.bin", [1, 2, 3], [4, 5, 6])
+
+    rows = list(cool.iter_claimed_rows("alligator-1", 2, 600, queue=queue))
+
+    assert [(row.col_num, row.row_num) for row in rows] == [(1, 4), (2, 5), (3, 6)]
+    assert queue.status()["leased"] == 3
+
+    queue.close()
+
+
+def test_copy_results_streams_csv_rows():
+    conn = mock.Mock()
+    conn.dialect.driver = "pg8000"
+    cursor = conn.connection.cursor.return_value
+    cursor.execute.side_effect = lambda sql, stream: setattr(cursor, "copied", stream.read())
+    results_df = pd.DataFrame({"confidence": [0.5, 0.25], "object_name": ["tower", "cooling, tower"]})
+
+    rows = cool.copy_results(results_df, conn)
+
+    assert rows == 2
+    assert cursor.execute.call_args.args[0] == (
+        'COPY cooling_tower_results ("confidence", "object_name") FROM STDIN WITH (FORMAT csv)'
+    )
+    assert cursor.copied == '0.5,tower\n0.25,"cooling, tower"\n'
+    cursor.close.assert_called_once()
+
+
+def test_copy_results_uses_the_psycopg2_copy_api():
+    conn = mock.Mock()
+    conn.dialect.driver = "psycopg2"
+    cursor = conn.connection.cursor.return_value
+    cursor.copy_expert.side_effect = lambda sql, data: setattr(cursor, "copied", data.read())
+
+    rows = cool.copy_results(pd.DataFrame({"confidence": [0.5]}), conn)
+
+    assert rows == 1
+    assert cursor.copy_expert.call_args.args[0].startswith('COPY cooling_tower_results ("confidence") FROM STDIN')
+    assert cursor.copied == "0.5\n"
+    cursor.execute.assert_not_called()
+
+
+@mock.patch("cool.copy_results")
+def test_write_results_inserts_with_drivers_that_can_not_copy(mock_copy_results):
+    conn = mock.Mock()
+    conn.dialect.driver = "pysqlite"
+    results_df = pd.DataFrame({"confidence": [0.5]})
+
+    with mock.patch.object(pd.DataFrame, "to_sql") as mock_to_sql:
+        cool.write_results(results_df, conn)
+
+    mock_copy_results.assert_not_called()
+    mock_to_sql.assert_called_once()
+
+
+@mock.patch("cool.copy_results")
+def test_write_results_selects_the_writer(mock_copy_results, monkeypatch):
+    conn = mock.Mock()
+    conn.dialect.driver = "pg8000"
+    results_df = pd.DataFrame({"confidence": [0.5]})
+
+    cool.write_results(results_df, conn)
+
+    mock_copy_results.assert_called_once_with(results_df, conn, "cooling_tower_results")
+
+    monkeypatch.setenv("RESULTS_WRITER", "insert")
+    with mock.patch.object(pd.DataFrame, "to_sql") as mock_to_sql:
+        cool.write_results(results_df, conn)
+
+    mock_to_sql.assert_called_once()
+    assert mock_copy_results.call_count == 1
+
+
+def _model_results(boxes):
+    """build an object that looks like a yolov5 result for the given xmin, ymin, xmax, ymax boxes"""
+    results_df = pd.DataFrame(boxes, columns=["xmin", "ymin", "xmax", "ymax"])
+    results_df["confidence"] = 0.5
+    results_df["class"] = 0
+    results_df["name"] = "tower"
+
+    return mock.Mock(pandas=mock.Mock(return_value=mock.Mock(xyxy=[results_df])))
+
+
+def test_locate_results_matches_mercantile_and_pyproj():
+    col, row = 198263, 394029
+    boxes = [[0, 0, 10, 10], [100.5, 200.25, 140.5, 230.75], [500, 500, 512, 512]]
+
+    results_df = cool.locate_results(_model_results(boxes), str(col), str(row))
+
+    tile = mercantile.ul(col, row, 20)
+    transformer = pyproj.Transformer.from_crs(4326, 3857, always_xy=True)
+    x, y = transformer.transform(tile.lng, tile.lat)
+    centroids = np.array([[(xmin + xmax) / 2, (ymin + ymax) / 2] for xmin, ymin, xmax, ymax in boxes])
+
+    assert np.allclose(results_df["centroid_x_3857"], x + centroids[:, 0] * 0.1492910708688, rtol=0, atol=1e-3)
+    assert np.allclose(results_df["centroid_y_3857"], y - centroids[:, 1] * 0.1492910708688, rtol=0, atol=1e-3)
+    assert list(results_df.columns[:4]) == ["envelope_x_min", "envelope_y_min", "envelope_x_max", "envelope_y_max"]
+
+
+def test_locate_results_batch_matches_locate_results():
+    keys = [(198263, 394029), (198265, 394029), (1, 2), (198263, 394031)]
+    boxes = [[[0, 0, 10, 10], [20, 30, 40, 50]], [], [[1, 1, 2, 2]], [[256, 256, 300, 300]]]
+
+    located = cool.locate_results_batch([_model_results(box) for box in boxes], keys)
+
+    assert [key for key, _ in located] == keys
+    assert located[1][1].empty
+
+    for (col, row), box, (_, results_df) in zip(keys, boxes, located):
+        expected = cool.locate_results(_model_results(box), col, row)
+
+        pd.testing.assert_frame_equal(results_df, expected)
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Build the `images_within_habitat` work index from the WMTS offset index and the processing footprint
+
+The footprint polygons are simplified, cut into small grid cells, and indexed with an STRtree so each test only
+looks at the few cells near a point. The offset index is read a chunk at a time and every chunk is tested at once
+with the vectorized shapely functions, then written to a parquet file or streamed into the database with COPY.
+
+The footprint is the GeoJSON geometry CSV from the README (`ogr2ogr ... footprints_in_4326.csv`) or a GeoJSON
+file in WGS84.
+
+Usage:
+    python build_habitat_index.py C:\\temp\\imagery_index.parquet footprints_in_4326.csv --out-file=habitat.parquet
+    python build_habitat_index.py imagery_index.parquet footprints_in_4326.csv --database-url=postgresql+pg8000://...
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import shapely
+from polars_build_offset_index import tile_lat, tile_lng
+
+#: test the upper left corner of the first tile, the point stored in the offset index
+POINT = "point"
+#: test the whole mosaic of `--grid` tiles that is processed for each index row
+TILE = "tile"
+PREDICATES = (POINT, TILE)
+
+SCHEMA = pa.schema([("row_num", pa.int32()), ("col_num", pa.int32())])
+
+
+def read_footprint(path):
+    """read the footprint polygons from a GeoJSON geometry CSV or a GeoJSON file
+
+    Args:
+        path (Path): the footprint file
+
+    Returns:
+        np.ndarray: the polygon geometries
+    """
+    path = Path(path)
+
+    if path.suffix.lower() == ".csv":
+        #: the footprint geometries are larger than the default csv field limit
+        csv.field_size_limit(sys.maxsize)
+
+        with path.open(newline="", encoding="utf-8") as footprint:
+            geometries = [shapely.from_geojson(record["geom"]) for record in csv.DictReader(footprint)]
+    else:
+        document = json.loads(path.read_text(encoding="utf-8"))
+        features = document["features"] if document.get("type") == "FeatureCollection" else [document]
+        geometries = [shapely.from_geojson(json.dumps(feature.get("geometry", feature))) for feature in features]
+
+    return np.asarray(geometries, dtype=object)
+
+
+def prepare_footprint(geometries, tolerance=0.0001, cell=0.05):
+    """simplify the footprint and cut it into grid cells so the tree can skip most of it for each point
+
+    Args:
+        geometries (np.ndarray): the footprint polygons
+        tolerance (float): the simplification tolerance in degrees, 0 to keep every vertex (optional)
+        cell (float): the width and height of the grid cells in degrees (optional)
+
+    Returns:
+        np.ndarray: the pieces of the footprint
+    """
+    geometries = shapely.make_valid(np.asarray(geometries, dtype=object))
+
+    if tolerance:
+        geometries = shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+    footprint = shapely.union_all(geometries)
+    west, south, east, north = footprint.bounds
+
+    xs = np.arange(west, east + cell, cell)
+    ys = np.arange(south, north + cell, cell)
+    x_min, y_min = (grid.ravel() for grid in np.meshgrid(xs[:-1], ys[:-1]))
+    cells = shapely.box(x_min, y_min, x_min + cell, y_min + cell)
+
+    #: only cut the cells the footprint touches
+    cells = cells[shapely.intersects(cells, footprint)]
+    pieces = shapely.get_parts(shapely.intersection(cells, footprint))
+    pieces = pieces[~shapely.is_empty(pieces) & (shapely.area(pieces) > 0)]
+
+    shapely.prepare(pieces)
+
+    return pieces
+
+
+def within_footprint(tree, batch, predicate=POINT, zoom=20, grid=2):
+    """test which index rows are in the footprint
+
+    Args:
+        tree (shapely.STRtree): the tree of the footprint pieces
+        batch (pa.RecordBatch): offset index rows with `col`, `row`, `lon`, and `lat` columns
+        predicate (str): `POINT` or `TILE` (optional)
+        zoom (int): the zoom level of the offset index (optional)
+        grid (int): the tiles on each side of the mosaics, the `MOSAIC_GRID` of the tasks (optional)
+
+    Returns:
+        np.ndarray: a mask of the rows in the footprint
+    """
+    if predicate == POINT:
+        geometries = shapely.points(batch.column("lon").to_numpy(), batch.column("lat").to_numpy())
+    else:
+        cols = batch.column("col").to_numpy()
+        rows = batch.column("row").to_numpy()
+        geometries = shapely.box(
+            tile_lng(cols, zoom), tile_lat(rows + grid, zoom), tile_lng(cols + grid, zoom), tile_lat(rows, zoom)
+        )
+
+    matches = tree.query(geometries, predicate="intersects")[0]
+    mask = np.zeros(len(geometries), dtype=bool)
+    mask[matches] = True
+
+    return mask
+
+
+def iter_habitat(index_file, pieces, predicate=POINT, zoom=20, chunk_size=1_000_000, grid=2):
+    """stream the offset index rows that are in the footprint
+
+    Args:
+        index_file (Path): the offset index parquet file
+        pieces (np.ndarray): the prepared footprint pieces
+        predicate (str): `POINT` or `TILE` (optional)
+        zoom (int): the zoom level of the offset index (optional)
+        chunk_size (int): the number of offset index rows tested at once (optional)
+        grid (int): the tiles on each side of the mosaics for the `TILE` predicate (optional)
+
+    Yields:
+        pa.RecordBatch: the `row_num` and `col_num` of the next chunk of habitat rows
+    """
+    if predicate not in PREDICATES:
+        raise ValueError(f"unknown predicate: {predicate}, expected one of {PREDICATES}")
+
+    tree = shapely.STRtree(pieces)
+    columns = ["col", "row"] if predicate == TILE else ["col", "row", "lon", "lat"]
+
+    for batch in pq.ParquetFile(index_file).iter_batches(batch_size=chunk_size, columns=columns):
+        batch = batch.filter(pa.array(within_footprint(tree, batch, predicate, zoom, grid)))
+
+        yield pa.record_batch(
+            [batch.column("row").cast(pa.int32()), batch.column("col").cast(pa.int32())], schema=SCHEMA
+        )
+
+
+def write_parquet(batches, out_file):
+    """write the habitat rows to a parquet file
+
+    Args:
+        batches (iterable): `row_num` and `col_num` record batches
+        out_file (Path): the parquet file
+
+    Returns:
+        int: the number of habitat rows
+    """
+    total = 0
+
+    with pq.ParquetWriter(out_file, SCHEMA, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            total += batch.num_rows
+
+    return total
+
+
+def copy_to_database(batches, database_url, table="images_within_habitat", truncate=False):
+    """stream the habitat rows into the work index table with COPY in a single transaction
+
+    Args:
+        batches (iterable): `row_num` and `col_num` record batches
+        database_url (str): the sqlalchemy url of the database
+        table (str): the work index table (optional)
+        truncate (bool): empty the table first (optional)
+
+    Returns:
+        int: the number of habitat rows
+    """
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+
+    engine = sqlalchemy.create_engine(database_url)
+    total = 0
+
+    with engine.begin() as conn:
+        if truncate:
+            conn.execute(sqlalchemy.text(f"TRUNCATE {table}"))
+
+        #: the raw pg8000 cursor shares the connection, and the transaction, of the sqlalchemy connection
+        cursor = conn.connection.cursor()
+
+        try:
+            for batch in batches:
+                data = io.BytesIO()
+                pa_csv.write_csv(batch, data, pa_csv.WriteOptions(include_header=False))
+                data.seek(0)
+
+                cursor.execute(f"COPY {table} (row_num, col_num) FROM STDIN WITH (FORMAT csv)", stream=data)
+                total += batch.num_rows
+        finally:
+            cursor.close()
+
+    engine.dispose()
+
+    return total
+
+
+def main():
+    """parse the arguments and write the habitat rows to a parquet file, a database, or both
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description="build the images_within_habitat work index")
+    parser.add_argument("index_file", help="the offset index parquet file from polars_build_offset_index.py")
+    parser.add_argument("footprint", help="the footprint GeoJSON geometry csv or GeoJSON file in WGS84")
+    parser.add_argument("--out-file", help="the habitat parquet file")
+    parser.add_argument("--database-url", help="the sqlalchemy url of a database to COPY the habitat rows into")
+    parser.add_argument("--truncate", action="store_true", help="empty the database table first")
+    parser.add_argument("--predicate", choices=PREDICATES, default=POINT, help="test the corner point or the mosaic")
+    parser.add_argument("--zoom", type=int, default=20, help="the zoom level of the offset index")
+    parser.add_argument("--grid", type=int, default=2, help="the MOSAIC_GRID the index was built for with --stride")
+    parser.add_argument("--tolerance", type=float, default=0.0001, help="the simplification tolerance in degrees")
+    parser.add_argument("--cell", type=float, default=0.05, help="the grid cell size the footprint is cut into")
+    parser.add_argument("--chunk-size", type=int, default=1_000_000, help="the index rows tested at once")
+    args = parser.parse_args()
+
+    if not args.out_file and not args.database_url:
+        parser.error("set --out-file, --database-url, or both")
+
+    start_time = time.time()
+
+    pieces = prepare_footprint(read_footprint(args.footprint), args.tolerance, args.cell)
+    print("Prepared {} footprint pieces: {:.2f}s".format(len(pieces), time.time() - start_time))
+
+    if args.out_file:
+        batches = iter_habitat(args.index_file, pieces, args.predicate, args.zoom, args.chunk_size, args.grid)
+        total = write_parquet(batches, args.out_file)
+        print("Wrote {:,} habitat rows to {}: {:.2f}s".format(total, args.out_file, time.time() - start_time))
+
+    if args.database_url:
+        #: the parquet file is already filtered so it is faster to copy from
+        if args.out_file:
+            batches = pq.ParquetFile(args.out_file).iter_batches(batch_size=args.chunk_size)
+        else:
+            batches = iter_habitat(args.index_file, pieces, args.predicate, args.zoom, args.chunk_size, args.grid)
+
+        total = copy_to_database(batches, args.database_url, truncate=args.truncate)
+        print("Copied {:,} habitat rows: {:.2f}s".format(total, time.time() - start_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+build_habitat_index_test.py
+A module that contains tests for the habitat work index builder.
+"""
+
+import csv
+import json
+
+import pyarrow.parquet as pq
+import pytest
+
+shapely = pytest.importorskip("shapely")
+
+import build_habitat_index as habitat  # pylint: disable=wrong-import-position
+import polars_build_offset_index as offset  # pylint: disable=wrong-import-position
+
+#: the upper left corners of the tiles 197000 to 197400 by 394000 to 394400 at zoom 20
+WEST, NORTH, EAST, SOUTH = -112.36541748046875, 40.77638178482896, -112.22808837890625, 40.6723059714534
+
+
+@pytest.fixture
+def index_file(tmp_path):
+    path = tmp_path / "imagery_index.parquet"
+    offset.build_index(path, (197000, 394000, 197400, 394400), rows_per_batch=10_000)
+
+    return path
+
+
+def test_read_footprint_reads_geojson_csv_and_feature_collections(tmp_path):
+    polygon = shapely.box(0, 0, 1, 1)
+    csv_file = tmp_path / "footprints_in_4326.csv"
+    geojson_file = tmp_path / "footprint.geojson"
+
+    with csv_file.open("w", newline="", encoding="utf-8") as footprint:
+        writer = csv.writer(footprint)
+        writer.writerow(["geom", "name"])
+        writer.writerow([shapely.to_geojson(polygon), "box"])
+
+    geojson_file.write_text(
+        json.dumps(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {"type": "Feature", "properties": {}, "geometry": json.loads(shapely.to_geojson(polygon))}
+                ],
+            }
+        ),
+        encoding="utf-8",
+    )
+
+    assert habitat.read_footprint(csv_file)[0].equals(polygon)
+    assert habitat.read_footprint(geojson_file)[0].equals(polygon)
+
+
+def test_prepare_footprint_cuts_the_footprint_into_cells():
+    polygon = shapely.Point(0, 0).buffer(0.1)
+
+    pieces = habitat.prepare_footprint([polygon], tolerance=0, cell=0.05)
+
+    assert len(pieces) == 16
+    assert shapely.union_all(pieces).symmetric_difference(polygon).area == pytest.approx(0, abs=1e-12)
+
+
+@pytest.mark.parametrize("predicate", habitat.PREDICATES)
+def test_iter_habitat_matches_a_brute_force_test(index_file, predicate):
+    footprint = shapely.Point((WEST + EAST) / 2, (NORTH + SOUTH) / 2).buffer(0.03)
+    pieces = habitat.prepare_footprint([footprint], tolerance=0, cell=0.01)
+
+    batches = list(habitat.iter_habitat(index_file, pieces, predicate, chunk_size=7_000))
+    found = {(row, col) for batch in batches for row, col in zip(*batch.to_pydict().values())}
+
+    index = pq.read_table(index_file).to_pydict()
+    expected = set()
+
+    for col, row, lon, lat in zip(index["col"], index["row"], index["lon"], index["lat"]):
+        if predicate == habitat.POINT:
+            geometry = shapely.Point(lon, lat)
+        else:
+            geometry = shapely.box(
+                offset.tile_lng([col], 20)[0],
+                offset.tile_lat([row + 2], 20)[0],
+                offset.tile_lng([col + 2], 20)[0],
+                offset.tile_lat([row], 20)[0],
+            )
+
+        if footprint.intersects(geometry):
+            expected.add((row, col))
+
+    assert len(batches) == 6
+    assert found == expected
+    assert 0 < len(found) < len(index["col"])
+
+
+def test_write_parquet_writes_the_work_index_columns(index_file, tmp_path):
+    pieces = habitat.prepare_footprint([shapely.box(WEST, SOUTH, EAST, NORTH)], tolerance=0)
+    out_file = tmp_path / "habitat.parquet"
+
+    total = habitat.write_parquet(habitat.iter_habitat(index_file, pieces), out_file)
+
+    assert total == 200 * 200
+    assert pq.read_schema(out_file).names == ["row_num", "col_num"]
+
+
+def test_within_footprint_tests_the_mosaic_of_the_grid():
+    batch = offset.pa.record_batch([offset.pa.array([197000]), offset.pa.array([394000])], names=["col", "row"])
+    #: a footprint inside the third column of tiles
+    west = offset.tile_lng([197002.25], 20)[0]
+    footprint = shapely.box(west, SOUTH, west + 0.0001, NORTH)
+    tree = shapely.STRtree(habitat.prepare_footprint([footprint], tolerance=0, cell=0.01))
+
+    assert not habitat.within_footprint(tree, batch, habitat.TILE, grid=2)[0]
+    assert habitat.within_footprint(tree, batch, habitat.TILE, grid=3)[0]
@@ -3,71 +3,198 @@
 Created on Tue Mar 21 09:21:49 2023
 
 @author: eneemann
+
+Build the WMTS offset index, the upper left corner of every `stride`th tile in a box, as a parquet file
+
+The columns and rows are generated with numpy and the corners use the closed form web mercator math of
+`mercantile.ul`. The longitude only depends on the column and the latitude only on the row so each is calculated
+once per column or row. The file is written a block of columns at a time so memory stays bounded.
+
+Usage:
+    python polars_build_offset_index.py --out-dir=C:\\temp
+    python polars_build_offset_index.py --bbox -114.05 36.99 -109.04 42.01 --zoom 20 --stride 2
 """
 
-import gc
+import argparse
+import math
 import time
 from pathlib import Path
 
-import mercantile
 import numpy as np
-import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+#: Utah WMTS tiling info at zoom 20
+#: total tiles = 14563 * 18898 = 275,211,574
+#: the index is built with every other tile, 275,211,574 / 4 = 68,802,893 points in the index
+UTAH_TILES = (192093, 389243, 206656, 408141)
 
-#: start timer and print start time
-start_time = time.time()
-readable_start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-print("The script start time is {}".format(readable_start))
+SCHEMA = pa.schema([("col", pa.int64()), ("row", pa.int64()), ("lon", pa.float64()), ("lat", pa.float64())])
 
-#: set up variables
-out_dir = r'C:\temp'
 
-#: Utah WMTS tiling info
-x_min = 192093
-x_max = 206656
-y_min = 389243
-y_max = 408141
-x_span = 14563
-y_span = 18898
+def tile_lng(cols, zoom):
+    """the longitude of the left edge of tiles, like `mercantile.ul(col, row, zoom).lng`
 
-#: total tiles = 14563 * 18898 = 275,211,574
-#: index will be built with every other tile
-#: 275,211,574 / 4 = 68,802,893 points in the index
-#: create list to hold values from min to max
-x_list = np.arange(x_min, x_max, 2)
-y_list = np.arange(y_min, y_max, 2)
-
-print("Building x/y indices ...")
-index_time = time.time()
-x_indices = []
-y_indices = []
-for x in x_list:
-    for y in y_list:
-        x_indices.append(x)
-        y_indices.append(y)
-
-print("Time elapsed building indices: {:.3f}s".format(time.time() - index_time))
-
-polars_time = time.time()
-dfpl = pl.DataFrame({'col': x_indices, 'row': y_indices})
-
-dfpl = dfpl.with_columns([
-    pl.struct(['col', 'row']).apply(lambda r: mercantile.ul(r['col'], r['row'], 20).lng).alias("lon"),
-    pl.struct(['col', 'row']).apply(lambda r: mercantile.ul(r['col'], r['row'], 20).lat).alias("lat"),
-    ])
-
-print("Time elapsed building dataframe: {:.3f}s".format(time.time() - polars_time))
-
-out_file = Path(out_dir).joinpath("imagery_index.parquet")
-write_time = time.time()
-dfpl.write_parquet(out_file)
-print("Time elapsed writing to zstd compressed parquet file: {:.3f}s".format(time.time() - write_time))
-
-del dfpl
-gc.collect()
-
-
-print("Script shutting down ...")
-#: stop timer and print end time
-readable_end = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-print("The script end time is {}".format(readable_end))
-print("Time elapsed: {:.2f}s".format(time.time() - start_time))
+    Args:
+        cols (np.ndarray): the tile columns
+        zoom (int): the zoom level
+
+    Returns:
+        np.ndarray: the longitudes
+    """
+    return np.asarray(cols, dtype=np.float64) / 2.0**zoom * 360.0 - 180.0
+
+
+def tile_lat(rows, zoom):
+    """the latitude of the top edge of tiles, like `mercantile.ul(col, row, zoom).lat`
+
+    Args:
+        rows (np.ndarray): the tile rows
+        zoom (int): the zoom level
+
+    Returns:
+        np.ndarray: the latitudes
+    """
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(rows, dtype=np.float64) / 2.0**zoom))))
+
+
+def bbox_to_tiles(west, south, east, north, zoom):
+    """the range of tiles covering a longitude and latitude box, like `mercantile.tile` for the corners
+
+    Args:
+        west (float): the minimum longitude
+        south (float): the minimum latitude
+        east (float): the maximum longitude
+        north (float): the maximum latitude
+        zoom (int): the zoom level
+
+    Returns:
+        tuple: the minimum column and row and the exclusive maximum column and row
+    """
+    scale = 2**zoom
+
+    def col(lng):
+        return int(math.floor((lng + 180.0) / 360.0 * scale))
+
+    def row(lat):
+        sin = math.sin(math.radians(lat))
+
+        return int(math.floor((0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * scale))
+
+    return col(west), row(north), col(east) + 1, row(south) + 1
+
+
+def iter_index_batches(tiles, zoom, stride, rows_per_batch=4_000_000):
+    """generate the index a block of columns at a time
+
+    the rows are ordered by column then row
+
+    Args:
+        tiles (tuple): the minimum column and row and the exclusive maximum column and row
+        zoom (int): the zoom level
+        stride (int): the step between the columns and rows in the index
+        rows_per_batch (int): about the number of index rows in each batch (optional)
+
+    Yields:
+        pa.RecordBatch: the next block of columns
+    """
+    x_min, y_min, x_max, y_max = tiles
+    cols = np.arange(x_min, x_max, stride, dtype=np.int64)
+    rows = np.arange(y_min, y_max, stride, dtype=np.int64)
+
+    if not len(cols) or not len(rows):
+        return
+
+    lons = tile_lng(cols, zoom)
+    lats = tile_lat(rows, zoom)
+    cols_per_batch = max(rows_per_batch // len(rows), 1)
+
+    for start in range(0, len(cols), cols_per_batch):
+        block = slice(start, start + cols_per_batch)
+        count = len(cols[block])
+
+        yield pa.record_batch(
+            [
+                np.repeat(cols[block], len(rows)),
+                np.tile(rows, count),
+                np.repeat(lons[block], len(rows)),
+                np.tile(lats, count),
+            ],
+            schema=SCHEMA,
+        )
+
+
+def build_index(out_file, tiles=UTAH_TILES, zoom=20, stride=2, rows_per_batch=4_000_000):
+    """write the index to a zstd compressed parquet file with a row group for each batch
+
+    Args:
+        out_file (Path): the parquet file
+        tiles (tuple): the minimum column and row and the exclusive maximum column and row (optional)
+        zoom (int): the zoom level (optional)
+        stride (int): the step between the columns and rows in the index (optional)
+        rows_per_batch (int): about the number of index rows in each row group (optional)
+
+    Returns:
+        int: the number of rows in the index
+    """
+    total = 0
+
+    with pq.ParquetWriter(out_file, SCHEMA, compression="zstd") as writer:
+        for batch in iter_index_batches(tiles, zoom, stride, rows_per_batch):
+            writer.write_batch(batch, row_group_size=batch.num_rows)
+            total += batch.num_rows
+
+    return total
+
+
+def main():
+    """parse the arguments and write the offset index parquet file
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description="build the WMTS offset index parquet file")
+    parser.add_argument("--out-dir", default=r"C:\temp", help="the folder for imagery_index.parquet")
+    parser.add_argument("--zoom", type=int, default=20, help="the WMTS zoom level")
+    parser.add_argument("--stride", type=int, default=2, help="the step between the columns and rows in the index")
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+        help="the longitude and latitude box to index instead of the Utah tiles",
+    )
+    parser.add_argument(
+        "--tiles",
+        type=int,
+        nargs=4,
+        metavar=("COL_MIN", "ROW_MIN", "COL_MAX", "ROW_MAX"),
+        default=UTAH_TILES,
+        help="the tiles to index, the maximums are exclusive",
+    )
+    parser.add_argument("--rows-per-group", type=int, default=4_000_000, help="the index rows in each row group")
+    args = parser.parse_args()
+
+    #: start timer and print start time
+    start_time = time.time()
+    readable_start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    print("The script start time is {}".format(readable_start))
+
+    tiles = bbox_to_tiles(*args.bbox, args.zoom) if args.bbox else tuple(args.tiles)
+    out_file = Path(args.out_dir).joinpath("imagery_index.parquet")
+
+    print("Building the index of {} every {} tiles ...".format(tiles, args.stride))
+    total = build_index(out_file, tiles, args.zoom, args.stride, args.rows_per_group)
+    print("Wrote {:,} points to {}".format(total, out_file))
+
+    #: stop timer and print end time
+    readable_end = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    print("The script end time is {}".format(readable_end))
+    print("Time elapsed: {:.2f}s".format(time.time() - start_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# * coding: utf8 *
+"""
+polars_build_offset_index_test.py
+A module that contains tests for the WMTS offset index builder.
+"""
+
+import mercantile
+import numpy as np
+import polars_build_offset_index as builder
+import pyarrow.parquet as pq
+import pytest
+
+
+def test_tile_corners_match_mercantile():
+    cols = np.array([0, 192093, 199999, 206655, 2**20 - 1])
+    rows = np.array([0, 389243, 400000, 408140, 2**20 - 1])
+
+    for col, row in zip(cols, rows):
+        corner = mercantile.ul(int(col), int(row), 20)
+
+        assert builder.tile_lng([col], 20)[0] == pytest.approx(corner.lng, abs=1e-9)
+        assert builder.tile_lat([row], 20)[0] == pytest.approx(corner.lat, abs=1e-9)
+
+
+def test_bbox_to_tiles_matches_mercantile():
+    north_west = mercantile.tile(-114.05, 42.01, 20)
+    south_east = mercantile.tile(-109.04, 36.99, 20)
+
+    assert builder.bbox_to_tiles(-114.05, 36.99, -109.04, 42.01, 20) == (
+        north_west.x,
+        north_west.y,
+        south_east.x + 1,
+        south_east.y + 1,
+    )
+
+
+def test_build_index_streams_row_groups_in_column_order(tmp_path):
+    out_file = tmp_path / "imagery_index.parquet"
+
+    total = builder.build_index(out_file, (10, 20, 15, 27), zoom=20, stride=2, rows_per_batch=8)
+
+    index = pq.ParquetFile(out_file)
+    table = index.read().to_pydict()
+    expected = [(col, row) for col in range(10, 15, 2) for row in range(20, 27, 2)]
+
+    assert total == len(expected) == 12
+    assert index.metadata.num_row_groups == 2
+    assert list(zip(table["col"], table["row"])) == expected
+    assert table["lon"][5] == pytest.approx(mercantile.ul(12, 22, 20).lng)
+    assert table["lat"][5] == pytest.approx(mercantile.ul(12, 22, 20).lat)